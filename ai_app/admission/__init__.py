@@ -0,0 +1,124 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from config import Config
+from registry import registry
+from metrics import metrics
+
+
+class Overloaded(Exception):
+    """
+    Limiter từ chối một việc vì hàng chờ đã đầy hoặc đã chờ quá lâu. `retry_after` là số giây
+    client nên chờ trước khi thử lại (header Retry-After của response 429).
+    """
+
+    def __init__(self, name: str, reason: str, retry_after: int):
+        super().__init__(f"{name} is overloaded ({reason}), retry after {retry_after}s")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Limiter:
+    """
+    Giới hạn số việc chạy đồng thời, với hàng chờ có giới hạn.
+
+    Tối đa `concurrency` việc giữ slot cùng lúc, các việc đến sau chờ theo thứ tự đến. Khi đã có
+    `max_queue` việc đang chờ, hoặc một việc chờ quá `queue_timeout` giây, việc đó bị từ chối bằng
+    Overloaded thay vì xếp hàng vô hạn làm mọi request cùng chậm. `concurrency` 0 là không giới hạn,
+    `max_queue` None là hàng chờ không giới hạn, `queue_timeout` 0/None là chờ không giới hạn.
+
+    Retry-After được ước tính từ thời gian giữ slot trung bình gần đây (EWMA) và độ dài hàng chờ.
+
+        async with limiter.slot():
+            ...
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: Optional[int] = None,
+                 queue_timeout: Optional[float] = None):
+        self.name = name
+        self._concurrency = max(0, concurrency)
+        self._semaphore = asyncio.Semaphore(self._concurrency) if self._concurrency else None
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout or None
+        self._active = 0
+        self._waiting = 0
+        self._hold_seconds = None
+
+    def retry_after(self) -> int:
+        hold = self._hold_seconds or self._queue_timeout or 1
+        return max(1, math.ceil(hold * (self._waiting + 1) / max(1, self._concurrency)))
+
+    def _reject(self, reason: str):
+        metrics.inc("admission_rejected_total", limiter=self.name, reason=reason)
+        raise Overloaded(self.name, reason, self.retry_after())
+
+    async def acquire(self, deadline: float = 0) -> None:
+        """Lấy một slot; `deadline` (epoch giây, 0 là không giới hạn) giới hạn thêm thời gian chờ trong hàng."""
+        if self._semaphore is None:
+            self._active += 1
+            return
+        start = time.perf_counter()
+        if not self._semaphore.locked():
+            # Còn slot trống thì lấy ngay, không qua wait_for: wait_for chạy acquire trong một task mới
+            # nên các request đến cùng lúc đều thấy slot còn trống
+            await self._semaphore.acquire()
+        else:
+            if self._max_queue is not None and self._waiting >= self._max_queue:
+                self._reject("queue_full")
+            timeout = self._queue_timeout
+            if deadline:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._reject("deadline")
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                metrics.observe("admission_queue_wait_seconds", time.perf_counter() - start, limiter=self.name)
+                self._reject("timeout")
+            finally:
+                self._waiting -= 1
+        self._active += 1
+        metrics.observe("admission_queue_wait_seconds", time.perf_counter() - start, limiter=self.name)
+
+    def release(self, held: float = None) -> None:
+        self._active -= 1
+        if held is not None:
+            self._hold_seconds = held if self._hold_seconds is None else 0.8 * self._hold_seconds + 0.2 * held
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self, deadline: float = 0):
+        """Giữ một slot cho tới khi thoát khỏi khối `async with`; raise Overloaded nếu bị từ chối."""
+        await self.acquire(deadline)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def status(self) -> Dict[str, Any]:
+        return {"concurrency": self._concurrency, "active": self._active, "waiting": self._waiting}
+
+
+def limiter(name: str) -> Limiter:
+    """
+    Limiter dùng chung trong process (mỗi worker của serve.py có limiter riêng):
+        chat        admission control trước mỗi lần chạy graph (ADMISSION_CONCURRENCY,
+                    ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT),
+        tên khác    lời gọi tới một upstream: openai, groq, serper, supabase (UPSTREAM_CONCURRENCY,
+                    UPSTREAM_QUEUE_TIMEOUT); upstream không được cấu hình không bị giới hạn.
+    """
+    def create() -> Limiter:
+        config = Config()
+        if name == "chat":
+            return Limiter(name, config.admission_concurrency, config.admission_max_queue,
+                           config.admission_queue_timeout)
+        return Limiter(name, config.upstream_concurrency.get(name, 0), None, config.upstream_queue_timeout)
+
+    return registry.get(f"limiter:{name}", create)
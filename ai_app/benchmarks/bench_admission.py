@@ -0,0 +1,145 @@
+"""
+Đo admission control và giới hạn theo upstream dưới một đợt request tăng vọt, với Supabase, Serper,
+Redis và LLM giả lập (FastAPI chạy trong process qua httpx.ASGITransport).
+
+    python benchmarks/bench_admission.py --requests 300
+    python benchmarks/bench_admission.py --requests 500 --admission 16 --max-queue 32 --capacity 30
+
+--requests POST /mobile/chat (nhánh web, chat_id khác nhau) được gửi cùng lúc. Nhà cung cấp LLM giả
+lập chỉ phục vụ --capacity lời gọi đồng thời mỗi provider (openai, groq), vượt quá thì trả lỗi 429.
+Các chế độ:
+    unbounded   không giới hạn (ADMISSION_CONCURRENCY=0, không có UPSTREAM_CONCURRENCY): mọi request
+                được nhận và gửi hết lời gọi LLM tới provider
+    limited     --admission request chạy cùng lúc, --max-queue request chờ tối đa --queue-timeout
+                giây, phần còn lại nhận 429 + Retry-After; lời gọi LLM tới mỗi provider tối đa
+                --upstream-concurrency
+
+In ra số request trả lời được (ok), trả lời lỗi/rỗng (degraded), bị từ chối (429), p50/p95 độ trễ
+của request ok, goodput (ok/giây), số lỗi 429 của provider, số vòng retry của grade_generation và
+số lời gọi LLM đồng thời cao nhất tới mỗi provider.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_suite import QUESTIONS, _percentile, _tables
+from benchmarks.fakes import FAST_TIER_MODEL, FakeChatModel, FakePostgREST, FakeRedisStore, FakeSerper, override_models
+
+LIMITERS = ("chat", "openai", "groq", "serper", "supabase")
+
+
+async def _bench(args):
+    from httpx import ASGITransport, AsyncClient
+    from admission import Limiter
+    from metrics import metrics
+    from registry import registry
+    import main
+
+    client = AsyncClient(transport=ASGITransport(app=main.app), base_url="http://bench", timeout=None)
+    capacity = {"openai": args.capacity, "groq": args.capacity}
+
+    async def one(payload):
+        start = time.perf_counter()
+        response = await client.post("/mobile/chat", json=payload)
+        latency = time.perf_counter() - start
+        if response.status_code == 429:
+            return "rejected", latency, int(response.headers.get("retry-after", 0))
+        body = response.json() if response.status_code == 200 else {}
+        ok = bool(body.get("result")) and not body.get("error")
+        return "ok" if ok else "degraded", latency, 0
+
+    results = {}
+    try:
+        for mode in args.modes:
+            registry.reset()
+            registry.override("redis_store", FakeRedisStore(latency=args.redis_latency))
+            override_models(registry, args.llm_latency, args.fast_latency, verdicts={"datasource": "web"},
+                            capacity=capacity)
+            if mode == "unbounded":
+                for name in LIMITERS:
+                    registry.override(f"limiter:{name}", Limiter(name, 0))
+            # Làm nóng client (supabase, httpx) trước khi đo
+            await one({"question": QUESTIONS["web"], "chat_id": f"warm-{uuid.uuid4()}", "profile_id": "me"})
+            metrics.reset()
+            FakeChatModel.reset_provider_stats()
+
+            payloads = [{"question": QUESTIONS["web"], "chat_id": f"spike-{uuid.uuid4()}", "profile_id": "me"}
+                        for _ in range(args.requests)]
+            start = time.perf_counter()
+            outcomes = await asyncio.gather(*(one(payload) for payload in payloads))
+            wall = time.perf_counter() - start
+            ok = [latency for outcome, latency, _ in outcomes if outcome == "ok"]
+            results[mode] = {
+                "ok": len(ok),
+                "degraded": sum(outcome == "degraded" for outcome, _, _ in outcomes),
+                "rejected": sum(outcome == "rejected" for outcome, _, _ in outcomes),
+                "retry_after": max((retry for _, _, retry in outcomes), default=0),
+                "p50": _percentile(ok, 50) if ok else 0,
+                "p95": _percentile(ok, 95) if ok else 0,
+                "goodput": len(ok) / wall,
+                "provider_429": sum(FakeChatModel.rejected.values()),
+                "retries": metrics.total("graph_retries_total"),
+                "peak": "/".join(f"{FakeChatModel.peak.get(name, 0)}" for name in ("openai", "groq")),
+            }
+    finally:
+        await client.aclose()
+    return results
+
+
+def main(args):
+    with FakePostgREST(_tables(), latency=args.supabase_latency) as supabase, \
+            FakeSerper(latency=args.serper_latency) as serper:
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+        os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "benchmark.service.role"
+        os.environ["SUPABASE_URL"] = supabase.url
+        os.environ["SERPER_URL"] = serper.url
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+        os.environ["SERPER_CACHE_REDIS"] = "false"
+        os.environ["SERPER_CACHE_SIZE"] = "0"
+        os.environ["ROUTER_LOCAL_ENABLED"] = "false"
+        os.environ["REQUEST_BUDGET"] = "0"
+        os.environ.setdefault("MODEL_FAST", FAST_TIER_MODEL)
+        os.environ["ADMISSION_CONCURRENCY"] = str(args.admission)
+        os.environ["ADMISSION_MAX_QUEUE"] = str(args.max_queue)
+        os.environ["ADMISSION_QUEUE_TIMEOUT"] = str(args.queue_timeout)
+        os.environ["UPSTREAM_CONCURRENCY"] = (f"openai={args.upstream_concurrency},groq={args.upstream_concurrency},"
+                                              f"serper=20,supabase=32")
+        # Các node in log cho từng request, ẩn đi để bảng kết quả dễ đọc
+        output = sys.stdout if args.verbose else io.StringIO()
+        with contextlib.redirect_stdout(output):
+            results = asyncio.run(_bench(args))
+
+    print(f"requests: {args.requests} at once, provider capacity: {args.capacity}, admission: {args.admission} "
+          f"(queue {args.max_queue}, {args.queue_timeout:g}s), upstream concurrency: {args.upstream_concurrency}")
+    print(f"{'mode':<10} {'ok':>5} {'degr':>5} {'429':>5} {'retry':>6} {'p50':>8} {'p95':>8} {'ok/s':>6} "
+          f"{'prov429':>8} {'retries':>8}  peak openai/groq")
+    for mode, row in results.items():
+        print(f"{mode:<10} {row['ok']:>5} {row['degraded']:>5} {row['rejected']:>5} {row['retry_after']:>5}s "
+              f"{row['p50']:>7.2f}s {row['p95']:>7.2f}s {row['goodput']:>6.1f} {row['provider_429']:>8} "
+              f"{row['retries']:>8.0f}  {row['peak']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Admission control and per-upstream limits under a request spike")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--modes", nargs="+", choices=["unbounded", "limited"], default=["unbounded", "limited"])
+    parser.add_argument("--capacity", type=int, default=40, help="Concurrent calls each fake LLM provider serves")
+    parser.add_argument("--admission", type=int, default=32, help="ADMISSION_CONCURRENCY of the limited mode")
+    parser.add_argument("--max-queue", type=int, default=64, help="ADMISSION_MAX_QUEUE of the limited mode")
+    parser.add_argument("--queue-timeout", type=float, default=5, help="ADMISSION_QUEUE_TIMEOUT of the limited mode")
+    parser.add_argument("--upstream-concurrency", type=int, default=40,
+                        help="UPSTREAM_CONCURRENCY for openai and groq in the limited mode")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per call of strong-tier models")
+    parser.add_argument("--fast-latency", type=float, default=0.08, help="Seconds per call of the fast-tier model")
+    parser.add_argument("--serper-latency", type=float, default=0.3)
+    parser.add_argument("--supabase-latency", type=float, default=0.01)
+    parser.add_argument("--redis-latency", type=float, default=0.002)
+    parser.add_argument("--verbose", action="store_true", help="Show the service's own log output")
+    main(parser.parse_args())
@@ -0,0 +1,133 @@
+"""
+So sánh /mobile/chat/batch với việc gọi /mobile/chat cho từng câu hỏi, với Supabase, Serper,
+Redis và LLM giả lập (FastAPI chạy trong process qua httpx.ASGITransport).
+
+    python benchmarks/bench_batch.py --requests 50
+    python benchmarks/bench_batch.py --requests 200 --modes concurrent batch
+
+Các chế độ, cùng --requests câu hỏi khác nhau theo nhánh web:
+    serial      lần lượt từng POST /mobile/chat (cách các job push notification/kiểm duyệt đang gọi)
+    concurrent  POST /mobile/chat song song, tối đa BATCH_CONCURRENCY request cùng lúc
+    batch       một POST /mobile/chat/batch: BATCH_CONCURRENCY graph cùng lúc, route và chấm tài
+                liệu được gộp thành lời gọi nhiều mục (LLMBatcher)
+
+In ra thời gian, requests/sec, số lời gọi LLM, token và chi phí ước tính mỗi request. Model giả
+lập trả lời mỗi lời gọi sau --llm-latency (tier strong) hoặc --fast-latency (tier fast) giây, cộng
+--item-latency giây cho mỗi mục của lời gọi nhiều mục.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_suite import _tables
+from benchmarks.fakes import FAST_TIER_MODEL, FakePostgREST, FakeRedisStore, FakeSerper, override_models
+
+
+def _payloads(count: int):
+    return [{"question": f"Quán cà phê hẹn hò số {i} ở Quận 1", "chat_id": f"batch-{uuid.uuid4()}", "profile_id": "me"}
+            for i in range(count)]
+
+
+async def _bench(args):
+    from httpx import ASGITransport, AsyncClient
+    from config import Config
+    from metrics import metrics
+    from registry import registry
+    import main
+
+    registry.reset()
+    registry.override("redis_store", FakeRedisStore(latency=args.redis_latency))
+    override_models(registry, args.llm_latency, args.fast_latency, verdicts={"datasource": "web"},
+                    item_latency=args.item_latency)
+    concurrency = Config().batch_concurrency
+    client = AsyncClient(transport=ASGITransport(app=main.app), base_url="http://bench", timeout=None)
+
+    async def single(payload) -> bool:
+        response = await client.post("/mobile/chat", json=payload)
+        return response.status_code == 200 and bool(response.json().get("result"))
+
+    async def serial(payloads):
+        return [await single(payload) for payload in payloads]
+
+    async def concurrent(payloads):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(payload):
+            async with semaphore:
+                return await single(payload)
+
+        return await asyncio.gather(*(one(payload) for payload in payloads))
+
+    async def batch(payloads):
+        response = await client.post("/mobile/chat/batch", json={"requests": payloads})
+        return [bool(item.get("result")) and not item.get("error") for item in response.json()["results"]]
+
+    modes = {"serial": serial, "concurrent": concurrent, "batch": batch}
+    results = {}
+    try:
+        # Làm nóng client (supabase, httpx) trước khi đo
+        await single(_payloads(1)[0])
+        for mode in args.modes:
+            metrics.reset()
+            start = time.perf_counter()
+            ok = await modes[mode](_payloads(args.requests))
+            wall = time.perf_counter() - start
+            results[mode] = {
+                "requests": len(ok),
+                "errors": len(ok) - sum(ok),
+                "seconds": wall,
+                "rps": len(ok) / wall,
+                "llm_calls": metrics.total("llm_request_duration_seconds") / len(ok),
+                "tokens": metrics.total("llm_tokens_total") / len(ok),
+                "cost": metrics.total("llm_cost_usd_total") / len(ok),
+            }
+    finally:
+        await client.aclose()
+    return results, concurrency
+
+
+def main(args):
+    with FakePostgREST(_tables(), latency=args.supabase_latency) as supabase, \
+            FakeSerper(latency=args.serper_latency) as serper:
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+        os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "benchmark.service.role"
+        os.environ["SUPABASE_URL"] = supabase.url
+        os.environ["SERPER_URL"] = serper.url
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+        os.environ["SERPER_CACHE_REDIS"] = "false"
+        os.environ["SERPER_CACHE_SIZE"] = "0"
+        os.environ["ROUTER_LOCAL_ENABLED"] = "false"
+        os.environ["REQUEST_BUDGET"] = "0"
+        os.environ.setdefault("MODEL_FAST", FAST_TIER_MODEL)
+        # Các node in log cho từng request, ẩn đi để bảng kết quả dễ đọc
+        output = sys.stdout if args.verbose else io.StringIO()
+        with contextlib.redirect_stdout(output):
+            results, concurrency = asyncio.run(_bench(args))
+
+    print(f"requests: {args.requests}, batch concurrency: {concurrency}")
+    print(f"{'mode':<11} {'n':>5} {'err':>4} {'seconds':>8} {'rps':>7} {'llm/req':>8} {'tok/req':>8} {'$/1k req':>9}")
+    for mode, row in results.items():
+        print(f"{mode:<11} {row['requests']:>5} {row['errors']:>4} {row['seconds']:>8.2f} {row['rps']:>7.1f} "
+              f"{row['llm_calls']:>8.2f} {row['tokens']:>8.0f} {row['cost'] * 1000:>9.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch endpoint vs one /mobile/chat call per question")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--modes", nargs="+", choices=["serial", "concurrent", "batch"],
+                        default=["serial", "concurrent", "batch"])
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per call of strong-tier models")
+    parser.add_argument("--fast-latency", type=float, default=0.08, help="Seconds per call of the fast-tier model")
+    parser.add_argument("--item-latency", type=float, default=0.01, help="Extra seconds per item of a packed call")
+    parser.add_argument("--serper-latency", type=float, default=0.3)
+    parser.add_argument("--supabase-latency", type=float, default=0.01)
+    parser.add_argument("--redis-latency", type=float, default=0.002)
+    parser.add_argument("--verbose", action="store_true", help="Show the service's own log output")
+    main(parser.parse_args())
@@ -0,0 +1,128 @@
+"""
+Benchmark tool get_friends với Supabase giả lập (benchmarks.fakes.FakePostgREST).
+
+    python benchmarks/bench_friends.py --friends 10 50 200 1000 --latency 0.005
+
+So sánh cách cũ (một truy vấn `profiles` cho mỗi bạn bè) với truy vấn `in` theo nhóm
+trong Chat._aget_profiles, rồi so sánh chạy lần lượt ba tool với ToolNode chạy chúng đồng thời
+khi model yêu cầu nhiều tool trong cùng một lượt. `--slow-tool` làm một tool bị treo để xem
+timeout riêng của tool (TOOL_TIMEOUT) và kết quả một phần.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakePostgREST
+
+
+def _tables(friend_count: int):
+    friends = [str(uuid.uuid4()) for _ in range(friend_count)]
+    profiles = [
+        {"id": profile_id, "full_name": f"User {i}", "avatar": None, "age": 20 + i % 20,
+         "gender": "female" if i % 2 else "male", "email": f"user{i}@example.com"}
+        for i, profile_id in enumerate(friends)
+    ]
+    return {"friends": [{"profile_id": "me", "friends": friends}], "profiles": profiles}
+
+
+def _n_plus_one(client, profile_id: str):
+    # Cách làm trước đây, giữ lại làm mốc so sánh
+    friends = client.table("friends").select("friends").eq("profile_id", profile_id).single().execute().data["friends"]
+    result = []
+    for friend_id in friends:
+        friend_info = client.table("profiles").select(
+            "id, full_name, avatar, age, gender, email").eq("id", friend_id).single().execute().data
+        friend_info["view_profile_link"] = f"nonegroup.io://profile/{friend_info['id']}?goBack=/chat"
+        result.append(friend_info)
+    return result
+
+
+def _tool_calls(profile_id: str):
+    from langchain_core.messages import AIMessage
+    names = ["get_user_info", "get_friends", "get_friend_request"]
+    return AIMessage(content="", tool_calls=[
+        {"name": name, "args": {"profile_id": profile_id}, "id": f"call_{i}"} for i, name in enumerate(names)
+    ])
+
+
+async def _sequential(tools, message):
+    return [await tools[call["name"]].ainvoke(call["args"]) for call in message.tool_calls]
+
+
+def main(friend_counts, latency: float, slow_tool: bool):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "benchmark.service.role"
+    from registry import registry
+
+    print(f"{'friends':>8} {'n+1':>10} {'requests':>9} {'batched':>10} {'requests':>9}")
+    for friend_count in friend_counts:
+        with FakePostgREST(_tables(friend_count), latency=latency) as fake:
+            os.environ["SUPABASE_URL"] = fake.url
+            registry.reset()
+            from tools import Chat
+            chat = Chat()
+            get_friends = {tool.name: tool for tool in chat.get_tools()}["get_friends"]
+            client = chat._supabase.get_client()
+
+            fake.requests = 0
+            start = time.perf_counter()
+            baseline = _n_plus_one(client, "me")
+            baseline_time, baseline_requests = time.perf_counter() - start, fake.requests
+
+            fake.requests = 0
+            start = time.perf_counter()
+            batched = asyncio.run(get_friends.ainvoke({"profile_id": "me"}))
+            batched_time, batched_requests = time.perf_counter() - start, fake.requests
+
+            assert [friend["id"] for friend in batched] == [friend["id"] for friend in baseline]
+            print(f"{friend_count:>8} {baseline_time * 1000:>8.1f}ms {baseline_requests:>9} "
+                  f"{batched_time * 1000:>8.1f}ms {batched_requests:>9}")
+
+    # Ba tool trong cùng một lượt: lần lượt so với ToolNode (đồng thời)
+    tables = _tables(max(friend_counts))
+    tables["profiles"].append({"id": "me", "full_name": "Me"})
+    tables["friend_request"] = [{"receiver_id": "me", "sender_id": profile["id"]} for profile in tables["profiles"][:10]]
+    with FakePostgREST(tables, latency=latency) as fake:
+        os.environ["SUPABASE_URL"] = fake.url
+        registry.reset()
+        from tools import Chat
+        chat = Chat()
+        tools = {tool.name: tool for tool in chat.get_tools()}
+        message = _tool_calls("me")
+
+        async def run():
+            start = time.perf_counter()
+            await _sequential(tools, message)
+            sequential_time = time.perf_counter() - start
+            start = time.perf_counter()
+            results = await chat.get_tool_node().ainvoke([message])
+            return sequential_time, time.perf_counter() - start, results
+
+        if slow_tool:
+            # get_friends và get_friend_request bị treo, get_user_info vẫn trả kết quả
+            async def hang(profile_ids):
+                await asyncio.sleep(3600)
+            chat._aget_profiles = hang
+        sequential_time, concurrent_time, results = asyncio.run(run())
+
+    print()
+    print(f"3 tools sequential : {sequential_time * 1000:>8.1f}ms")
+    print(f"3 tools concurrent : {concurrent_time * 1000:>8.1f}ms")
+    for result in results:
+        status = "error" if '"error"' in result.content else "ok"
+        print(f"  {result.name:<20} {status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark get_friends against a fake PostgREST")
+    parser.add_argument("--friends", type=int, nargs="+", default=[10, 50, 200, 1000])
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds per fake Supabase round-trip")
+    parser.add_argument("--slow-tool", action="store_true",
+                        help="Make the profile lookups hang to exercise TOOL_TIMEOUT and partial results")
+    args = parser.parse_args()
+    main(args.friends, args.latency, args.slow_tool)
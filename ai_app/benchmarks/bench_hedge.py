@@ -0,0 +1,102 @@
+"""
+Đo tác dụng của hedging (HedgedModel) lên độ trễ đuôi của lời gọi LLM, với model chính có
+một phần lời gọi rất chậm và model dự phòng giả lập.
+
+    python benchmarks/bench_hedge.py --calls 1000 --slow-rate 0.03 --slow-latency 4
+    python benchmarks/bench_hedge.py --max-rate 0.05 --percentile 90
+
+So sánh chỉ dùng model chính với hedge theo HEDGE_* (ghi đè bằng tham số dòng lệnh): p50/p95/p99,
+tỉ lệ hedge, số lần model dự phòng thắng, số lời gọi thêm và chi phí ước tính theo MODEL_PRICES.
+"""
+import argparse
+import asyncio
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeChatModel
+
+PRIMARY, SECONDARY = "chatgpt:gpt-4o-mini", "groq:llama-3.3-70b-versatile"
+
+
+def _percentile(values, percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+async def _run(model, calls: int, concurrency: int):
+    from langchain_core.messages import HumanMessage
+    from metrics import llm_metrics
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await model.ainvoke([HumanMessage(content=f"Câu hỏi số {i}")], config={"callbacks": [llm_metrics]})
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return latencies
+
+
+async def _bench(args):
+    from config import Config
+    from metrics import metrics
+    from models import HedgeBudget, HedgedModel
+
+    primary = FakeChatModel(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                            model_name=PRIMARY.partition(":")[2])
+    secondary = FakeChatModel(latency=args.secondary_latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                              model_name=SECONDARY.partition(":")[2])
+    hedged = HedgedModel(primary, secondary, HedgeBudget(Config()), PRIMARY, SECONDARY)
+
+    rows = []
+    for name, model in (("primary", primary), ("hedged", hedged)):
+        metrics.reset()
+        latencies = await _run(model, args.calls, args.concurrency)
+        rows.append((name, latencies, {
+            "fired": metrics.value("llm_hedges_total", model=PRIMARY, result="fired"),
+            "won": metrics.value("llm_hedges_total", model=PRIMARY, result="won"),
+            "capped": metrics.value("llm_hedges_total", model=PRIMARY, result="capped"),
+            "cost": metrics.total("llm_cost_usd_total"),
+        }))
+    return rows
+
+
+def main(args):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["HEDGE_PERCENTILE"] = str(args.percentile)
+    os.environ["HEDGE_MAX_RATE"] = str(args.max_rate)
+    os.environ["HEDGE_MIN_SAMPLES"] = str(args.min_samples)
+    os.environ["HEDGE_INITIAL_DELAY"] = str(args.initial_delay)
+    os.environ["HEDGE_MIN_DELAY"] = str(args.min_delay)
+    rows = asyncio.run(_bench(args))
+
+    print(f"primary {args.latency}s ({args.slow_rate:.0%} at {args.slow_latency}s), secondary {args.secondary_latency}s, "
+          f"p{args.percentile:g} threshold, max hedge rate {args.max_rate:.0%}")
+    print(f"{'mode':<8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'hedged':>7} {'won':>5} {'capped':>7} {'$/1k calls':>11}")
+    for name, latencies, stats in rows:
+        print(f"{name:<8} {_percentile(latencies, 50) * 1000:>7.0f}ms {_percentile(latencies, 95) * 1000:>7.0f}ms "
+              f"{_percentile(latencies, 99) * 1000:>7.0f}ms {max(latencies) * 1000:>7.0f}ms "
+              f"{stats['fired'] / len(latencies):>7.1%} {stats['won']:>5.0f} {stats['capped']:>7.0f} "
+              f"{stats['cost'] / len(latencies) * 1000:>11.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure LLM tail latency with and without hedging")
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3, help="Primary model seconds per call")
+    parser.add_argument("--secondary-latency", type=float, default=0.4)
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="Share of calls that hit the slow tail")
+    parser.add_argument("--slow-latency", type=float, default=4.0)
+    parser.add_argument("--percentile", type=float, default=95)
+    parser.add_argument("--max-rate", type=float, default=0.1)
+    parser.add_argument("--min-samples", type=int, default=20)
+    parser.add_argument("--initial-delay", type=float, default=2.0)
+    parser.add_argument("--min-delay", type=float, default=0.2)
+    main(parser.parse_args())
@@ -0,0 +1,67 @@
+"""
+So sánh hai cách lưu lịch sử chat trong RedisStore trên Redis thật (cần REDIS_* trong .env).
+
+    python benchmarks/bench_history.py --turns 1000 10000 --appends 200
+
+Với mỗi độ dài lịch sử, đo thời gian trung bình của một lần append (save_history) và
+một lần đọc 5 lượt gần nhất (như node history) cho chế độ "json" và "list".
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _store(mode: str):
+    os.environ["HISTORY_STORAGE"] = mode
+    os.environ["HISTORY_MAX_TURNS"] = "0"
+    os.environ["HISTORY_TTL"] = "0"
+    from database import RedisStore
+    return RedisStore()
+
+
+async def _prefill(store, mode: str, chat_id: str, turns: int):
+    if mode == "json":
+        await store.aredis.json().set(chat_id, "$", [{"question": f"q{i}", "answer": f"a{i}"} for i in range(turns)])
+    else:
+        await store.aredis.rpush(chat_id, *[store._encode_turn(f"q{i}", f"a{i}") for i in range(turns)])
+
+
+async def _bench(mode: str, turns: int, appends: int):
+    store = _store(mode)
+    chat_id = f"bench:history:{uuid.uuid4()}"
+    try:
+        await _prefill(store, mode, chat_id, turns)
+
+        start = time.perf_counter()
+        for i in range(appends):
+            await store.asave_history(chat_id, f"question {i}", f"answer {i}")
+        append = (time.perf_counter() - start) / appends
+
+        start = time.perf_counter()
+        for _ in range(appends):
+            await store.aget_history(chat_id, -5, -1)
+        read = (time.perf_counter() - start) / appends
+        return append, read
+    finally:
+        await store.aredis.delete(chat_id)
+
+
+async def main(turns_list, appends: int):
+    print(f"{'turns':>7} {'mode':>5} {'append':>10} {'read last 5':>12}")
+    for turns in turns_list:
+        for mode in ("json", "list"):
+            append, read = await _bench(mode, turns, appends)
+            print(f"{turns:>7} {mode:>5} {append * 1000:>8.2f}ms {read * 1000:>10.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chat history storage")
+    parser.add_argument("--turns", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--appends", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.appends))
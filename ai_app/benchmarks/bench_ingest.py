@@ -0,0 +1,139 @@
+"""
+Đo throughput của việc nạp hồ sơ vào index vector (ProfileIngestor) với Supabase, embedding
+và Redis giả lập.
+
+    python benchmarks/bench_ingest.py --profiles 100000
+    python benchmarks/bench_ingest.py --profiles 100000 --redis-url redis://localhost:6379/15
+
+Các lượt chạy liên tiếp trên cùng dữ liệu:
+    cold      index và cache embedding rỗng
+    rerun     không có gì thay đổi: không gọi API embedding, không ghi document
+    changed   --changed hồ sơ được sửa, chạy lại toàn bộ: chỉ các hồ sơ đó được embedding lại
+    since     như changed nhưng chỉ đọc các hồ sơ cập nhật sau mốc thời gian (--since)
+    rebuild   xoá index rồi nạp lại: embedding lấy hết từ cache
+
+Không có --redis-url thì dùng fakeredis (extra `test`). Với fakeredis, vector mặc định chỉ có
+256 chiều để dữ liệu vừa bộ nhớ; throughput chủ yếu phụ thuộc độ trễ API embedding giả lập
+(--embed-latency + --embed-per-text x số văn bản mỗi lô).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeEmbeddings, FakePostgREST, FakeVectorStore
+
+CITIES = ["Hà Nội", "Thành phố Hồ Chí Minh", "Đà Nẵng", "Huế", "Cần Thơ", "Hải Phòng", "Nha Trang"]
+INTERESTS = ["cà phê", "leo núi", "đọc sách", "du lịch", "nấu ăn", "chạy bộ", "âm nhạc", "phim ảnh", "yoga", "chụp ảnh"]
+
+
+def _profiles(count: int):
+    profiles = []
+    for i in range(count):
+        profile = {"id": f"p{i:08d}", "full_name": f"Người dùng {i}", "age": 18 + i % 30,
+                   "gender": random.choice(["male", "female"]), "email": f"user{i}@example.com",
+                   "updated_at": "2024-01-01T00:00:00Z"}
+        # Khoảng 1/10 hồ sơ chỉ có giới tính và tuổi, nội dung trùng nhau nên chỉ embedding một lần
+        if i % 10:
+            profile.update({
+                "location": random.choice(CITIES),
+                "bio": f"Mình là người {random.choice(['vui vẻ', 'trầm tính', 'năng động', 'lãng mạn'])}, thích gặp gỡ bạn mới.",
+                "interests": random.sample(INTERESTS, 3),
+            })
+        else:
+            profile["full_name"] = None
+        profiles.append(profile)
+    return profiles
+
+
+def _redis(url: str):
+    if url:
+        from redis.asyncio import Redis
+        return Redis.from_url(url)
+    try:
+        import fakeredis.aioredis
+    except ImportError:
+        sys.exit("fakeredis is not installed: pip install -e .[test], or pass --redis-url")
+    return fakeredis.aioredis.FakeRedis()
+
+
+async def _bench(args, supabase):
+    from database import SupabaseStore
+    from ingest import ProfileIngestor
+
+    redis = _redis(args.redis_url)
+    await redis.flushdb()
+    store = SimpleNamespace(aredis=redis, store=FakeVectorStore())
+    embeddings = FakeEmbeddings(dimensions=args.dimensions, latency=args.embed_latency, per_text=args.embed_per_text)
+    ingestor = ProfileIngestor(SupabaseStore(), store, embeddings)
+    profiles = supabase.tables["profiles"]
+
+    async def run(name: str, **kwargs):
+        requests = supabase.requests
+        report = await ingestor.arun(**kwargs)
+        report["supabase_requests"] = supabase.requests - requests
+        return name, report
+
+    results = [await run("cold")]
+    results.append(await run("rerun"))
+    for profile in random.sample(profiles, args.changed):
+        profile["bio"] = f"Hồ sơ đã cập nhật: thích {random.choice(INTERESTS)}."
+        profile["updated_at"] = "2024-06-01T00:00:00Z"
+    results.append(await run("changed"))
+    for profile in random.sample(profiles, args.changed):
+        profile["bio"] = f"Cập nhật lần hai: thích {random.choice(INTERESTS)}."
+        profile["updated_at"] = "2024-07-01T00:00:00Z"
+    results.append(await run("since", since="2024-07-01T00:00:00Z"))
+    async for key in redis.scan_iter(match="dating_app:*", count=1000):
+        await redis.delete(key)
+    results.append(await run("rebuild"))
+    await redis.aclose()
+    return results
+
+
+def main(args):
+    random.seed(args.seed)
+    rows = _profiles(args.profiles)
+    with FakePostgREST({"profiles": rows}, latency=args.supabase_latency) as supabase:
+        os.environ["SUPABASE_URL"] = supabase.url
+        os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "benchmark.service.role"
+        os.environ["INGEST_PAGE_SIZE"] = str(args.page_size)
+        os.environ["INGEST_CONCURRENCY"] = str(args.concurrency)
+        os.environ["EMBEDDING_BATCH_SIZE"] = str(args.batch_size)
+        output = sys.stdout if args.verbose else io.StringIO()
+        with contextlib.redirect_stdout(output):
+            results = asyncio.run(_bench(args, supabase))
+
+    print(f"profiles: {args.profiles}, page size: {args.page_size}, concurrency: {args.concurrency}, "
+          f"embedding batch: {args.batch_size}")
+    print(f"{'run':<8} {'read':>7} {'upserted':>9} {'unchanged':>10} {'embedded':>9} {'cache hit':>10} "
+          f"{'api calls':>10} {'pages':>6} {'seconds':>8} {'profiles/s':>11}")
+    for name, report in results:
+        print(f"{name:<8} {report['read']:>7} {report['upserted']:>9} {report['unchanged']:>10} {report['embedded']:>9} "
+              f"{report['embedding_cache_hits']:>10} {report['embedding_api_calls']:>10} {report['supabase_requests']:>6} "
+              f"{report['seconds']:>8.2f} {report['profiles_per_second']:>11.0f}")
+        if report["failed"]:
+            print(f"{name}: {report['failed']} profiles failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile ingestion throughput on offline stand-ins")
+    parser.add_argument("--profiles", type=int, default=100000)
+    parser.add_argument("--changed", type=int, default=1000, help="Profiles edited between runs")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4, help="Pages processed at once")
+    parser.add_argument("--batch-size", type=int, default=500, help="Texts per embedding API call")
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--embed-latency", type=float, default=0.2, help="Fixed seconds per embedding API call")
+    parser.add_argument("--embed-per-text", type=float, default=0.0005, help="Extra seconds per text in a call")
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--redis-url")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    main(parser.parse_args())
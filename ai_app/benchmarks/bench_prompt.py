@@ -0,0 +1,63 @@
+"""
+Đo số token ngữ cảnh của generate trước và sau ContextBuilder với kết quả Serper giả lập.
+
+    python benchmarks/bench_prompt.py --results 5 20 50 --duplicates 0.3 --budget 2000
+
+`raw` là cách format cũ (repr của list tài liệu và lịch sử), `built` là ngữ cảnh sau khi render gọn,
+bỏ trùng và cắt theo ngân sách. Khi không tải được bảng mã tiktoken (offline), số token là ước lượng.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import WebSearch
+
+
+def _places(count: int, duplicates: float):
+    places = []
+    for i in range(count):
+        if places and random.random() < duplicates:
+            # Cùng một địa điểm xuất hiện lại, chỉ khác số đánh giá
+            place = dict(random.choice(places))
+            place["reviewCount"] = place["reviewCount"] + 1
+        else:
+            place = {"title": f"Quán cà phê {i}", "address": f"{i} Nguyễn Huệ, Quận 1, Thành phố Hồ Chí Minh",
+                     "rating": round(3.5 + random.random() * 1.5, 1), "reviewCount": random.randint(10, 2000)}
+            if i % 3 == 0:
+                place["openingHours"] = "07:00 - 22:00"
+        places.append(place)
+    return places
+
+
+def main(counts, duplicates: float, budget: int, history_turns: int):
+    os.environ["GENERATE_CONTEXT_TOKENS"] = str(budget)
+    from context import ContextBuilder
+    builder = ContextBuilder()
+    question = "Gợi ý quán cà phê hẹn hò yên tĩnh ở Quận 1"
+    history = [{"question": f"Câu hỏi số {i} về địa điểm hẹn hò", "answer": "Bạn có thể thử một quán cà phê sân vườn. " * 5}
+               for i in range(history_turns)]
+
+    print(f"{'results':>8} {'kept':>5} {'raw':>7} {'built':>7} {'saved':>7} {'build':>9}")
+    for count in counts:
+        documents = [document.page_content for document in WebSearch._to_documents({"places": _places(count, duplicates)}, "maps")]
+        start = time.perf_counter()
+        _, _, report = builder.build(question, documents, history)
+        elapsed = time.perf_counter() - start
+        print(f"{count:>8} {report['documents_kept']:>5} {report['tokens_before']:>7} {report['tokens_after']:>7} "
+              f"{report['tokens_saved'] / (report['tokens_before'] or 1):>6.0%} {elapsed * 1000:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure generate prompt context tokens")
+    parser.add_argument("--results", type=int, nargs="+", default=[5, 10, 20, 50, 100])
+    parser.add_argument("--duplicates", type=float, default=0.3, help="Share of repeated places")
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--history-turns", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    main(args.results, args.duplicates, args.budget, args.history_turns)
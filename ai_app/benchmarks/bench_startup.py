@@ -0,0 +1,79 @@
+"""
+Đo thời gian khởi động lạnh của app (cần các biến môi trường thật trong .env).
+
+    python benchmarks/bench_startup.py --runs 5
+
+    python benchmarks/bench_startup.py --runs 5 --fake --llm-latency 0.4 --fast-latency 0.15
+
+Mỗi lần chạy là một process mới: đo thời gian `import main` (tới lúc uvicorn có thể nhận
+request), thời gian `flow.warm()` (tới lúc /ready trả về 200) và số lời gọi LLM mà warm-up gửi đi
+(mỗi lời gọi là một request trả phí, ở mỗi worker, mỗi lần khởi động). Chạy trên hai commit
+khác nhau để so sánh trước/sau.
+
+Với --fake, app là benchmarks.fake_app (Redis, Supabase, Serper và LLM giả lập như
+bench_workers.py) nên chạy được offline; độ trễ LLM lấy từ --llm-latency và --fast-latency.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+PROBE = """
+import asyncio, json, time
+start = time.perf_counter()
+import {module}
+import main
+from metrics import metrics
+imported = time.perf_counter()
+warm = getattr(main.flow, "warm", None)
+if warm:
+    asyncio.run(warm())
+ready = time.perf_counter()
+print(json.dumps({{"import": imported - start, "ready": ready - start,
+                  "llm_calls": metrics.total("llm_request_duration_seconds")}}))
+"""
+
+
+def _fake_env(args, supabase_url: str, serper_url: str):
+    from benchmarks.bench_workers import _env
+    return _env(argparse.Namespace(**vars(args), path="web"), supabase_url, serper_url)
+
+
+def _probe(runs: int, module: str, env=None):
+    imports, readies, calls = [], [], []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=APP_DIR, env=env,
+                                capture_output=True, text=True, check=True)
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        imports.append(result["import"])
+        readies.append(result["ready"])
+        calls.append(result["llm_calls"])
+
+    print(f"runs          : {runs}")
+    print(f"import main   : median {statistics.median(imports):.3f}s, max {max(imports):.3f}s")
+    print(f"ready (warm)  : median {statistics.median(readies):.3f}s, max {max(readies):.3f}s")
+    print(f"warm-up LLM   : {statistics.median(calls):.0f} calls per start")
+
+
+def main(args):
+    if not args.fake:
+        _probe(args.runs, "main")
+        return
+    from benchmarks.bench_suite import _tables
+    from benchmarks.fakes import FakePostgREST, FakeSerper
+    with FakePostgREST(_tables()) as supabase, FakeSerper() as serper:
+        _probe(args.runs, "benchmarks.fake_app", _fake_env(args, supabase.url, serper.url))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure app cold-start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--fake", action="store_true", help="Use benchmarks.fake_app (offline)")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="Fake LLM latency (seconds), with --fake")
+    parser.add_argument("--fast-latency", type=float, default=0.15, help="Fake fast-tier latency, with --fake")
+    main(parser.parse_args())
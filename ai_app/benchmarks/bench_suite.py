@@ -0,0 +1,227 @@
+"""
+Benchmark offline cho toàn bộ service, không gọi OpenAI/Serper/Supabase/Redis thật.
+
+    python benchmarks/bench_suite.py --requests 200 --concurrency 20
+    python benchmarks/bench_suite.py --save baseline.json
+    python benchmarks/bench_suite.py --baseline baseline.json --tolerance 0.2
+
+Mỗi nhánh của graph được chạy qua Flow.arun (lõi của Flow.run) và qua POST /mobile/chat
+(FastAPI chạy trong process qua httpx.ASGITransport), với:
+    - LLM giả lập (benchmarks.fakes.FakeChatModel) cho mọi model của ModelPolicy, có độ trễ cố định
+      (--llm-latency cho tier strong, --fast-latency cho tier fast) và verdict JSON theo kịch bản,
+    - Serper giả lập (FakeSerper) gọi qua WebSearch thật bằng SERPER_URL,
+    - Supabase giả lập (FakePostgREST) gọi qua client supabase thật,
+    - Redis thay bằng FakeRedisStore trong bộ nhớ.
+
+Các nhánh:
+    tools  route -> tools (get_friends)
+    web    route -> web -> grade_docs -> generate -> grade_generation (useful)
+    retry  như web nhưng grader hallucination luôn trả "no", graph lặp tới max retries
+
+Với --models tiered single, mỗi nhánh được chạy thêm với mọi node dùng model của tier strong
+(hậu tố @single) để so sánh độ trễ và chi phí của việc chia tier.
+
+In ra p50/p95/p99, requests/sec, số lần gọi LLM, token và chi phí ước tính (USD cho 1000 request,
+theo MODEL_PRICES) trên mỗi request. Với --baseline, thoát với mã 1 nếu p95 của nhánh nào chậm
+hơn baseline quá --tolerance.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FAST_TIER_MODEL, FakePostgREST, FakeRedisStore, FakeSerper, override_models
+
+QUESTIONS = {
+    "tools": "Cho tôi xem danh sách bạn bè",
+    "web": "Quán cà phê hẹn hò ở Quận 1",
+    "retry": "Quán cà phê hẹn hò ở Quận 1",
+}
+
+VERDICTS = {
+    "tools": {"datasource": "tools"},
+    "web": {"datasource": "web"},
+    "retry": {"datasource": "web", "hallucination": "no", "grounded": "no"},
+}
+
+
+def _percentile(values, percent: float) -> float:
+    # Nearest-rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def _tables():
+    friends = [f"friend-{i}" for i in range(20)]
+    return {
+        "friends": [{"profile_id": "me", "friends": friends}],
+        "profiles": [{"id": "me", "full_name": "Me"}] + [
+            {"id": friend_id, "full_name": f"User {i}", "avatar": None, "age": 20 + i, "gender": "female",
+             "email": f"user{i}@example.com"}
+            for i, friend_id in enumerate(friends)
+        ],
+        "friend_request": [{"receiver_id": "me", "sender_id": friend_id} for friend_id in friends[:5]],
+    }
+
+
+def _configure_env(args, supabase_url: str, serper_url: str):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "benchmark.service.role"
+    os.environ["SUPABASE_URL"] = supabase_url
+    os.environ["SERPER_URL"] = serper_url
+    os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+    os.environ["SERPER_CACHE_REDIS"] = "false"
+    os.environ["ROUTER_LOCAL_ENABLED"] = str(args.router_local)
+    os.environ["REQUEST_BUDGET"] = str(args.budget)
+    os.environ.setdefault("MODEL_FAST", FAST_TIER_MODEL)
+    if not args.serper_cache:
+        # Mỗi request đều đi tới Serper giả lập
+        os.environ["SERPER_CACHE_SIZE"] = "0"
+
+
+async def _run(send, path: str, total: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await send(QUESTIONS[path], f"bench-{uuid.uuid4()}")
+            except Exception as e:
+                print(f"{path}: {e}")
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += 0 if ok else 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return latencies, errors, time.perf_counter() - wall_start
+
+
+async def _bench(args):
+    from httpx import ASGITransport, AsyncClient
+    from config import Config
+    from metrics import metrics
+    from registry import registry
+    from workflow import Flow
+    import main
+
+    async def via_flow(question: str, chat_id: str) -> bool:
+        result = await main.flow.arun(question, chat_id, "me")
+        return bool(result.get("final_generation"))
+
+    client = AsyncClient(transport=ASGITransport(app=main.app), base_url="http://bench", timeout=None)
+
+    async def via_http(question: str, chat_id: str) -> bool:
+        response = await client.post("/mobile/chat", json={"question": question, "chat_id": chat_id, "profile_id": "me"})
+        return response.status_code == 200 and bool(response.json().get("result"))
+
+    config = Config()
+    results = {}
+    try:
+        for models in args.models:
+            # single: tier fast dùng cùng model với tier strong
+            os.environ["MODEL_FAST"] = config.model_strong if models == "single" else config.model_fast
+            registry.reset()
+            registry.override("redis_store", FakeRedisStore(latency=args.redis_latency))
+            main.flow = Flow()
+            for path in args.paths:
+                override_models(registry, args.llm_latency, args.fast_latency, verdicts=VERDICTS[path])
+                for target, send in (("flow", via_flow), ("http", via_http)):
+                    if target not in args.targets:
+                        continue
+                    # Làm nóng client (supabase, httpx) trước khi đo
+                    await send(QUESTIONS[path], f"warm-{uuid.uuid4()}")
+                    metrics.reset()
+                    latencies, errors, wall = await _run(send, path, args.requests, args.concurrency)
+                    key = f"{target}:{path}" + ("" if models == "tiered" else f"@{models}")
+                    results[key] = {
+                        "requests": len(latencies),
+                        "errors": errors,
+                        "p50": _percentile(latencies, 50),
+                        "p95": _percentile(latencies, 95),
+                        "p99": _percentile(latencies, 99),
+                        "rps": len(latencies) / wall,
+                        "llm_calls": metrics.total("llm_request_duration_seconds") / len(latencies),
+                        "tokens": metrics.total("llm_tokens_total") / len(latencies),
+                        "cost": metrics.total("llm_cost_usd_total") / len(latencies),
+                    }
+    finally:
+        await client.aclose()
+    return results
+
+
+def _print(results, baseline):
+    width = max([12] + [len(key) for key in results])
+    print(f"{'target:path':<{width}} {'n':>5} {'err':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>8} {'llm/req':>8} {'tok/req':>8}"
+          f" {'$/1k req':>9}" + (f" {'p95 Δ':>8}" if baseline else ""))
+    regressions = []
+    for key, row in results.items():
+        line = (f"{key:<{width}} {row['requests']:>5} {row['errors']:>4} {row['p50'] * 1000:>7.1f}ms {row['p95'] * 1000:>7.1f}ms "
+                f"{row['p99'] * 1000:>7.1f}ms {row['rps']:>8.1f} {row['llm_calls']:>8.1f} {row['tokens']:>8.0f}"
+                f" {row.get('cost', 0) * 1000:>9.4f}")
+        if baseline and key in baseline:
+            change = row["p95"] / baseline[key]["p95"] - 1
+            line += f" {change * 100:>+7.1f}%"
+            regressions.append((key, change))
+        print(line)
+    return regressions
+
+
+def main(args):
+    with FakePostgREST(_tables(), latency=args.supabase_latency) as supabase, \
+            FakeSerper(latency=args.serper_latency) as serper:
+        _configure_env(args, supabase.url, serper.url)
+        # Các node in log cho từng request, ẩn đi để bảng kết quả dễ đọc
+        output = sys.stdout if args.verbose else io.StringIO()
+        with contextlib.redirect_stdout(output):
+            results = asyncio.run(_bench(args))
+        print(f"serper requests: {serper.requests}, supabase requests: {supabase.requests}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = _print(results, baseline)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    failed = [key for key, change in regressions if change > args.tolerance]
+    if failed:
+        print(f"p95 regression over {args.tolerance:.0%}: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark per graph path")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per path and target")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--paths", nargs="+", choices=list(QUESTIONS), default=list(QUESTIONS))
+    parser.add_argument("--targets", nargs="+", choices=["flow", "http"], default=["flow", "http"])
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per call of strong-tier models")
+    parser.add_argument("--fast-latency", type=float, default=0.08, help="Seconds per call of the fast-tier model")
+    parser.add_argument("--models", nargs="+", choices=["tiered", "single"], default=["tiered"],
+                        help="single: every node on the strong-tier model")
+    parser.add_argument("--serper-latency", type=float, default=0.3)
+    parser.add_argument("--supabase-latency", type=float, default=0.01)
+    parser.add_argument("--redis-latency", type=float, default=0.002)
+    parser.add_argument("--budget", type=float, default=0, help="Per-request time budget in seconds (0 = unlimited)")
+    parser.add_argument("--router-local", action="store_true", help="Use the local router instead of scripted route verdicts")
+    parser.add_argument("--serper-cache", action="store_true", help="Keep the in-process Serper cache enabled")
+    parser.add_argument("--verbose", action="store_true", help="Show the service's own log output")
+    parser.add_argument("--save", help="Write results as JSON (use as a later --baseline)")
+    parser.add_argument("--baseline", help="JSON results to compare p95 against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 slowdown vs baseline (0.2 = 20%%)")
+    main(parser.parse_args())
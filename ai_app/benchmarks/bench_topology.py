@@ -0,0 +1,81 @@
+"""
+So sánh độ trễ của graph khi history và route chạy tuần tự hoặc song song (GRAPH_PARALLEL_ENTRY),
+trên nhánh tools và nhánh web, với LLM/Redis/Serper/Supabase giả lập.
+
+    python benchmarks/bench_topology.py --runs 20 --llm-latency 0.3 --redis-latency 0.02
+
+Chạy cả khi router cục bộ bật và tắt: khi tắt, route luôn tốn một lần gọi LLM và
+là lúc chạy song song với history có lợi nhất.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakePostgREST, FakeRedisStore, FakeWebSearch, override_models
+
+QUESTIONS = {
+    "tools": "Cho tôi xem danh sách bạn bè",
+    "web": "Quán cà phê hẹn hò ở Quận 1",
+}
+
+
+def _build_flow(path: str, parallel: bool, router_local: bool, args):
+    os.environ["GRAPH_PARALLEL_ENTRY"] = str(parallel)
+    os.environ["ROUTER_LOCAL_ENABLED"] = str(router_local)
+    os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+    from registry import registry
+    from tools import Chat
+    from workflow import Flow
+
+    registry.reset()
+    store = FakeRedisStore(latency=args.redis_latency)
+    store._summaries["chat:bench"] = "Người dùng đang tìm địa điểm hẹn hò ở Quận 1."
+    registry.override("redis_store", store)
+    override_models(registry, args.llm_latency, verdicts={"datasource": path})
+    registry.override("web_search", FakeWebSearch(latency=args.serper_latency))
+    registry.override("chat", Chat())
+    return Flow()
+
+
+async def _measure(flow, path: str, runs: int):
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await flow.arun(QUESTIONS[path], "bench", "me")
+        latencies.append(time.perf_counter() - start)
+    return statistics.mean(latencies)
+
+
+def main(args):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "benchmark.service.role"
+    tables = {
+        "friends": [{"profile_id": "me", "friends": ["f1", "f2"]}],
+        "profiles": [{"id": "f1", "full_name": "An"}, {"id": "f2", "full_name": "Bình"}],
+    }
+    with FakePostgREST(tables, latency=args.supabase_latency) as fake:
+        os.environ["SUPABASE_URL"] = fake.url
+        print(f"{'path':>6} {'router':>7} {'sequential':>11} {'parallel':>9} {'saved':>8}")
+        for path in ("tools", "web"):
+            for router_local in (False, True):
+                sequential = asyncio.run(_measure(_build_flow(path, False, router_local, args), path, args.runs))
+                parallel = asyncio.run(_measure(_build_flow(path, True, router_local, args), path, args.runs))
+                router = "local" if router_local else "llm"
+                print(f"{path:>6} {router:>7} {sequential * 1000:>9.1f}ms {parallel * 1000:>7.1f}ms "
+                      f"{(sequential - parallel) * 1000:>6.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare sequential and parallel history/route")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--redis-latency", type=float, default=0.02)
+    parser.add_argument("--serper-latency", type=float, default=0.3)
+    parser.add_argument("--supabase-latency", type=float, default=0.01)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,162 @@
+"""
+Đo throughput của serve.py theo số worker, với Supabase, Serper, Redis và LLM giả lập.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --requests 1000 --concurrency 64
+
+Với mỗi số worker: chạy `serve.py --app benchmarks.fake_app:app` trong process riêng, chờ tới khi
+/health của đủ các worker trả về 200 (thời gian "ready" gồm cả import, compile graph và warm-up),
+rồi gửi --requests request POST /mobile/chat (chat_id khác nhau) với --concurrency request đồng thời.
+In ra requests/sec, p50/p95 và số request mỗi worker đã xử lý (theo header X-Worker-Id).
+
+LLM và Serper giả lập chỉ chờ (asyncio.sleep), nên một worker bão hoà khi phần CPU của mỗi request
+(graph, pydantic, JSON, HTTP) chiếm hết một core; thêm worker chỉ tăng throughput khi máy có thêm
+core trống (xem `cpus` ở dòng đầu).
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from benchmarks.bench_suite import QUESTIONS, _percentile, _tables
+from benchmarks.fakes import FAST_TIER_MODEL, FakePostgREST, FakeSerper
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _env(args, supabase_url: str, serper_url: str):
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    env.setdefault("MODEL_FAST", FAST_TIER_MODEL)
+    env.update({
+        "SUPABASE_URL": supabase_url,
+        "SUPABASE_SERVICE_ROLE_KEY": "benchmark.service.role",
+        "SERPER_URL": serper_url,
+        "SERPER_CACHE_REDIS": "false",
+        "SERPER_CACHE_SIZE": "0",
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "ROUTER_LOCAL_ENABLED": "false",
+        "FAKE_LLM_LATENCY": str(args.llm_latency),
+        "FAKE_FAST_LATENCY": str(args.fast_latency),
+        "FAKE_DATASOURCE": args.path,
+    })
+    return env
+
+
+async def _wait_ready(url: str, workers: int, process: subprocess.Popen, timeout: float) -> float:
+    """Chờ tới khi thấy `workers` pid khác nhau trả lời /health với 200."""
+    start = time.perf_counter()
+    ready = set()
+    # Không giữ kết nối: mỗi lần hỏi là một kết nối mới, có thể rơi vào worker khác
+    limits = httpx.Limits(max_keepalive_connections=0)
+    async with httpx.AsyncClient(limits=limits, timeout=5) as client:
+        while len(ready) < workers:
+            if process.poll() is not None:
+                raise RuntimeError(f"serve.py exited with code {process.returncode}")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"only {len(ready)}/{workers} workers ready after {timeout}s")
+            try:
+                response = await client.get(f"{url}/health")
+                if response.status_code == 200:
+                    ready.add(response.json()["worker"])
+                    continue
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.05)
+    return time.perf_counter() - start
+
+
+async def _load(url: str, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, workers = [], Counter()
+    errors = 0
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        async def one():
+            nonlocal errors
+            payload = {"question": QUESTIONS[args.path], "chat_id": f"bench-{uuid.uuid4()}", "profile_id": "me"}
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(f"{url}/mobile/chat", json=payload)
+                    ok = response.status_code == 200 and bool(response.json().get("result"))
+                    workers[response.headers.get("x-worker-id")] += 1
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += 0 if ok else 1
+
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        wall = time.perf_counter() - wall_start
+    return latencies, errors, wall, workers
+
+
+def _run(workers: int, args, env):
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, "serve.py", "--app", "benchmarks.fake_app:app", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    output = None if args.verbose else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=output, stderr=output)
+    try:
+        ready = asyncio.run(_wait_ready(url, workers, process, args.ready_timeout))
+        latencies, errors, wall, per_worker = asyncio.run(_load(url, args))
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {
+        "ready": ready,
+        "errors": errors,
+        "rps": len(latencies) / wall,
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "per_worker": sorted(per_worker.values(), reverse=True),
+    }
+
+
+def main(args):
+    with FakePostgREST(_tables(), latency=args.supabase_latency) as supabase, \
+            FakeSerper(latency=args.serper_latency) as serper:
+        env = _env(args, supabase.url, serper.url)
+        results = {workers: _run(workers, args, env) for workers in args.workers}
+
+    print(f"cpus: {os.cpu_count()}, path: {args.path}, requests: {args.requests}, concurrency: {args.concurrency}")
+    print(f"{'workers':>7} {'ready':>7} {'err':>4} {'rps':>8} {'speedup':>8} {'p50':>9} {'p95':>9}  requests per worker")
+    base = results[args.workers[0]]["rps"]
+    for workers, row in results.items():
+        print(f"{workers:>7} {row['ready']:>6.2f}s {row['errors']:>4} {row['rps']:>8.1f} {row['rps'] / base:>7.2f}x "
+              f"{row['p50'] * 1000:>7.1f}ms {row['p95'] * 1000:>7.1f}ms  {'/'.join(map(str, row['per_worker']))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput of serve.py by worker count on offline stand-ins")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--path", choices=["web", "tools"], default="web")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--fast-latency", type=float, default=0.08)
+    parser.add_argument("--serper-latency", type=float, default=0.3)
+    parser.add_argument("--supabase-latency", type=float, default=0.01)
+    parser.add_argument("--ready-timeout", type=float, default=120)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--verbose", action="store_true", help="Show serve.py output")
+    main(parser.parse_args())
@@ -0,0 +1,117 @@
+"""
+Đánh giá offline bộ định tuyến cục bộ (router.LocalRouter).
+
+    python benchmarks/eval_router.py                       # leave-one-out trên seed.json + held-out
+    python benchmarks/eval_router.py --fit                 # fit ROUTER_TEMPERATURE trên leave-one-out
+    python benchmarks/eval_router.py --data labelled.jsonl # held-out là file JSON Lines khác
+
+Leave-one-out trên seed.json chỉ cho biết router nhớ bộ mẫu tốt đến đâu; con số quyết định việc bật
+ROUTER_LOCAL_ENABLED là precision trên bộ held-out (router/holdout.json: các câu hỏi viết lại, không
+có trong seed) ở ngưỡng ROUTER_CONFIDENCE_THRESHOLD, cần đạt --bar.
+
+Với mỗi tập và mỗi ngưỡng tin cậy in ra: tỉ lệ câu hỏi được quyết định cục bộ (phần còn lại sẽ gọi
+LLM), precision trên phần đó và số câu bị định tuyến sai. Độ tin cậy được hiệu chỉnh bằng
+ROUTER_TEMPERATURE và ROUTER_MIN_COVERAGE (hoặc --temperature, --min-coverage).
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from router import HOLDOUT_PATH, LocalRouter
+
+
+def _leave_one_out(examples):
+    # Mỗi câu được chấm bởi router huấn luyện trên các câu còn lại
+    return [(example["label"], *LocalRouter(examples[:index] + examples[index + 1:]).log_odds(example["text"]))
+            for index, example in enumerate(examples)]
+
+
+def _held_out(examples, data):
+    router = LocalRouter(examples)
+    return [(example["label"], *router.log_odds(example["text"])) for example in data]
+
+
+def _confidence(margin: float, coverage: float, temperature: float, min_coverage: float) -> float:
+    if coverage < min_coverage:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-margin / temperature))
+
+
+def _fit_temperature(scored) -> float:
+    # Nhiệt độ có negative log-likelihood nhỏ nhất trên các dự đoán leave-one-out
+    def nll(temperature):
+        total = 0.0
+        for label, predicted, margin, _ in scored:
+            confidence = _confidence(margin, 1.0, temperature, 0.0)
+            total -= math.log(max(confidence if label == predicted else 1.0 - confidence, 1e-12))
+        return total / len(scored)
+
+    return min((step / 10 for step in range(5, 201)), key=nll)
+
+
+def _report(name, scored, thresholds, temperature, min_coverage):
+    total = len(scored)
+    correct = sum(1 for label, predicted, _, _ in scored if label == predicted)
+    print(f"{name}: {total} examples, accuracy {correct / total:.3f}")
+    print(f"{'threshold':>9} {'coverage':>9} {'precision':>9} {'errors':>7}")
+    rows = {}
+    for threshold in thresholds:
+        decided = [(label, predicted) for label, predicted, margin, coverage in scored
+                   if _confidence(margin, coverage, temperature, min_coverage) >= threshold]
+        errors = sum(1 for label, predicted in decided if label != predicted)
+        precision = 1 - errors / len(decided) if decided else 0.0
+        rows[threshold] = precision
+        print(f"{threshold:>9.2f} {len(decided) / total:>9.3f} {precision:>9.3f} {errors:>7}")
+    print()
+    return rows
+
+
+def main(args):
+    config = Config()
+    examples = LocalRouter.load_examples()
+    with open(args.data or HOLDOUT_PATH, encoding="utf-8") as f:
+        data = [json.loads(line) for line in f if line.strip()] if args.data else json.load(f)
+
+    loo = _leave_one_out(examples)
+    held_out = _held_out(examples, data)
+    temperature = args.temperature or config.router_temperature
+    min_coverage = config.router_min_coverage if args.min_coverage is None else args.min_coverage
+    if args.fit:
+        temperature = _fit_temperature(loo)
+        print(f"fitted temperature: {temperature:.1f} (ROUTER_TEMPERATURE)")
+
+    router = LocalRouter(examples, temperature, min_coverage)
+    latencies = []
+    for example in data:
+        start = time.perf_counter()
+        router.predict(example["text"])
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"temperature {temperature:.1f}, min coverage {min_coverage:.2f}, "
+          f"latency mean {sum(latencies) / len(latencies) * 1e6:.1f}µs, "
+          f"p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6:.1f}µs")
+    print()
+
+    thresholds = sorted(set(args.thresholds) | {config.router_confidence_threshold})
+    _report("seed.json (leave-one-out)", loo, thresholds, temperature, min_coverage)
+    rows = _report(f"held-out ({args.data or 'router/holdout.json'})", held_out, thresholds, temperature, min_coverage)
+    precision = rows[config.router_confidence_threshold]
+    verdict = "meets" if precision >= args.bar else "is below"
+    print(f"held-out precision at {config.router_confidence_threshold:.2f}: {precision:.3f}, {verdict} the bar of {args.bar:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the local router")
+    parser.add_argument("--data", help="Held-out JSON Lines file with {\"text\", \"label\"} per line")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 0.95, 0.99])
+    parser.add_argument("--temperature", type=float, help="Override ROUTER_TEMPERATURE")
+    parser.add_argument("--min-coverage", type=float, help="Override ROUTER_MIN_COVERAGE")
+    parser.add_argument("--fit", action="store_true", help="Fit the temperature on the leave-one-out predictions")
+    parser.add_argument("--bar", type=float, default=0.99, help="Held-out precision required to enable the router")
+    main(parser.parse_args())
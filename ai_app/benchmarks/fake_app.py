@@ -0,0 +1,28 @@
+"""
+App của `main` với Redis và model giả lập, để chạy serve.py offline (benchmarks/bench_workers.py).
+
+    python serve.py --app benchmarks.fake_app:app --workers 4
+
+Mỗi worker import module này nên có Redis (fakeredis, trong extra `test`) và model giả lập riêng.
+Supabase và Serper giả lập chạy ở process benchmark, truyền vào qua SUPABASE_URL và SERPER_URL.
+Độ trễ và kịch bản đọc từ biến môi trường FAKE_LLM_LATENCY, FAKE_FAST_LATENCY, FAKE_REDIS_LATENCY
+và FAKE_DATASOURCE (web hoặc tools).
+"""
+import os
+import sys
+
+try:
+    import fakeredis.aioredis
+except ImportError:
+    sys.exit("fakeredis is not installed: pip install -e .[test]")
+
+from benchmarks.fakes import FakeRedisStore, override_models
+from registry import registry
+
+_store = FakeRedisStore(latency=float(os.getenv("FAKE_REDIS_LATENCY", 0.002)))
+_store.aredis = fakeredis.aioredis.FakeRedis()
+registry.override("redis_store", _store)
+override_models(registry, float(os.getenv("FAKE_LLM_LATENCY", 0.2)), float(os.getenv("FAKE_FAST_LATENCY", 0.08)),
+                verdicts={"datasource": os.getenv("FAKE_DATASOURCE", "web")})
+
+from main import app  # noqa: E402
@@ -0,0 +1,479 @@
+"""
+Các dịch vụ giả lập chạy cục bộ dùng cho benchmark, không cần mạng hay API key.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlparse
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Đầu mỗi mục trong prompt nhiều mục của LLMBatcher
+_BATCH_ITEM = re.compile(r"^### Mục (\d+)$", re.MULTILINE)
+
+
+def _parse_in(value: str):
+    # in.(a,"b,c") -> ["a", "b,c"]
+    values, current, quoted = [], "", False
+    for char in value[1:-1]:
+        if char == '"':
+            quoted = not quoted
+        elif char == "," and not quoted:
+            values.append(current)
+            current = ""
+        else:
+            current += char
+    if current:
+        values.append(current)
+    return values
+
+
+def _filter(rows, column: str, condition: str):
+    operator, _, value = condition.partition(".")
+    if operator == "eq":
+        return [row for row in rows if str(row.get(column)) == value]
+    if operator == "in":
+        values = set(_parse_in(value))
+        return [row for row in rows if str(row.get(column)) in values]
+    if operator == "gt":
+        return [row for row in rows if row.get(column) is not None and str(row.get(column)) > value]
+    if operator == "gte":
+        return [row for row in rows if row.get(column) is not None and str(row.get(column)) >= value]
+    return rows
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Backlog mặc định (5) làm rớt kết nối khi chạy đồng thời, gây các đỉnh trễ ~1s do SYN bị gửi lại
+    request_queue_size = 1024
+
+
+class _Server:
+    """Chạy một ThreadingHTTPServer trong thread nền, dùng với `with`."""
+
+    def __init__(self, handler, host: str = "127.0.0.1", port: int = 0):
+        # Giữ kết nối (keep-alive) như server thật để đo đúng chi phí của connection pool phía client
+        handler.protocol_version = "HTTP/1.1"
+        # Header và body được ghi riêng, tắt Nagle để tránh trễ ~40ms do delayed ACK
+        handler.disable_nagle_algorithm = True
+        self._server = _HTTPServer((host, port), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakePostgREST(_Server):
+    """
+    PostgREST tối giản cho supabase-py: GET /rest/v1/{table} với `select`, bộ lọc `eq.`/`in.`/`gt.`/`gte.`,
+    `order`, `offset`/`limit` và header `Accept: application/vnd.pgrst.object+json` của `.single()`.
+
+    Mỗi request chờ `latency` giây để mô phỏng một round-trip tới Supabase.
+    """
+
+    def __init__(self, tables: dict, latency: float = 0.005, **kwargs):
+        self.tables = tables
+        self.latency = latency
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake.requests += 1
+                # Đọc hết body (supabase-py có thể gửi "{}" kèm GET) để kết nối keep-alive không bị lệch
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(fake.latency)
+                parsed = urlparse(self.path)
+                table = parsed.path.rsplit("/", 1)[-1]
+                rows = fake.tables.get(table, [])
+                offset, limit, order, columns = 0, None, None, None
+                for key, value in parse_qsl(parsed.query):
+                    if key == "select":
+                        columns = [column.strip() for column in value.split(",")] if value != "*" else None
+                    elif key == "offset":
+                        offset = int(value)
+                    elif key == "limit":
+                        limit = int(value)
+                    elif key == "order":
+                        order = value
+                    else:
+                        rows = _filter(rows, key, value)
+
+                if order:
+                    column, _, direction = order.partition(".")
+                    rows = sorted(rows, key=lambda row: row.get(column), reverse=direction.startswith("desc"))
+                rows = rows[offset:offset + limit if limit is not None else None]
+                if columns:
+                    rows = [{column: row.get(column) for column in columns} for row in rows]
+
+                if "vnd.pgrst.object" in self.headers.get("Accept", ""):
+                    if len(rows) != 1:
+                        self._send(406, {"code": "PGRST116", "message": "JSON object requested, multiple (or no) rows returned"})
+                        return
+                    rows = rows[0]
+                self._send(200, rows)
+
+            def _send(self, status: int, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        super().__init__(Handler, **kwargs)
+
+
+class FakeSerper(_Server):
+    """
+    Serper giả lập: POST /maps trả về `results` địa điểm, POST /search trả về một answerBox.
+    Dùng với SERPER_URL để WebSearch thật (connection pool, retry, cache) gọi tới server này.
+    """
+
+    def __init__(self, latency: float = 0.3, results: int = 5, **kwargs):
+        self.latency = latency
+        self.results = results
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                fake.requests += 1
+                length = int(self.headers.get("Content-Length", 0))
+                query = json.loads(self.rfile.read(length) or b"{}").get("q", "")
+                time.sleep(fake.latency)
+                if self.path.rstrip("/").endswith("maps"):
+                    body = {"places": [
+                        {"title": f"Quán {i}", "address": f"{i} Nguyễn Huệ, Quận 1", "rating": 4.0 + i / 10,
+                         "reviewCount": 100 + i, "openingHours": "07:00 - 22:00"}
+                        for i in range(fake.results)
+                    ]}
+                else:
+                    body = {"answerBox": {"title": query, "snippet": f"Thông tin về {query}", "link": "https://example.com"}}
+                payload = json.dumps(body, ensure_ascii=False).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        super().__init__(Handler, **kwargs)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model giả lập, trả lời theo prompt mà các node gửi tới với độ trễ cố định.
+
+    `verdicts` ghi đè câu trả lời JSON cho router/grader, ví dụ {"datasource": "tools"} hoặc
+    {"score": ["no", "yes"]} (danh sách được dùng lần lượt, phần tử cuối lặp lại).
+    Khi được bind_tools, model trả về một tool call `tool_name` với profile_id trong prompt.
+    `model_name` được ghi vào metrics như model thật (giá theo MODEL_PRICES). Với `slow_rate`,
+    một phần lời gọi chậm `slow_latency` giây thay vì `latency` (độ trễ đuôi).
+    Prompt nhiều mục của LLMBatcher ("### Mục {id}") nhận {"results": [...]} với verdict cho từng
+    mục, chậm thêm `item_latency` giây mỗi mục (câu trả lời dài hơn).
+    Với `capacity`, nhà cung cấp `provider` (dùng chung giữa các model của nó) chỉ phục vụ chừng đó
+    lời gọi bất đồng bộ cùng lúc, lời gọi vượt quá nhận lỗi 429 như rate limit của provider thật
+    (đếm trong `rejected`, số lời gọi đồng thời cao nhất trong `peak`).
+    """
+    model_name: str = "fake"
+    latency: float = 0.05
+    slow_rate: float = 0.0
+    slow_latency: float = 0.0
+    item_latency: float = 0.0
+    verdicts: Dict[str, Any] = {}
+    answer: str = "Gợi ý cho bạn một vài địa điểm hẹn hò phù hợp."
+    tool_name: str = "get_friends"
+    tools_bound: bool = False
+    calls: Dict[str, int] = {}
+    provider: str = "fake"
+    capacity: int = 0
+    inflight: ClassVar[Dict[str, int]] = {}
+    peak: ClassVar[Dict[str, int]] = {}
+    rejected: ClassVar[Dict[str, int]] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def _verdict(self, key: str, default: str) -> str:
+        value = self.verdicts.get(key, default)
+        if isinstance(value, list):
+            index = self.calls.get(key, 0)
+            self.calls[key] = index + 1
+            return value[min(index, len(value) - 1)]
+        return value
+
+    @staticmethod
+    def _items(messages) -> List[str]:
+        text = "\n".join(str(message.content) for message in messages)
+        return _BATCH_ITEM.findall(text) if '"results"' in text else []
+
+    def _reply(self, messages) -> AIMessage:
+        text = "\n".join(str(message.content) for message in messages)
+        if self.tools_bound:
+            profile_id = text.split("profile_id của tôi là", 1)[-1].split()[0] if "profile_id của tôi là" in text else "me"
+            return AIMessage(content="", tool_calls=[{"name": self.tool_name, "args": {"profile_id": profile_id}, "id": "call_0"}])
+        items = self._items(messages)
+        if items:
+            return AIMessage(content=json.dumps({"results": [{"id": int(item), **self._verdicts(text)} for item in items]}))
+        content = self._verdicts(text)
+        if content is None:
+            return AIMessage(content=self.answer)
+        return AIMessage(content=json.dumps(content))
+
+    def _verdicts(self, text: str) -> Optional[Dict[str, Any]]:
+        if '"datasource"' in text:
+            content = {"datasource": self._verdict("datasource", "web")}
+        elif '"relevant"' in text:
+            content = {"relevant": self._verdict("relevant", "yes")}
+        elif '"grounded"' in text:
+            content = {"grounded": self._verdict("grounded", "yes"), "answers": self._verdict("answers", "yes")}
+        elif '"score"' in text and "explanation" in text:
+            content = {"score": self._verdict("hallucination", "yes"), "explanation": ""}
+        elif '"score"' in text:
+            content = {"score": self._verdict("score", "yes")}
+        elif '"type"' in text:
+            content = {"type": self._verdict("type", "maps")}
+        else:
+            return None
+        return content
+
+    def _result(self, messages) -> ChatResult:
+        message = self._reply(messages)
+        # Ước lượng ~4 ký tự một token để metrics token/chi phí có số liệu
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = len(str(message.content)) // 4
+        message.usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                  "total_tokens": input_tokens + output_tokens}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _delay(self, messages) -> float:
+        latency = self.slow_latency if self.slow_rate and random.random() < self.slow_rate else self.latency
+        return latency + self.item_latency * len(self._items(messages))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._delay(messages))
+        return self._result(messages)
+
+    @asynccontextmanager
+    async def _provider_slot(self):
+        inflight = FakeChatModel.inflight.get(self.provider, 0)
+        if self.capacity and inflight >= self.capacity:
+            FakeChatModel.rejected[self.provider] = FakeChatModel.rejected.get(self.provider, 0) + 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError(f"Error code: 429 - {self.provider} rate limit reached (fake capacity {self.capacity})")
+        FakeChatModel.inflight[self.provider] = inflight + 1
+        FakeChatModel.peak[self.provider] = max(FakeChatModel.peak.get(self.provider, 0), inflight + 1)
+        try:
+            yield
+        finally:
+            FakeChatModel.inflight[self.provider] -= 1
+
+    @classmethod
+    def reset_provider_stats(cls) -> None:
+        cls.peak.clear()
+        cls.rejected.clear()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        async with self._provider_slot():
+            await asyncio.sleep(self._delay(messages))
+            return self._result(messages)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async with self._provider_slot():
+            await asyncio.sleep(self._delay(messages))
+            message = self._reply(messages)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}
+                for call in message.tool_calls
+            ]))
+            return
+        for word in message.content.split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(word + " ", chunk=chunk)
+            yield chunk
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tools_bound": True})
+
+
+# Model tier fast mà các benchmark dùng khi chưa đặt MODEL_FAST, để tier fast khác tier strong
+# (mặc định của service là cùng một model ChatGPT)
+FAST_TIER_MODEL = "groq:llama-3.1-8b-instant"
+
+
+def override_models(registry, latency: float, fast_latency: float = None, verdicts: Dict[str, Any] = None,
+                    item_latency: float = 0.0, capacity: Dict[str, int] = None):
+    """
+    Thay mọi model của ModelPolicy (theo MODEL_FAST/MODEL_STRONG/MODEL_NODES hiện tại) bằng
+    FakeChatModel mang tên model thật; model của tier fast trễ `fast_latency` giây nếu có.
+    `capacity` giới hạn số lời gọi đồng thời theo nhà cung cấp, ví dụ {"openai": 40, "groq": 40}.
+    """
+    from models import ModelPolicy
+    policy = ModelPolicy()
+    for spec in policy.specs():
+        fast = spec == policy.tier("fast") and spec != policy.tier("strong")
+        model_latency = fast_latency if fast and fast_latency is not None else latency
+        model_name = spec.partition(":")[2] or spec
+        provider = ModelPolicy.provider(spec).upstream
+        limits = {"provider": provider, "capacity": (capacity or {}).get(provider, 0)}
+        registry.override(ModelPolicy.registry_key("llm", spec),
+                          FakeChatModel(latency=model_latency, model_name=model_name, **limits))
+        registry.override(ModelPolicy.registry_key("llm_json_model", spec),
+                          FakeChatModel(latency=model_latency, model_name=model_name, verdicts=verdicts or {},
+                                        item_latency=item_latency, **limits))
+
+
+class FakeRedisStore:
+    """
+    Thay thế RedisStore trong bộ nhớ cho các node (lịch sử, tóm tắt), mỗi thao tác chờ `latency` giây.
+    """
+
+    def __init__(self, latency: float = 0.002):
+        self.latency = latency
+        self._histories: Dict[str, List[dict]] = {}
+        self._summaries: Dict[str, Tuple[str, int]] = {}
+        self._turns: Dict[str, int] = {}
+        self.aredis = None
+        # Index vector rỗng: node store luôn chuyển sang web sau một lần tìm kiếm
+        self.store = FakeVectorStore(latency=latency)
+
+    async def aget_history(self, chat_id: str, start: int = 0, end: int = -1) -> List[dict]:
+        await asyncio.sleep(self.latency)
+        history = self._histories.get(chat_id, [])
+        return history[start:] if end == -1 else history[start:end + 1]
+
+    async def asave_history(self, chat_id: str, question: str, answer: str) -> None:
+        await asyncio.sleep(self.latency)
+        self._histories.setdefault(chat_id, []).append({"question": question, "answer": answer})
+        self._turns[chat_id] = self._turns.get(chat_id, 0) + 1
+
+    async def adelete_chat(self, chat_id: str) -> None:
+        self._histories.pop(chat_id, None)
+        self._summaries.pop(chat_id, None)
+        self._turns.pop(chat_id, None)
+
+    async def aget_summary(self, chat_id: str) -> Tuple[Optional[str], int, int]:
+        await asyncio.sleep(self.latency)
+        summary, through = self._summaries.get(chat_id, (None, 0))
+        return summary, through, self._turns.get(chat_id, 0)
+
+    async def asave_summary(self, chat_id: str, summary: str, through: int, expected: int) -> bool:
+        await asyncio.sleep(self.latency)
+        if self._summaries.get(chat_id, (None, 0))[1] != expected:
+            return False
+        self._summaries[chat_id] = (summary, through)
+        return True
+
+
+class FakeVectorStore:
+    """Thay thế RedisVectorStore cho node store: trả về `documents` (điểm 0.1) sau `latency` giây."""
+
+    def __init__(self, latency: float = 0.002, documents: List[str] = ()):
+        from types import SimpleNamespace
+        self.latency = latency
+        self.documents = list(documents)
+        self.config = SimpleNamespace(key_prefix="dating_app", content_field="text", embedding_field="embedding")
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs):
+        from langchain_core.documents import Document
+        await asyncio.sleep(self.latency)
+        return [(Document(page_content=text), 0.1) for text in self.documents[:k]]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs):
+        from langchain_core.documents import Document
+        time.sleep(self.latency)
+        return [(Document(page_content=text), 0.1) for text in self.documents[:k]]
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Embedding giả lập: vector `dimensions` chiều xác định theo nội dung, mỗi lần gọi chờ
+    `latency` + `per_text` x số văn bản giây (gần với độ trễ của API embedding theo lô).
+    """
+
+    def __init__(self, dimensions: int = 1536, latency: float = 0.2, per_text: float = 0.0005):
+        self.model = "fake-embedding"
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_text = per_text
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha1(text.encode()).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency + self.per_text * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        await asyncio.sleep(self.latency + self.per_text * len(texts))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeWebSearch:
+    """Thay thế WebSearch: trả về `results` địa điểm giả sau `latency` giây."""
+
+    def __init__(self, latency: float = 0.3, results: int = 5):
+        self.latency = latency
+        self.results = results
+
+    async def aserper_search(self, query: str, type_search: str):
+        from langchain_core.documents import Document
+        await asyncio.sleep(self.latency)
+        return [
+            Document(page_content=f"Tên địa điểm: Quán {i}\nĐịa chỉ: {i} Nguyễn Huệ, Quận 1\nĐánh giá: 4.{i} sao")
+            for i in range(self.results)
+        ]
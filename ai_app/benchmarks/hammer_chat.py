@@ -0,0 +1,138 @@
+"""
+Bắn nhiều request đồng thời vào cùng một chat, qua nhiều "worker" (mỗi worker một Flow riêng,
+dùng chung một Redis), rồi kiểm tra việc gộp request trùng và xếp hàng các lượt.
+
+    python benchmarks/hammer_chat.py --workers 4 --questions 5 --duplicates 4
+    python benchmarks/hammer_chat.py --redis-url redis://localhost:6379/15   # Redis thật
+    python benchmarks/hammer_chat.py --no-coordination                       # để so sánh
+
+Không có --redis-url thì dùng fakeredis (extra `test`, không phải dependency của app).
+Kiểm tra:
+    - số lần chạy graph bằng số câu hỏi khác nhau (request trùng không chạy lại),
+    - không có hai lượt của cùng chat chạy chồng lên nhau,
+    - lịch sử chat có đúng một lượt cho mỗi câu hỏi và theo đúng thứ tự các lượt đã chạy,
+    - mọi request trùng nhận cùng một câu trả lời.
+Thoát với mã 1 nếu có kiểm tra thất bại.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeRedisStore, FakeWebSearch, override_models
+
+
+class _Probe:
+    """Bọc Flow._arun của mỗi worker để đếm số lần chạy graph và số lượt chạy chồng nhau."""
+
+    def __init__(self):
+        self.executions = []
+        self.running = 0
+        self.max_running = 0
+
+    def wrap(self, flow):
+        arun = flow._arun
+
+        async def probed(question, *args, **kwargs):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                result = await arun(question, *args, **kwargs)
+                self.executions.append(question)
+                return result
+            finally:
+                self.running -= 1
+
+        flow._arun = probed
+
+
+def _redis(url: str):
+    if url:
+        from redis.asyncio import Redis
+        return Redis.from_url(url)
+    try:
+        import fakeredis.aioredis
+    except ImportError:
+        sys.exit("fakeredis is not installed: pip install -e .[test], or pass --redis-url")
+    return fakeredis.aioredis.FakeRedis()
+
+
+async def main(args):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:1")
+    os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "benchmark.service.role"
+    os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+    os.environ["ROUTER_LOCAL_ENABLED"] = "false"
+    os.environ["CHAT_COORDINATION_ENABLED"] = str(not args.no_coordination)
+    from registry import registry
+    from workflow import Flow
+
+    redis = _redis(args.redis_url)
+    chat_id = f"hammer-{random.randrange(1 << 30)}"
+    await redis.delete(f"chat_lock:{chat_id}")
+
+    store = FakeRedisStore(latency=0.002)
+    store.aredis = redis
+    registry.reset()
+    registry.override("redis_store", store)
+    override_models(registry, args.llm_latency, verdicts={"datasource": "web"})
+    registry.override("web_search", FakeWebSearch(latency=args.llm_latency))
+
+    probe = _Probe()
+    workers = [Flow() for _ in range(args.workers)]
+    for flow in workers:
+        probe.wrap(flow)
+
+    questions = [f"Quán cà phê hẹn hò số {i} ở Quận 1" for i in range(args.questions)]
+    requests = [question for question in questions for _ in range(args.duplicates)]
+    random.shuffle(requests)
+
+    async def send(index: int, question: str):
+        # Mô phỏng người dùng bấm gửi liên tục: các request đến cách nhau vài mili giây
+        await asyncio.sleep(index * args.spacing)
+        flow = workers[index % len(workers)]
+        result = await flow.arun(question, chat_id, "me")
+        return question, result.get("final_generation")
+
+    start = time.perf_counter()
+    answers = await asyncio.gather(*(send(index, question) for index, question in enumerate(requests)))
+    elapsed = time.perf_counter() - start
+
+    history = await store.aget_history(f"chat:{chat_id}")
+    turns = [turn["question"] for turn in history]
+    by_question = {}
+    for question, answer in answers:
+        by_question.setdefault(question, set()).add(answer)
+
+    checks = {
+        "one execution per question": sorted(probe.executions) == sorted(questions),
+        "no overlapping turns": probe.max_running <= 1,
+        "history has each question once, in execution order": turns == probe.executions and len(set(turns)) == len(turns),
+        "duplicates share one answer": all(len(answers) == 1 for answers in by_question.values()),
+    }
+    print(f"requests       : {len(requests)} ({args.questions} questions x {args.duplicates}) over {args.workers} workers")
+    print(f"graph runs     : {len(probe.executions)}")
+    print(f"max concurrent : {probe.max_running}")
+    print(f"history turns  : {len(turns)}")
+    print(f"elapsed        : {elapsed:.2f}s")
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'}  {name}")
+    await redis.aclose()
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hammer one chat with concurrent duplicate requests")
+    parser.add_argument("--workers", type=int, default=4, help="Flow instances sharing one Redis")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--duplicates", type=int, default=4, help="Copies of each question")
+    parser.add_argument("--spacing", type=float, default=0.005, help="Seconds between request arrivals")
+    parser.add_argument("--llm-latency", type=float, default=0.02)
+    parser.add_argument("--redis-url")
+    parser.add_argument("--no-coordination", action="store_true")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(main(args)) else 1)
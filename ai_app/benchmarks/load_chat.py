@@ -0,0 +1,78 @@
+"""
+Load test cho endpoint /mobile/chat.
+
+Gửi nhiều request đồng thời và đo xem các request có thực sự chạy chồng lên nhau
+hay bị xếp hàng trong event loop.
+
+    python benchmarks/load_chat.py --url http://localhost:8000 --concurrency 10 --requests 50
+
+`overlap` là tổng latency chia cho thời gian thực tế: ~1 nghĩa là các request chạy tuần tự,
+gần bằng `concurrency` nghĩa là chúng chạy song song.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+import httpx
+
+
+async def _one(client: httpx.AsyncClient, url: str, question: str, profile_id: str):
+    payload = {
+        "question": question,
+        "chat_id": f"load-{uuid.uuid4()}",
+        "profile_id": profile_id,
+    }
+    start = time.perf_counter()
+    response = await client.post(f"{url}/mobile/chat", json=payload)
+    end = time.perf_counter()
+    return start, end, response.status_code
+
+
+def _max_in_flight(intervals):
+    events = []
+    for start, end in intervals:
+        events.append((start, 1))
+        events.append((end, -1))
+    current = peak = 0
+    for _, delta in sorted(events):
+        current += delta
+        peak = max(peak, current)
+    return peak
+
+
+async def main(url: str, concurrency: int, total: int, question: str, profile_id: str, timeout: float):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        async def worker():
+            async with semaphore:
+                return await _one(client, url, question, profile_id)
+
+        wall_start = time.perf_counter()
+        results = await asyncio.gather(*(worker() for _ in range(total)), return_exceptions=True)
+        wall = time.perf_counter() - wall_start
+
+    ok = [r for r in results if not isinstance(r, Exception) and r[2] == 200]
+    failed = len(results) - len(ok)
+    latencies = sorted(end - start for start, end, _ in ok)
+    if not latencies:
+        print(f"Tất cả {failed} request đều lỗi")
+        return
+
+    print(f"requests    : {len(ok)} ok, {failed} lỗi")
+    print(f"wall time   : {wall:.2f}s")
+    print(f"latency p50 : {latencies[len(latencies) // 2]:.2f}s")
+    print(f"latency max : {latencies[-1]:.2f}s")
+    print(f"overlap     : {sum(latencies) / wall:.2f}x")
+    print(f"max inflight: {_max_in_flight([(s, e) for s, e, _ in ok])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /mobile/chat")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--question", default="Quán cà phê hẹn hò ở Quận 1")
+    parser.add_argument("--profile-id", default="00000000-0000-0000-0000-000000000000")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.concurrency, args.requests, args.question, args.profile_id, args.timeout))
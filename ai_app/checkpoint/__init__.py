@@ -0,0 +1,179 @@
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.serde.types import TASKS
+from redis.exceptions import RedisError
+from config import Config
+from metrics import metrics
+
+
+class RedisCheckpointer(BaseCheckpointSaver):
+    """
+    Checkpointer của LangGraph lưu trong Redis (client redis.asyncio của RedisStore).
+
+    Mỗi thread là một request (`chat:{chat_id}:{request_id}`) và chỉ cần checkpoint mới nhất để chạy
+    tiếp, nên mỗi thread chỉ giữ checkpoint mới nhất cùng các write của nó và của checkpoint cha
+    (pending sends). Mọi key hết hạn sau CHECKPOINT_TTL giây kể từ lần ghi cuối; checkpoint hoặc
+    write lớn hơn CHECKPOINT_MAX_BYTES bị bỏ qua, lần chạy lại sẽ bắt đầu từ checkpoint trước đó.
+
+        checkpoint:{thread_id}:{ns}                   hash: checkpoint, metadata (serde.dumps_typed), id, parent
+        checkpoint_writes:{thread_id}:{ns}:{id}       hash: "{task_id}\\0{idx}" -> "{channel}\\0{type}\\0{value}"
+    """
+
+    def __init__(self, redis, config: Config = None):
+        super().__init__()
+        config = config or Config()
+        self._redis = redis
+        self._ttl = config.checkpoint_ttl
+        self._max_bytes = config.checkpoint_max_bytes
+
+    @staticmethod
+    def _key(thread_id: str, ns: str) -> str:
+        return f"checkpoint:{thread_id}:{ns}"
+
+    @staticmethod
+    def _writes_key(thread_id: str, ns: str, checkpoint_id: str) -> str:
+        return f"checkpoint_writes:{thread_id}:{ns}:{checkpoint_id}"
+
+    def _load_writes(self, stored: Dict[bytes, bytes]):
+        writes = []
+        for field, value in stored.items():
+            channel, type_, data = value.split(b"\0", 2)
+            writes.append((field.split(b"\0", 1)[0].decode(), channel.decode(),
+                           self.serde.loads_typed((type_.decode(), data))))
+        return writes
+
+    async def _load(self, record: Dict[bytes, bytes]) -> CheckpointTuple:
+        thread_id, ns = record[b"thread_id"].decode(), record[b"ns"].decode()
+        checkpoint_id, parent_id = record[b"id"].decode(), record[b"parent"].decode() or None
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hgetall(self._writes_key(thread_id, ns, checkpoint_id))
+        if parent_id:
+            pipe.hgetall(self._writes_key(thread_id, ns, parent_id))
+        writes, *parent_writes = await pipe.execute()
+        sends = [value for _, channel, value in self._load_writes(parent_writes[0])
+                 if channel == TASKS] if parent_writes else []
+
+        def config(checkpoint_id):
+            return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint_id}}
+
+        return CheckpointTuple(
+            config=config(checkpoint_id),
+            checkpoint={**self.serde.loads_typed((record[b"type"].decode(), record[b"checkpoint"])),
+                        "pending_sends": sends},
+            metadata=self.serde.loads_typed((record[b"metadata_type"].decode(), record[b"metadata"])),
+            parent_config=config(parent_id) if parent_id else None,
+            pending_writes=self._load_writes(writes),
+        )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        with metrics.timer("upstream_request_duration_seconds", errors="upstream_errors_total",
+                           upstream="redis", operation="checkpoint_get"):
+            record = await self._redis.hgetall(self._key(thread_id, ns))
+            checkpoint_id = get_checkpoint_id(config)
+            # Chỉ checkpoint mới nhất được giữ lại
+            if not record or (checkpoint_id and record[b"id"].decode() != checkpoint_id):
+                return None
+            return await self._load(record)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        if config is not None:
+            keys = [self._key(config["configurable"]["thread_id"], config["configurable"].get("checkpoint_ns", ""))]
+        else:
+            keys = [key async for key in self._redis.scan_iter(match="checkpoint:*", count=1000)]
+        before_id = get_checkpoint_id(before) if before else None
+        for key in keys:
+            if limit is not None and limit <= 0:
+                return
+            record = await self._redis.hgetall(key)
+            if not record or (before_id and record[b"id"].decode() >= before_id):
+                continue
+            checkpoint = await self._load(record)
+            if filter and any(checkpoint.metadata.get(name) != value for name, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        parent_id = config["configurable"].get("checkpoint_id")
+        saved = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint["id"]}}
+
+        # pending_sends được dựng lại từ write TASKS của checkpoint cha khi đọc
+        checkpoint = {name: value for name, value in checkpoint.items() if name != "pending_sends"}
+        type_, data = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_data = self.serde.dumps_typed(metadata)
+        if len(data) + len(metadata_data) > self._max_bytes:
+            print(f"Checkpoint of {thread_id} is {len(data) + len(metadata_data)} bytes, not saved")
+            metrics.inc("graph_checkpoints_total", result="too_large")
+            return saved
+
+        key = self._key(thread_id, ns)
+        # Lỗi Redis chỉ làm mất checkpoint, không làm hỏng request đang chạy
+        try:
+            with metrics.timer("upstream_request_duration_seconds", errors="upstream_errors_total",
+                               upstream="redis", operation="checkpoint_put"):
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.hget(key, "parent")
+                pipe.hset(key, mapping={
+                    "thread_id": thread_id,
+                    "ns": ns,
+                    "id": checkpoint["id"],
+                    "parent": parent_id or "",
+                    "type": type_,
+                    "checkpoint": data,
+                    "metadata_type": metadata_type,
+                    "metadata": metadata_data,
+                })
+                pipe.expire(key, self._ttl)
+                previous_parent = (await pipe.execute())[0]
+                # Write của checkpoint trước checkpoint cha không còn cần tới
+                if previous_parent and previous_parent.decode() != parent_id:
+                    await self._redis.unlink(self._writes_key(thread_id, ns, previous_parent.decode()))
+        except RedisError as e:
+            print(f"Checkpoint error: {e}")
+            metrics.inc("graph_checkpoints_total", result="error")
+            return saved
+        metrics.inc("graph_checkpoints_total", result="saved")
+        return saved
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        key = self._writes_key(thread_id, ns, config["configurable"]["checkpoint_id"])
+        pipe = self._redis.pipeline(transaction=False)
+        for idx, (channel, value) in enumerate(writes):
+            type_, data = self.serde.dumps_typed(value)
+            if len(data) > self._max_bytes:
+                print(f"Write {channel} of {thread_id} is {len(data)} bytes, not saved")
+                metrics.inc("graph_checkpoints_total", result="too_large")
+                continue
+            index = WRITES_IDX_MAP.get(channel, idx)
+            field, stored = f"{task_id}\0{index}", b"\0".join((channel.encode(), type_.encode(), data))
+            # Giống MemorySaver: write thường của một task không bị ghi đè, write đặc biệt (lỗi, interrupt) thì có
+            if index >= 0:
+                pipe.hsetnx(key, field, stored)
+            else:
+                pipe.hset(key, field, stored)
+        pipe.expire(key, self._ttl)
+        try:
+            with metrics.timer("upstream_request_duration_seconds", errors="upstream_errors_total",
+                               upstream="redis", operation="checkpoint_put_writes"):
+                await pipe.execute()
+        except RedisError as e:
+            print(f"Checkpoint error: {e}")
+            metrics.inc("graph_checkpoints_total", result="error")
@@ -0,0 +1,168 @@
+from dotenv import load_dotenv
+import os
+load_dotenv()
+
+
+def _get_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes")
+
+
+class Config:
+    def __init__(self):
+        # Số tài liệu được chấm điểm song song trong grade_docs
+        self.grade_docs_concurrency = int(os.getenv("GRADE_DOCS_CONCURRENCY", 5))
+        # Số tài liệu phù hợp tối thiểu để chuyển sang generate
+        self.min_relevant_docs = int(os.getenv("MIN_RELEVANT_DOCS", 1))
+        # Dừng chấm điểm ngay khi đủ min_relevant_docs tài liệu phù hợp
+        self.grade_docs_early_exit = _get_bool("GRADE_DOCS_EARLY_EXIT", False)
+        # Semantic cache câu trả lời trước khi chạy graph
+        self.semantic_cache_enabled = _get_bool("SEMANTIC_CACHE_ENABLED", True)
+        self.semantic_cache_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+        self.semantic_cache_ttl = int(os.getenv("SEMANTIC_CACHE_TTL", 86400))
+        self.semantic_cache_max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+        # Bộ định tuyến cục bộ, chỉ gọi LLM khi độ tin cậy thấp hơn ngưỡng
+        # Tắt mặc định: precision trên bộ câu hỏi held-out (router/holdout.json) ở ngưỡng 0.9 còn dưới
+        # 0.99, xem benchmarks/eval_router.py
+        self.router_local_enabled = _get_bool("ROUTER_LOCAL_ENABLED", False)
+        self.router_confidence_threshold = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", 0.9))
+        # Hiệu chỉnh độ tin cậy: nhiệt độ chia log-odds (eval_router.py --fit) và tỉ lệ từ đã biết tối thiểu
+        self.router_temperature = float(os.getenv("ROUTER_TEMPERATURE", 1.9))
+        self.router_min_coverage = float(os.getenv("ROUTER_MIN_COVERAGE", 0.5))
+        # Lưu lịch sử chat: "list" (Redis list, append nguyên tử) hoặc "json" (cách lưu cũ)
+        self.history_storage = os.getenv("HISTORY_STORAGE", "list").strip().lower()
+        # Số lượt hỏi đáp tối đa giữ lại cho mỗi chat, 0 là không giới hạn
+        self.history_max_turns = int(os.getenv("HISTORY_MAX_TURNS", 200))
+        # Thời gian sống của lịch sử chat (giây) kể từ lượt cuối, 0 là không hết hạn
+        self.history_ttl = int(os.getenv("HISTORY_TTL", 30 * 86400))
+        # Số id tối đa trong một truy vấn `in` tới Supabase
+        self.supabase_in_chunk_size = int(os.getenv("SUPABASE_IN_CHUNK_SIZE", 100))
+        # Serper: địa chỉ API, timeout (giây), số lần retry, backoff và cache kết quả tìm kiếm
+        self.serper_url = os.getenv("SERPER_URL", "https://google.serper.dev").rstrip("/")
+        self.serper_connect_timeout = float(os.getenv("SERPER_CONNECT_TIMEOUT", 3))
+        self.serper_read_timeout = float(os.getenv("SERPER_READ_TIMEOUT", 10))
+        self.serper_max_connections = int(os.getenv("SERPER_MAX_CONNECTIONS", 20))
+        self.serper_max_retries = int(os.getenv("SERPER_MAX_RETRIES", 2))
+        self.serper_backoff = float(os.getenv("SERPER_BACKOFF", 0.3))
+        self.serper_cache_size = int(os.getenv("SERPER_CACHE_SIZE", 512))
+        self.serper_cache_ttl = int(os.getenv("SERPER_CACHE_TTL", 3600))
+        self.serper_cache_redis = _get_bool("SERPER_CACHE_REDIS", True)
+        # Cách chạy grader trong grade_generation: "parallel", "fused" hoặc "sequential"
+        self.grader_mode = os.getenv("GRADER_MODE", "parallel").strip().lower()
+        # Chạy history và route song song thay vì history -> route
+        self.graph_parallel_entry = _get_bool("GRAPH_PARALLEL_ENTRY", True)
+        # Timeout (giây) cho mỗi tool, ghi đè riêng từng tool bằng TOOL_TIMEOUTS="get_friends=8,get_user_info=3"
+        self.tool_timeout = float(os.getenv("TOOL_TIMEOUT", 5))
+        self.tool_timeouts = {
+            name.strip(): float(value)
+            for name, _, value in (item.partition("=") for item in os.getenv("TOOL_TIMEOUTS", "").split(","))
+            if name.strip() and value.strip()
+        }
+        # Ngân sách token cho ngữ cảnh (lịch sử + tài liệu) trong prompt của generate
+        self.generate_context_tokens = int(os.getenv("GENERATE_CONTEXT_TOKENS", 2000))
+        self.generate_history_tokens = int(os.getenv("GENERATE_HISTORY_TOKENS", 500))
+        # Hai tài liệu có độ trùng từ (Jaccard) từ ngưỡng này trở lên được xem là trùng nhau
+        self.context_dedup_threshold = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.9))
+        # Ngân sách thời gian (giây) cho mỗi request, ghi đè theo endpoint bằng
+        # REQUEST_BUDGETS="/mobile/chat=20,/mobile/chat/stream=45"; 0 là không giới hạn
+        self.request_budget = float(os.getenv("REQUEST_BUDGET", 30))
+        self.request_budgets = {
+            endpoint.strip(): float(value)
+            for endpoint, _, value in (item.partition("=") for item in os.getenv("REQUEST_BUDGETS", "").split(","))
+            if endpoint.strip() and value.strip()
+        }
+        # Gộp request trùng và xếp hàng các lượt của cùng một chat (Redis lock giữa các worker)
+        self.chat_coordination_enabled = _get_bool("CHAT_COORDINATION_ENABLED", True)
+        # Thời gian sống của lock (giây), đủ dài cho một lượt chạy hết ngân sách
+        self.chat_lock_timeout = float(os.getenv("CHAT_LOCK_TIMEOUT", (self.request_budget or 60) + 30))
+        # Thời gian tối đa chờ lượt trước của cùng chat
+        self.chat_lock_wait = float(os.getenv("CHAT_LOCK_WAIT", 30))
+        # Request giống hệt trong khoảng này (giây) nhận lại kết quả đã có thay vì chạy lại
+        self.chat_dedup_window = int(os.getenv("CHAT_DEDUP_WINDOW", 30))
+        # Node store: tìm hồ sơ người dùng trong index vector `dating_app` trước khi tìm trên web,
+        # chỉ bật sau khi đã nạp hồ sơ bằng ingest_profiles.py
+        self.profile_store_enabled = _get_bool("PROFILE_STORE_ENABLED", False)
+        self.profile_store_k = int(os.getenv("PROFILE_STORE_K", 3))
+        # Khoảng cách cosine tối đa (0 là trùng hoàn toàn) để hồ sơ được xem là khớp với câu hỏi
+        self.profile_store_max_distance = float(os.getenv("PROFILE_STORE_MAX_DISTANCE", 0.5))
+        # Nạp hồ sơ vào index: số hồ sơ mỗi trang Supabase, số trang xử lý đồng thời,
+        # các cột đưa vào nội dung được embedding và cột thời gian cập nhật dùng cho --since
+        self.ingest_page_size = int(os.getenv("INGEST_PAGE_SIZE", 1000))
+        self.ingest_concurrency = int(os.getenv("INGEST_CONCURRENCY", 4))
+        self.ingest_profile_fields = [
+            field.strip()
+            for field in os.getenv("INGEST_PROFILE_FIELDS", "full_name,age,gender,location,bio,interests").split(",")
+            if field.strip()
+        ]
+        self.ingest_updated_column = os.getenv("INGEST_UPDATED_COLUMN", "updated_at")
+        # Số văn bản mỗi lần gọi API embedding và thời gian sống (giây) của cache embedding theo hash nội dung
+        self.embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", 500))
+        self.embedding_cache_ttl = int(os.getenv("EMBEDDING_CACHE_TTL", 30 * 86400))
+        # Model theo tier, dạng "<nhà cung cấp>:<model>" (groq hoặc chatgpt): tier fast cho route,
+        # grader, chọn kiểu tìm kiếm và tóm tắt; tier strong cho generate và tools. Mặc định cả hai tier
+        # dùng ChatGPT, đặt MODEL_FAST=groq:llama-3.1-8b-instant để chuyển tier fast sang Groq
+        self.model_fast = os.getenv("MODEL_FAST", "chatgpt:gpt-4o-mini").strip()
+        self.model_strong = os.getenv("MODEL_STRONG", "chatgpt:gpt-4o-mini").strip()
+        # Ghi đè theo node bằng tên tier hoặc model, ví dụ MODEL_NODES="route=strong,generate=chatgpt:gpt-4o"
+        self.model_nodes = {
+            node.strip(): value.strip()
+            for node, _, value in (item.partition("=") for item in os.getenv("MODEL_NODES", "").split(","))
+            if node.strip() and value.strip()
+        }
+        # Hedging: model chính chưa trả lời sau ngưỡng thì gửi cùng request tới model dự phòng
+        # (HEDGE_MODELS="<model chính>=<model dự phòng>,...") và lấy kết quả về trước
+        self.hedge_enabled = _get_bool("HEDGE_ENABLED", False)
+        self.hedge_models = {
+            primary.strip(): secondary.strip()
+            for primary, _, secondary in (item.partition("=") for item in os.getenv(
+                "HEDGE_MODELS", "chatgpt:gpt-4o-mini=groq:llama-3.3-70b-versatile,"
+                                "groq:llama-3.1-8b-instant=chatgpt:gpt-4o-mini").split(","))
+            if primary.strip() and secondary.strip()
+        }
+        # Ngưỡng là phân vị HEDGE_PERCENTILE của độ trễ model chính trong HEDGE_WINDOW lời gọi gần nhất,
+        # HEDGE_INITIAL_DELAY khi chưa đủ HEDGE_MIN_SAMPLES mẫu, không nhỏ hơn HEDGE_MIN_DELAY (giây)
+        self.hedge_percentile = float(os.getenv("HEDGE_PERCENTILE", 95))
+        self.hedge_initial_delay = float(os.getenv("HEDGE_INITIAL_DELAY", 2))
+        self.hedge_min_delay = float(os.getenv("HEDGE_MIN_DELAY", 0.2))
+        self.hedge_min_samples = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+        self.hedge_window = int(os.getenv("HEDGE_WINDOW", 200))
+        # Tỉ lệ lời gọi được hedge tối đa trong HEDGE_WINDOW lời gọi gần nhất
+        self.hedge_max_rate = float(os.getenv("HEDGE_MAX_RATE", 0.1))
+        # Chạy nhiều worker qua serve.py: số worker (0 là số CPU); mỗi worker warm-up xong
+        # (tối đa WARM_TIMEOUT giây) mới nhận request khi WARM_BEFORE_SERVE bật
+        self.serve_workers = int(os.getenv("SERVE_WORKERS", 0))
+        self.warm_before_serve = _get_bool("WARM_BEFORE_SERVE", False)
+        self.warm_timeout = float(os.getenv("WARM_TIMEOUT", 30))
+        # Warm-up gửi một lời gọi 1 token tới model tier fast để mở sẵn kết nối HTTPS tới provider;
+        # tắt mặc định vì đó là lời gọi trả phí ở mỗi worker mỗi lần khởi động
+        self.warm_llm = _get_bool("WARM_LLM", False)
+        # Checkpoint của graph trong Redis cho request có request_id: request thử lại với cùng request_id
+        # chạy tiếp từ node đã xong gần nhất hoặc nhận lại kết quả đã có, trong CHECKPOINT_TTL giây.
+        # Checkpoint lớn hơn CHECKPOINT_MAX_BYTES không được lưu
+        self.checkpoint_enabled = _get_bool("CHECKPOINT_ENABLED", False)
+        self.checkpoint_ttl = int(os.getenv("CHECKPOINT_TTL", 600))
+        self.checkpoint_max_bytes = int(os.getenv("CHECKPOINT_MAX_BYTES", 1_000_000))
+        # /mobile/chat/batch: số request tối đa mỗi batch và số graph chạy đồng thời
+        self.batch_max_requests = int(os.getenv("BATCH_MAX_REQUESTS", 100))
+        self.batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", 16))
+        # Lời gọi route/chấm tài liệu của các request trong batch đến trong LLM_BATCH_WINDOW giây
+        # được gộp vào một prompt, tối đa LLM_BATCH_MAX_ITEMS mục
+        self.llm_batch_window = float(os.getenv("LLM_BATCH_WINDOW", 0.02))
+        self.llm_batch_max_items = int(os.getenv("LLM_BATCH_MAX_ITEMS", 10))
+        # Admission control trước mỗi lần chạy graph: tối đa ADMISSION_CONCURRENCY request chạy cùng lúc mỗi
+        # worker (0 là không giới hạn), tối đa ADMISSION_MAX_QUEUE request chờ, mỗi request chờ tối đa
+        # ADMISSION_QUEUE_TIMEOUT giây; bị từ chối thì trả về 429 kèm Retry-After
+        self.admission_concurrency = int(os.getenv("ADMISSION_CONCURRENCY", 32))
+        self.admission_max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", 64))
+        self.admission_queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+        # Số lời gọi đồng thời tối đa tới từng upstream mỗi worker, upstream không có trong danh sách
+        # không bị giới hạn; lời gọi chờ quá UPSTREAM_QUEUE_TIMEOUT giây bị xem như lỗi của upstream
+        self.upstream_concurrency = {
+            name.strip(): int(value)
+            for name, _, value in (item.partition("=") for item in os.getenv(
+                "UPSTREAM_CONCURRENCY", "openai=64,groq=64,serper=20,supabase=32").split(","))
+            if name.strip() and value.strip()
+        }
+        self.upstream_queue_timeout = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", 10))
+
+    def request_budget_for(self, endpoint: str) -> float:
+        return self.request_budgets.get(endpoint, self.request_budget)
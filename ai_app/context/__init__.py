@@ -0,0 +1,167 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+from config import Config
+from metrics import metrics
+
+# Các dòng kết quả Serper không mang thông tin, bỏ đi khi render tài liệu
+_PLACEHOLDERS = ("Không có thông tin", "Không có đánh giá", "Không có đường dẫn", "Không có câu trả lời",
+                 "Không có tiêu đề", "Không rõ")
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=None)
+def _encoding(model_name: str):
+    """Tokenizer tiktoken của model, None nếu không có tiktoken hoặc không tải được bảng mã (offline)."""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Tokenizer unavailable, using estimate: {e}")
+        return None
+
+
+def _normalize(text: str) -> str:
+    text = text.lower().replace("đ", "d")
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+
+def _terms(text: str) -> set:
+    return set(re.findall(r"\w+", _normalize(text)))
+
+
+class TokenCounter:
+    """Đếm token bằng tiktoken, hoặc ước lượng theo số từ và dấu câu khi không có tokenizer."""
+
+    def __init__(self, model_name: str = "gpt-4o-mini"):
+        self._model_name = model_name
+
+    def count(self, text: str) -> int:
+        encoding = _encoding(self._model_name)
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return len(_WORD.findall(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        encoding = _encoding(self._model_name)
+        if encoding is not None:
+            tokens = encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens]) + "…"
+        words = list(_WORD.finditer(text))
+        return text if len(words) <= max_tokens else text[:words[max_tokens - 1].end()] + "…"
+
+
+class ContextBuilder:
+    """
+    Dựng phần ngữ cảnh (lịch sử chat và tài liệu) cho prompt của `generate` trong giới hạn token.
+
+    Tài liệu được render gọn (bỏ khoảng trắng thừa và các dòng không có thông tin), loại bỏ các
+    tài liệu gần trùng nhau, xếp theo độ trùng từ khoá với câu hỏi rồi lấy lần lượt tới khi hết
+    ngân sách. Lịch sử chỉ giữ các lượt gần nhất trong phần ngân sách dành cho nó.
+    """
+
+    def __init__(self, config: Config = None, counter: TokenCounter = None):
+        config = config or Config()
+        self._budget = config.generate_context_tokens
+        self._history_budget = config.generate_history_tokens
+        self._dedup_threshold = config.context_dedup_threshold
+        self._counter = counter or TokenCounter()
+
+    def warm(self) -> None:
+        # Tải bảng mã tokenizer trước để request đầu tiên không phải chờ
+        self._counter.count("")
+
+    @staticmethod
+    def render_document(document: Any) -> str:
+        text = getattr(document, "page_content", document)
+        lines = []
+        for line in str(text).splitlines():
+            line = " ".join(line.split()).rstrip(".")
+            if line and not any(placeholder in line for placeholder in _PLACEHOLDERS):
+                lines.append(line)
+        return "; ".join(lines)
+
+    def _deduplicate(self, documents: List[str]) -> List[Tuple[str, set]]:
+        kept = []
+        for document in documents:
+            terms = _terms(document)
+            duplicate = any(
+                len(terms & other) / (len(terms | other) or 1) >= self._dedup_threshold
+                for _, other in kept
+            )
+            if not duplicate:
+                kept.append((document, terms))
+        return kept
+
+    def _documents(self, question: str, documents: List[Any], budget: int) -> Tuple[str, int]:
+        rendered = [self.render_document(document) for document in documents]
+        unique = self._deduplicate([document for document in rendered if document])
+        question_terms = _terms(question)
+        # Xếp theo số từ khoá chung với câu hỏi, giữ thứ tự gốc (thứ hạng của Serper) khi bằng nhau
+        ranked = sorted(enumerate(unique), key=lambda item: (-len(item[1][1] & question_terms), item[0]))
+
+        lines, used = [], 0
+        for _, (document, _) in ranked:
+            line = f"{len(lines) + 1}. {document}"
+            tokens = self._counter.count(line)
+            if used + tokens > budget:
+                if not lines:
+                    # Tài liệu đầu tiên đã vượt ngân sách: cắt bớt thay vì bỏ trống
+                    line = self._counter.truncate(line, budget)
+                    lines.append(line)
+                    used += self._counter.count(line)
+                break
+            lines.append(line)
+            used += tokens
+        return "\n".join(lines), len(lines)
+
+    def _history(self, history: Any, budget: int) -> str:
+        if not history:
+            return ""
+        if isinstance(history, str):
+            # Bản tóm tắt: chỉ cắt nếu quá dài
+            return self._counter.truncate(" ".join(history.split()), budget)
+
+        turns, used = [], 0
+        for turn in reversed(list(history)):
+            if isinstance(turn, dict):
+                text = f"Người dùng: {turn.get('question', '')}\nTrợ lý: {turn.get('answer', '')}"
+            else:
+                text = str(turn)
+            tokens = self._counter.count(text)
+            if used + tokens > budget:
+                break
+            turns.append(text)
+            used += tokens
+        return "\n".join(reversed(turns))
+
+    def build(self, question: str, documents: List[Any], history: Any) -> Tuple[str, str, Dict[str, int]]:
+        """
+        Returns:
+            (history, documents, report): hai đoạn văn bản để đưa vào generate_prompt và số liệu
+            token trước/sau (trước là cách format list/dict thô như trước đây).
+        """
+        history_text = self._history(history, min(self._history_budget, self._budget))
+        history_tokens = self._counter.count(history_text)
+        documents_text, kept = self._documents(question, documents or [], self._budget - history_tokens)
+
+        before = self._counter.count(str(history)) + self._counter.count(str(documents))
+        after = history_tokens + self._counter.count(documents_text)
+        report = {
+            "tokens_before": before,
+            "tokens_after": after,
+            "tokens_saved": max(0, before - after),
+            "documents": len(documents or []),
+            "documents_kept": kept,
+        }
+        metrics.inc("prompt_context_tokens_total", before, stage="raw")
+        metrics.inc("prompt_context_tokens_total", after, stage="built")
+        metrics.inc("prompt_documents_total", len(documents or []) - kept, result="dropped")
+        metrics.inc("prompt_documents_total", kept, result="kept")
+        return history_text, documents_text, report
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import json
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict
+from redis.exceptions import LockError, RedisError
+from config import Config
+from metrics import metrics
+
+
+class ChatCoordinator:
+    """
+    Gộp các request trùng nhau và xếp hàng các lượt của cùng một chat.
+
+    Trong một process: request giống hệt (cùng chat_id, profile_id và câu hỏi) đang chạy thì request
+    sau chờ và dùng chung kết quả; các lượt khác nhau của một chat chạy lần lượt theo thứ tự đến
+    (asyncio.Lock theo chat).
+
+    Giữa các worker (khi có `redis`, client redis.asyncio): các lượt của một chat được tuần tự hoá
+    bằng Redis lock `chat_lock:{chat_id}`, và kết quả được giữ ở `chat_result:{chat_id}:{hash}`
+    trong CHAT_DEDUP_WINDOW giây, nên request trùng ở worker khác nhận lại kết quả đó thay vì
+    chạy lại graph.
+    """
+
+    def __init__(self, redis=None, config: Config = None):
+        config = config or Config()
+        self._redis = redis
+        self._lock_timeout = config.chat_lock_timeout
+        self._wait_timeout = config.chat_lock_wait
+        self._result_ttl = config.chat_dedup_window
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Lock tự được giải phóng khi không còn request nào của chat đó giữ tham chiếu
+        self._locks = weakref.WeakValueDictionary()
+
+    @staticmethod
+    def _digest(question: str, profile_id: str) -> str:
+        normalized = " ".join(question.lower().split())
+        return hashlib.sha1(f"{profile_id}\n{normalized}".encode()).hexdigest()
+
+    @staticmethod
+    async def _acquire_local(lock: asyncio.Lock, timeout: float) -> bool:
+        if not lock.locked():
+            await lock.acquire()
+            return True
+        if timeout <= 0:
+            return False
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @asynccontextmanager
+    async def serialize(self, chat_id: str, deadline: float = 0):
+        """
+        Giữ quyền xử lý lượt tiếp theo của chat cho tới khi thoát khỏi khối `async with`.
+
+        Chờ lượt trước tối đa CHAT_LOCK_WAIT giây và không quá hạn chót `deadline` (epoch giây, 0 là
+        không giới hạn) của request; hết thời gian chờ thì vẫn chạy, vì ưu tiên trả lời hơn là thứ tự
+        tuyệt đối khi lượt trước chạy quá lâu (request đã quá hạn chót nhận ngay câu trả lời dự phòng).
+        """
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+
+        start = time.perf_counter()
+        wait = self._wait_timeout if not deadline else max(0.0, min(self._wait_timeout, deadline - time.time()))
+        locked = await self._acquire_local(lock, wait)
+        acquired, redis_lock = False, None
+        try:
+            if locked and self._redis is not None:
+                redis_lock = self._redis.lock(f"chat_lock:{chat_id}", timeout=self._lock_timeout)
+                try:
+                    acquired = await redis_lock.acquire(
+                        blocking_timeout=max(0.0, wait - (time.perf_counter() - start)))
+                except RedisError as e:
+                    print(f"Chat lock error: {e}")
+            metrics.observe("chat_lock_wait_seconds", time.perf_counter() - start)
+            if not locked or (redis_lock is not None and not acquired):
+                print(f"Chat lock wait timed out for {chat_id}")
+                metrics.inc("chat_lock_timeouts_total")
+            yield
+        finally:
+            if acquired:
+                try:
+                    await redis_lock.release()
+                except (LockError, RedisError):
+                    # Lock đã hết hạn (lượt chạy lâu hơn CHAT_LOCK_TIMEOUT) hoặc mất kết nối
+                    pass
+            if locked:
+                lock.release()
+
+    async def run(self, chat_id: str, question: str, profile_id: str,
+                  execute: Callable[[], Awaitable[Dict[str, Any]]], deadline: float = 0) -> Dict[str, Any]:
+        """
+        Chạy `execute()` cho một lượt chat, hoặc trả về kết quả của request giống hệt đang chạy/vừa xong.
+        Kết quả phải serialize được thành JSON để chia sẻ giữa các worker. Thời gian chờ lượt trước
+        bị giới hạn bởi hạn chót `deadline` của request (xem serialize).
+        """
+        digest = self._digest(question, profile_id)
+        key = f"{chat_id}:{digest}"
+        future = self._inflight.get(key)
+        if future is not None:
+            metrics.inc("chat_coalesced_total", scope="process")
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        # Tránh cảnh báo "exception was never retrieved" khi không có request nào chờ
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            result = await self._run_serialized(chat_id, digest, execute, deadline)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _run_serialized(self, chat_id: str, digest: str, execute, deadline: float = 0):
+        result_key = f"chat_result:{chat_id}:{digest}"
+        async with self.serialize(chat_id, deadline):
+            if self._redis is not None:
+                # Request giống hệt vừa được trả lời (có thể ở worker khác) trong lúc chờ lock
+                try:
+                    cached = await self._redis.get(result_key)
+                except RedisError as e:
+                    print(f"Chat result cache error: {e}")
+                    cached = None
+                if cached:
+                    metrics.inc("chat_coalesced_total", scope="redis")
+                    return json.loads(cached)
+
+            result = await execute()
+
+            if self._redis is not None and self._result_ttl > 0:
+                try:
+                    await self._redis.set(result_key, json.dumps(result, ensure_ascii=False, default=str),
+                                          ex=self._result_ttl)
+                except Exception as e:
+                    print(f"Chat result cache error: {e}")
+            return result
@@ -1,12 +1,31 @@
 from dotenv import load_dotenv
 import os
+import asyncio
 from langchain_redis import RedisConfig, RedisVectorStore
 from redis import Redis
+from redis.exceptions import ResponseError
+from redis.asyncio import Redis as AsyncRedis
+from redis.commands.search.field import TagField, VectorField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
 from langchain_openai import OpenAIEmbeddings
-from supabase import create_client
-from supabase.lib.client_options import  ClientOptions
+from supabase import create_client, acreate_client
+from supabase.lib.client_options import  ClientOptions, AsyncClientOptions
+from typing import Optional, List, Tuple
+import numpy as np
+import hashlib
+import json
+import re
+import time
+from config import Config
+from metrics import metrics
 load_dotenv()
 
+
+def _redis_timed(operation: str):
+    return metrics.timed("upstream_request_duration_seconds", errors="upstream_errors_total", upstream="redis", operation=operation)
+
+
 class RedisStore:
     def __init__(self):
         self.redis = Redis(
@@ -14,26 +33,427 @@ class RedisStore:
             port=os.getenv('REDIS_PORT'),
             password=os.getenv('REDIS_PASSWORD'),
         )
+        self.aredis = AsyncRedis(
+            host=os.getenv('REDIS_HOST'),
+            port=os.getenv('REDIS_PORT'),
+            password=os.getenv('REDIS_PASSWORD'),
+        )
         self._embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
         self._config = RedisConfig(index_name="dating_app", redis_client=self.redis)
-        self.store = RedisVectorStore(self._embeddings, self._config)
+        self._vector_store = None
+        config = Config()
+        self._history_storage = config.history_storage
+        self._history_max_turns = config.history_max_turns
+        self._history_ttl = config.history_ttl
+
+    @property
+    def store(self) -> RedisVectorStore:
+        # Tạo index khi dùng lần đầu thay vì lúc khởi động
+        if self._vector_store is None:
+            self._vector_store = RedisVectorStore(self._embeddings, self._config)
+        return self._vector_store
+
+    def get_embeddings(self):
+        return self._embeddings
 
     def as_retriver(self):
         return self.store.as_retriever(search_kwargs={"k": 3})
 
-    def get_history(self, chat_id: str) -> str:
-        return self.redis.json().get(chat_id)
+    @staticmethod
+    def _slice(chat_history, start: int, end: int):
+        if not chat_history:
+            return chat_history
+        return chat_history[start:] if end == -1 else chat_history[start:end + 1]
+
+    @staticmethod
+    def _encode_turn(question: str, answer: str) -> str:
+        return json.dumps({"question": question, "answer": answer}, ensure_ascii=False)
+
+    @staticmethod
+    def _decode_turns(turns) -> List[dict]:
+        return [json.loads(turn) for turn in turns]
+
+    def _append_turn(self, pipe, chat_id: str, *turns: str, count: bool = True) -> None:
+        # RPUSH + LTRIM + EXPIRE trong cùng một MULTI nên các request song song không làm mất lượt nào
+        pipe.rpush(chat_id, *turns)
+        if self._history_max_turns > 0:
+            pipe.ltrim(chat_id, -self._history_max_turns, -1)
+        if count:
+            self._count_turns(pipe, chat_id, len(turns))
+        if self._history_ttl > 0:
+            pipe.expire(chat_id, self._history_ttl)
+            self._expire_summary(pipe, chat_id)
+
+    def _count_turns(self, pipe, chat_id: str, turns: int) -> None:
+        # Tổng số lượt đã lưu, không bị LTRIM cắt: bản tóm tắt ghi lại nó đã gộp tới lượt thứ mấy
+        pipe.incrby(self._turns_key(chat_id), turns)
+        if self._history_ttl > 0:
+            pipe.expire(self._turns_key(chat_id), self._history_ttl)
+
+    def _expire_summary(self, pipe, chat_id: str) -> None:
+        # Bản tóm tắt sống cùng lịch sử mà nó tóm tắt
+        pipe.expire(self._summary_key(chat_id), self._history_ttl)
+        pipe.expire(self._through_key(chat_id), self._history_ttl)
+
+    @_redis_timed("get_history")
+    def get_history(self, chat_id: str, start: int = 0, end: int = -1) -> List[dict]:
+        """Đọc các lượt hỏi đáp trong khoảng [start, end], chỉ số âm tính từ cuối giống LRANGE."""
+        if self._history_storage != "list":
+            return self._slice(self.redis.json().get(chat_id), start, end)
+        try:
+            return self._decode_turns(self.redis.lrange(chat_id, start, end))
+        except ResponseError:
+            # Key cũ còn ở dạng JSON
+            self.migrate_history(chat_id)
+            return self._decode_turns(self.redis.lrange(chat_id, start, end))
 
+    @_redis_timed("save_history")
     def save_history(self, chat_id: str, question: str, answer: str) -> None:
-        chat_history = self.get_history(chat_id)
-        if not chat_history:
-            chat_history = []
-        chat_history.append({"question": question, "answer": answer})
-        self.redis.json().set(chat_id, "$", chat_history)
+        if self._history_storage != "list":
+            chat_history = self.get_history(chat_id)
+            if not chat_history:
+                chat_history = []
+            chat_history.append({"question": question, "answer": answer})
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.json().set(chat_id, "$", chat_history)
+            self._count_turns(pipe, chat_id, 1)
+            pipe.execute()
+            return
+
+        turn = self._encode_turn(question, answer)
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            self._append_turn(pipe, chat_id, turn)
+            pipe.execute()
+        except ResponseError:
+            self.migrate_history(chat_id)
+            pipe = self.redis.pipeline(transaction=True)
+            self._append_turn(pipe, chat_id, turn)
+            pipe.execute()
+
+    def migrate_history(self, chat_id: str) -> bool:
+        """Chuyển lịch sử dạng JSON của một chat sang Redis list. Trả về True nếu có chuyển đổi."""
+        def migrate(pipe):
+            if pipe.type(chat_id) != b"ReJSON-RL":
+                return False
+            chat_history = pipe.json().get(chat_id) or []
+            turns = [self._encode_turn(turn.get("question"), turn.get("answer")) for turn in chat_history]
+            pipe.multi()
+            pipe.delete(chat_id)
+            if turns:
+                # Các lượt này đã được đếm khi lưu ở dạng JSON
+                self._append_turn(pipe, chat_id, *turns, count=False)
+            return True
+
+        return self.redis.transaction(migrate, chat_id, value_from_callable=True)
 
+    def migrate_all_histories(self, pattern: str = "chat:*") -> int:
+        migrated = 0
+        for key in self.redis.scan_iter(match=pattern, _type="ReJSON-RL"):
+            if self.migrate_history(key.decode()):
+                migrated += 1
+        return migrated
 
+    @_redis_timed("delete_chat")
     def delete_chat(self, chat_id: str) -> None:
-        return self.redis.delete(chat_id)
+        return self.redis.delete(chat_id, self._summary_key(chat_id), self._through_key(chat_id), self._turns_key(chat_id))
+
+    @_redis_timed("get_history")
+    async def aget_history(self, chat_id: str, start: int = 0, end: int = -1) -> List[dict]:
+        if self._history_storage != "list":
+            return self._slice(await self.aredis.json().get(chat_id), start, end)
+        try:
+            return self._decode_turns(await self.aredis.lrange(chat_id, start, end))
+        except ResponseError:
+            await self.amigrate_history(chat_id)
+            return self._decode_turns(await self.aredis.lrange(chat_id, start, end))
+
+    @_redis_timed("save_history")
+    async def asave_history(self, chat_id: str, question: str, answer: str) -> None:
+        if self._history_storage != "list":
+            chat_history = await self.aget_history(chat_id)
+            if not chat_history:
+                chat_history = []
+            chat_history.append({"question": question, "answer": answer})
+            pipe = self.aredis.pipeline(transaction=True)
+            pipe.json().set(chat_id, "$", chat_history)
+            self._count_turns(pipe, chat_id, 1)
+            await pipe.execute()
+            return
+
+        turn = self._encode_turn(question, answer)
+        try:
+            pipe = self.aredis.pipeline(transaction=True)
+            self._append_turn(pipe, chat_id, turn)
+            await pipe.execute()
+        except ResponseError:
+            await self.amigrate_history(chat_id)
+            pipe = self.aredis.pipeline(transaction=True)
+            self._append_turn(pipe, chat_id, turn)
+            await pipe.execute()
+
+    async def amigrate_history(self, chat_id: str) -> bool:
+        async def migrate(pipe):
+            if await pipe.type(chat_id) != b"ReJSON-RL":
+                return False
+            chat_history = await pipe.json().get(chat_id) or []
+            turns = [self._encode_turn(turn.get("question"), turn.get("answer")) for turn in chat_history]
+            pipe.multi()
+            pipe.delete(chat_id)
+            if turns:
+                # Các lượt này đã được đếm khi lưu ở dạng JSON
+                self._append_turn(pipe, chat_id, *turns, count=False)
+            return True
+
+        return await self.aredis.transaction(migrate, chat_id, value_from_callable=True)
+
+    @_redis_timed("delete_chat")
+    async def adelete_chat(self, chat_id: str) -> None:
+        return await self.aredis.delete(chat_id, self._summary_key(chat_id), self._through_key(chat_id),
+                                        self._turns_key(chat_id))
+
+    @staticmethod
+    def _summary_key(chat_id: str) -> str:
+        return f"{chat_id}:summary"
+
+    @staticmethod
+    def _through_key(chat_id: str) -> str:
+        return f"{chat_id}:summary_through"
+
+    @staticmethod
+    def _turns_key(chat_id: str) -> str:
+        return f"{chat_id}:turns"
+
+    @_redis_timed("get_summary")
+    async def aget_summary(self, chat_id: str) -> Tuple[Optional[str], int, int]:
+        """
+        Returns:
+            (summary, through, total): bản tóm tắt (None nếu chưa có), số lượt nó đã gộp và tổng số lượt
+            đã lưu của chat; `total - through` lượt cuối chưa có trong bản tóm tắt.
+        """
+        summary, through, total = await self.aredis.mget(
+            self._summary_key(chat_id), self._through_key(chat_id), self._turns_key(chat_id))
+        return summary.decode() if summary else None, int(through or 0), int(total or 0)
+
+    @_redis_timed("save_summary")
+    async def asave_summary(self, chat_id: str, summary: str, through: int, expected: int) -> bool:
+        """
+        Ghi bản tóm tắt đã gộp tới lượt `through`, nếu bản đang lưu vẫn là bản đã đọc (gộp tới `expected`).
+        Worker khác đã ghi bản mới hơn thì bỏ qua và trả về False: các lượt chưa gộp vẫn được node history
+        đọc trực tiếp và được gộp ở lần cập nhật sau. Bản tóm tắt hết hạn cùng lịch sử (HISTORY_TTL).
+        """
+        through_key = self._through_key(chat_id)
+        ttl = self._history_ttl if self._history_ttl > 0 else None
+
+        async def update(pipe):
+            if int(await pipe.get(through_key) or 0) != expected:
+                return False
+            pipe.multi()
+            pipe.set(self._summary_key(chat_id), summary, ex=ttl)
+            pipe.set(through_key, through, ex=ttl)
+            return True
+
+        return await self.aredis.transaction(update, through_key, value_from_callable=True)
+
+class SemanticCache:
+    """
+    Cache câu trả lời theo độ tương đồng ngữ nghĩa của câu hỏi.
+
+    Mỗi entry là một Redis hash `semantic_cache:{scope}:{id}` (câu hỏi, câu trả lời, scope, embedding)
+    có TTL riêng, được đánh index bởi RediSearch (`semantic_cache_idx`): lookup là một truy vấn KNN
+    lọc theo TAG scope, Redis tự bỏ các hash đã hết hạn khỏi index. Sorted set
+    `semantic_cache:{scope}:index` lưu thời điểm dùng gần nhất để loại bỏ entry cũ nhất khi vượt quá
+    giới hạn. Scope `global` dùng chung cho mọi người dùng, scope `profile:{profile_id}` chỉ dành cho
+    một người dùng.
+    """
+    GLOBAL_SCOPE = "global"
+    INDEX_NAME = "semantic_cache_idx"
+
+    def __init__(self, store: RedisStore):
+        config = Config()
+        self._redis = store.aredis
+        self._embeddings = store.get_embeddings()
+        self._threshold = config.semantic_cache_threshold
+        self._ttl = config.semantic_cache_ttl
+        self._max_entries = config.semantic_cache_max_entries
+        self._index_ready = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def profile_scope(profile_id: str) -> str:
+        return f"profile:{profile_id}"
+
+    @staticmethod
+    def _index_key(scope: str) -> str:
+        return f"semantic_cache:{scope}:index"
+
+    @staticmethod
+    def _entry_key(scope: str, entry_id: str) -> str:
+        return f"semantic_cache:{scope}:{entry_id}"
+
+    @staticmethod
+    def _tag(value: str) -> str:
+        # Giá trị TAG trong truy vấn RediSearch phải escape dấu câu (":" của profile scope, "-" của uuid...)
+        return re.sub(r"([^\w])", r"\\\1", value)
+
+    async def _ensure_index(self, dim: int) -> None:
+        if self._index_ready:
+            return
+        try:
+            await self._redis.ft(self.INDEX_NAME).create_index(
+                [
+                    TagField("scope"),
+                    VectorField("embedding", "HNSW", {"TYPE": "FLOAT32", "DIM": dim, "DISTANCE_METRIC": "COSINE"}),
+                ],
+                definition=IndexDefinition(prefix=["semantic_cache:"], index_type=IndexType.HASH),
+            )
+        except ResponseError as e:
+            # Worker khác (hoặc lần chạy trước) đã tạo index
+            if "already exists" not in str(e):
+                raise
+        self._index_ready = True
+
+    async def _best_match(self, scopes: List[str], embedding: np.ndarray) -> Tuple[float, Optional[str], Optional[str], Optional[str]]:
+        await self._ensure_index(len(embedding))
+        scope_filter = "|".join(self._tag(scope) for scope in scopes)
+        query = (
+            Query(f"(@scope:{{{scope_filter}}})=>[KNN 1 @embedding $vector AS distance]")
+            .sort_by("distance")
+            .return_fields("answer", "scope", "distance")
+            .paging(0, 1)
+            .dialect(2)
+        )
+        result = await self._redis.ft(self.INDEX_NAME).search(query, query_params={"vector": embedding.tobytes()})
+        if not result.docs:
+            return 0.0, None, None, None
+        doc = result.docs[0]
+        # Khoảng cách cosine của RediSearch là 1 - độ tương đồng
+        return 1.0 - float(doc.distance), doc.scope, doc.id.rsplit(":", 1)[-1], doc.answer
+
+    @_redis_timed("semantic_cache_lookup")
+    async def alookup(self, question: str, profile_id: str) -> Tuple[Optional[str], List[float]]:
+        """
+        Tìm câu trả lời đã cache cho câu hỏi tương tự.
+
+        Returns:
+            (answer, embedding): answer là None nếu không có entry nào vượt ngưỡng;
+            embedding được trả lại để `asave` không phải gọi embedding lần nữa.
+        """
+        embedding = await self._embeddings.aembed_query(question)
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        best_score, best_scope, best_id, best_answer = await self._best_match(
+            [self.GLOBAL_SCOPE, self.profile_scope(profile_id)], vector)
+
+        if best_answer is not None and best_score >= self._threshold:
+            self.hits += 1
+            await self._redis.zadd(self._index_key(best_scope), {best_id: time.time()})
+            await self._redis.incr("semantic_cache:stats:hits")
+            return best_answer, embedding
+
+        self.misses += 1
+        await self._redis.incr("semantic_cache:stats:misses")
+        return None, embedding
+
+    @_redis_timed("semantic_cache_save")
+    async def asave(self, question: str, answer: str, embedding: List[float], scope: str) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        await self._ensure_index(len(vector))
+        entry_id = hashlib.sha1(question.strip().lower().encode()).hexdigest()
+        index_key = self._index_key(scope)
+
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.hset(self._entry_key(scope, entry_id), mapping={
+            "question": question,
+            "answer": answer,
+            "scope": scope,
+            "embedding": vector.tobytes(),
+        })
+        pipe.expire(self._entry_key(scope, entry_id), self._ttl)
+        pipe.zadd(index_key, {entry_id: time.time()})
+        pipe.expire(index_key, self._ttl)
+        await pipe.execute()
+
+        # Loại bỏ các entry ít được dùng nhất khi vượt quá giới hạn
+        overflow = await self._redis.zcard(index_key) - self._max_entries
+        if overflow > 0:
+            evicted = await self._redis.zpopmin(index_key, overflow)
+            await self._redis.delete(*[self._entry_key(scope, entry_id.decode()) for entry_id, _ in evicted])
+
+    async def astats(self) -> dict:
+        hits, misses = await self._redis.mget("semantic_cache:stats:hits", "semantic_cache:stats:misses")
+        return {
+            "hits": int(hits or 0),
+            "misses": int(misses or 0),
+            "process_hits": self.hits,
+            "process_misses": self.misses,
+        }
+
+
+class EmbeddingCache:
+    """
+    Cache embedding theo hash nội dung: mỗi văn bản là một key `embedding_cache:{model}:{sha1}`
+    chứa vector float32, nên văn bản không đổi (hoặc trùng nhau giữa nhiều hồ sơ) không bao giờ
+    bị embedding lại. Các văn bản chưa có trong cache được gửi tới API theo lô EMBEDDING_BATCH_SIZE.
+    """
+
+    def __init__(self, store: RedisStore, embeddings=None, config: Config = None):
+        config = config or Config()
+        self._redis = store.aredis
+        self._embeddings = embeddings or store.get_embeddings()
+        self._namespace = f"embedding_cache:{getattr(self._embeddings, 'model', 'default')}"
+        self._batch_size = max(1, config.embedding_batch_size)
+        self._ttl = config.embedding_cache_ttl
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _key(self, content_hash: str) -> str:
+        return f"{self._namespace}:{content_hash}"
+
+    async def aembed_documents(self, texts: List[str], hashes: List[str] = None) -> List[np.ndarray]:
+        """Trả về vector float32 của từng văn bản, theo đúng thứ tự của `texts`."""
+        hashes = hashes or [self.content_hash(text) for text in texts]
+        with metrics.timer("upstream_request_duration_seconds", errors="upstream_errors_total",
+                           upstream="redis", operation="embedding_cache_get"):
+            cached = await self._redis.mget([self._key(content_hash) for content_hash in hashes])
+
+        vectors, missing = [None] * len(texts), {}
+        for index, (content_hash, vector) in enumerate(zip(hashes, cached)):
+            if vector is not None:
+                vectors[index] = np.frombuffer(vector, dtype=np.float32)
+            else:
+                # Văn bản giống nhau trong cùng lô chỉ embedding một lần
+                missing.setdefault(content_hash, []).append(index)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        metrics.inc("upstream_cache_total", len(texts) - len(missing), upstream="embeddings", result="hit")
+        metrics.inc("upstream_cache_total", len(missing), upstream="embeddings", result="miss")
+
+        pending = list(missing.items())
+        for start in range(0, len(pending), self._batch_size):
+            batch = pending[start:start + self._batch_size]
+            self.api_calls += 1
+            with metrics.timer("upstream_request_duration_seconds", errors="upstream_errors_total",
+                               upstream="openai", operation="embed"):
+                embedded = await self._embeddings.aembed_documents([texts[indexes[0]] for _, indexes in batch])
+
+            pipe = self._redis.pipeline(transaction=False)
+            for (content_hash, indexes), embedding in zip(batch, embedded):
+                vector = np.asarray(embedding, dtype=np.float32)
+                for index in indexes:
+                    vectors[index] = vector
+                pipe.set(self._key(content_hash), vector.tobytes(), ex=self._ttl or None)
+            await pipe.execute()
+        return vectors
+
 
 class SupabaseStore:
     def __init__(self):
@@ -45,9 +465,26 @@ class SupabaseStore:
           options=ClientOptions(auto_refresh_token=False, persist_session=False)
         )
 
+        self._async_supabase = None
+        self._async_lock = asyncio.Lock()
+
     def get_client(self):
         return self._supabase
 
+    async def aget_client(self):
+        """
+        Client bất đồng bộ (supabase AsyncClient), tạo lần đầu khi cần và dùng chung cho các lần sau.
+        """
+        if self._async_supabase is None:
+            async with self._async_lock:
+                if self._async_supabase is None:
+                    self._async_supabase = await acreate_client(
+                        self._url,
+                        self._key,
+                        options=AsyncClientOptions(auto_refresh_token=False, persist_session=False)
+                    )
+        return self._async_supabase
+
 
 
 
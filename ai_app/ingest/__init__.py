@@ -0,0 +1,165 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List
+from database import EmbeddingCache, RedisStore, SupabaseStore
+from config import Config
+from metrics import metrics
+
+# Nhãn của các cột hồ sơ khi render thành văn bản để embedding
+_LABELS = {
+    "full_name": "Tên",
+    "age": "Tuổi",
+    "gender": "Giới tính",
+    "location": "Nơi sống",
+    "bio": "Giới thiệu",
+    "interests": "Sở thích",
+    "job": "Công việc",
+}
+
+
+class ProfileIngestor:
+    """
+    Nạp hồ sơ từ bảng `profiles` của Supabase vào index vector `dating_app` (RedisVectorStore)
+    mà node store tìm kiếm.
+
+    Hồ sơ được đọc theo trang (keyset theo `id`), mỗi trang được xử lý song song với việc đọc
+    trang tiếp theo (tối đa INGEST_CONCURRENCY trang cùng lúc):
+        - render các cột INGEST_PROFILE_FIELDS thành văn bản và tính hash nội dung,
+        - bỏ qua hồ sơ có hash trùng với `content_hash` đã lưu trong index (không đổi từ lần trước),
+        - embedding các hồ sơ còn lại qua EmbeddingCache (theo lô, cache theo hash nội dung),
+        - ghi đè document `dating_app:{profile_id}` theo đúng định dạng của RedisVectorStore.
+    """
+
+    def __init__(self, supabase: SupabaseStore, store: RedisStore, embeddings=None, config: Config = None):
+        config = config or Config()
+        self._supabase = supabase
+        self._store = store
+        self._redis = store.aredis
+        self._cache = EmbeddingCache(store, embeddings, config)
+        self._page_size = config.ingest_page_size
+        self._concurrency = max(1, config.ingest_concurrency)
+        self._fields = config.ingest_profile_fields
+        self._updated_column = config.ingest_updated_column
+
+    def render_profile(self, profile: Dict[str, Any]) -> str:
+        lines = []
+        for field in self._fields:
+            value = profile.get(field)
+            if value in (None, "", [], {}):
+                continue
+            if isinstance(value, (list, tuple)):
+                value = ", ".join(str(item) for item in value)
+            lines.append(f"{_LABELS.get(field, field)}: {value}")
+        return "\n".join(lines)
+
+    async def _apages(self, since: str = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        client = await self._supabase.aget_client()
+        last_id = None
+        while True:
+            # Keyset thay vì offset: mỗi trang là một truy vấn theo index của khoá chính
+            query = client.table("profiles").select("*").order("id").limit(self._page_size)
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            if since:
+                query = query.gte(self._updated_column, since)
+            with metrics.timer("upstream_request_duration_seconds", errors="upstream_errors_total",
+                               upstream="supabase", operation="profiles_page"):
+                rows = (await query.execute()).data
+            if not rows:
+                return
+            yield rows
+            if len(rows) < self._page_size:
+                return
+            last_id = rows[-1]["id"]
+
+    async def _aingest_page(self, rows: List[Dict[str, Any]], report: Dict[str, int]) -> None:
+        config = self._store.store.config
+        profiles = []
+        for row in rows:
+            text = self.render_profile(row)
+            if text:
+                profiles.append((str(row["id"]), text, EmbeddingCache.content_hash(text)))
+        report["empty"] += len(rows) - len(profiles)
+
+        pipe = self._redis.pipeline(transaction=False)
+        for profile_id, _, _ in profiles:
+            pipe.hget(f"{config.key_prefix}:{profile_id}", "content_hash")
+        stored = await pipe.execute()
+        changed = [profile for profile, content_hash in zip(profiles, stored)
+                   if content_hash is None or content_hash.decode() != profile[2]]
+        report["unchanged"] += len(profiles) - len(changed)
+        if not changed:
+            return
+
+        vectors = await self._cache.aembed_documents([text for _, text, _ in changed],
+                                                     [content_hash for _, _, content_hash in changed])
+        pipe = self._redis.pipeline(transaction=False)
+        for (profile_id, text, content_hash), vector in zip(changed, vectors):
+            pipe.hset(f"{config.key_prefix}:{profile_id}", mapping={
+                config.content_field: text,
+                config.embedding_field: vector.tobytes(),
+                "profile_id": profile_id,
+                "content_hash": content_hash,
+            })
+        await pipe.execute()
+        report["upserted"] += len(changed)
+        metrics.inc("ingest_profiles_total", len(changed), result="upserted")
+
+    async def _aprune(self, seen: set) -> int:
+        """Xoá document của các hồ sơ không còn trong Supabase."""
+        prefix = f"{self._store.store.config.key_prefix}:"
+        stale = []
+        async for key in self._redis.scan_iter(match=f"{prefix}*", count=1000):
+            if key.decode()[len(prefix):] not in seen:
+                stale.append(key)
+        for start in range(0, len(stale), 1000):
+            await self._redis.delete(*stale[start:start + 1000])
+        return len(stale)
+
+    async def arun(self, since: str = None, prune: bool = False) -> Dict[str, Any]:
+        """
+        Args:
+            since: chỉ nạp hồ sơ có INGEST_UPDATED_COLUMN từ thời điểm này (ISO 8601), None là toàn bộ.
+            prune: sau khi nạp toàn bộ, xoá document của hồ sơ đã bị xoá khỏi Supabase.
+
+        Returns:
+            Số hồ sơ đã đọc, bỏ qua, ghi, lỗi và số lần gọi API embedding.
+        """
+        start = time.perf_counter()
+        # Tạo index (nếu chưa có) trước khi ghi document
+        await asyncio.to_thread(lambda: self._store.store)
+        hits, misses, api_calls = self._cache.hits, self._cache.misses, self._cache.api_calls
+        report = {"read": 0, "empty": 0, "unchanged": 0, "upserted": 0, "failed": 0, "pruned": 0}
+        seen, tasks = set(), set()
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def ingest(rows):
+            try:
+                await self._aingest_page(rows, report)
+            except Exception as e:
+                # Lần chạy sau sẽ thử lại các hồ sơ này vì content_hash chưa được cập nhật
+                print(f"Error ingesting profiles {rows[0]['id']}..{rows[-1]['id']}: {e}")
+                report["failed"] += len(rows)
+                metrics.inc("ingest_profiles_total", len(rows), result="failed")
+            finally:
+                semaphore.release()
+
+        async for rows in self._apages(since):
+            report["read"] += len(rows)
+            seen.update(str(row["id"]) for row in rows)
+            await semaphore.acquire()
+            task = asyncio.create_task(ingest(rows))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+        if prune and not since and not report["failed"]:
+            report["pruned"] = await self._aprune(seen)
+        metrics.inc("ingest_profiles_total", report["unchanged"], result="unchanged")
+
+        report["embedded"] = self._cache.misses - misses
+        report["embedding_cache_hits"] = self._cache.hits - hits
+        report["embedding_api_calls"] = self._cache.api_calls - api_calls
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        report["profiles_per_second"] = round(report["read"] / report["seconds"], 1) if report["seconds"] else 0.0
+        return report
@@ -0,0 +1,23 @@
+"""
+Nạp hồ sơ người dùng từ Supabase vào index vector `dating_app` dùng cho node store.
+
+    python ingest_profiles.py                                # toàn bộ hồ sơ
+    python ingest_profiles.py --since 2024-12-01T00:00:00Z   # chỉ hồ sơ cập nhật từ thời điểm này
+    python ingest_profiles.py --prune                        # xoá document của hồ sơ đã bị xoá
+
+Chạy lại an toàn: hồ sơ không đổi nội dung được bỏ qua, embedding được cache theo hash nội dung.
+"""
+import argparse
+import asyncio
+import json
+from database import RedisStore, SupabaseStore
+from ingest import ProfileIngestor
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest Supabase profiles into the dating_app vector index")
+    parser.add_argument("--since", help="Only profiles updated at or after this ISO 8601 timestamp")
+    parser.add_argument("--prune", action="store_true", help="Delete documents of profiles no longer in Supabase (full runs only)")
+    args = parser.parse_args()
+    ingestor = ProfileIngestor(SupabaseStore(), RedisStore())
+    report = asyncio.run(ingestor.arun(since=args.since, prune=args.prune))
+    print(json.dumps(report, indent=2))
@@ -1,10 +1,78 @@
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from workflow import Flow
+from admission import Overloaded, limiter
 from database import RedisStore
 from datetime import datetime
 from pydantic import BaseModel
-app = FastAPI()
+from typing import List, Optional
+from registry import registry
+from config import Config
+from metrics import metrics
+import asyncio
+import json
+import os
+import time
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if config.warm_before_serve:
+        # uvicorn chỉ nhận request trên socket sau khi lifespan startup xong, nên mỗi worker
+        # (serve.py) warm-up xong mới nhận traffic
+        try:
+            await asyncio.wait_for(flow.warm(), config.warm_timeout)
+        except Exception as e:
+            print(f"Warm-up failed: {e!r}")
+        yield
+        return
+
+    # Khởi tạo client ở background, /ready trả về 503 cho tới khi xong
+    async def warm():
+        try:
+            await flow.warm()
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+
+    warm_task = asyncio.create_task(warm())
+    yield
+    warm_task.cancel()
+
+
+class WorkerStats:
+    """
+    ASGI middleware đếm request của worker hiện tại và gắn header X-Worker-Id (pid) vào response,
+    để phân biệt các worker của serve.py sau cùng một cổng.
+    """
+
+    started = time.time()
+    inflight = 0
+    served = 0
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_worker(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-worker-id", str(os.getpid()).encode())]
+            await send(message)
+
+        WorkerStats.inflight += 1
+        try:
+            await self.app(scope, receive, send_with_worker)
+        finally:
+            WorkerStats.inflight -= 1
+            WorkerStats.served += 1
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(WorkerStats)
 # store = RedisStore()
 # Cấu hình CORS
 app.add_middleware(
@@ -16,11 +84,34 @@ app.add_middleware(
 )
 
 flow = Flow()
+config = Config()
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request, exc: Overloaded):
+    # Quá tải (hàng chờ của admission control hoặc của upstream): client thử lại sau Retry-After giây
+    return JSONResponse({"detail": str(exc)}, status_code=429, headers={"Retry-After": str(exc.retry_after)})
+
 
 class ChatRequest(BaseModel):
     question: str
     chat_id: str
     profile_id: str
+    # Id do client tạo cho mỗi câu hỏi và giữ nguyên khi thử lại (CHECKPOINT_ENABLED)
+    request_id: Optional[str] = None
+
+
+class ChatBatchRequest(BaseModel):
+    requests: List[ChatRequest]
+
+
+def _chat_response(result) -> dict:
+    return {
+        "result": result.get("final_generation", ""),
+        "error": result.get("error", None),
+        "grader_latency": result.get("grader_latency", []),
+        "deadline_exceeded": result.get("deadline_exceeded", False)
+    }
 
 
 @app.get("/")
@@ -28,14 +119,94 @@ async def root():
     print(flow.get_graph())
     return {"message": "Hello World"}
 
+@app.get("/ready")
+async def ready():
+    status = registry.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/health")
+async def health():
+    # Trạng thái của riêng worker trả lời request này (mỗi worker của serve.py có pid riêng)
+    status = registry.status()
+    status.update({
+        "worker": os.getpid(),
+        "uptime_seconds": round(time.time() - WorkerStats.started, 1),
+        "inflight": WorkerStats.inflight,
+        "served": WorkerStats.served,
+        "admission": {name: limiter(name).status() for name in ("chat", *config.upstream_concurrency)},
+    })
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
 @app.post("/mobile/chat")
 async def chat(request: ChatRequest):
-    result = flow.run(request.question, request.chat_id, request.profile_id)
-    final_result = {
-        "result": result.get("final_generation", ""),
-        "error": result.get("error", None)
-    }
-    return final_result
+    # Hạn chót tính từ lúc request tới, bao gồm thời gian chờ lượt trước của chat và chờ admission control
+    deadline = flow.deadline(config.request_budget_for("/mobile/chat"))
+    with metrics.timer("request_duration_seconds", errors="request_errors_total", endpoint="/mobile/chat"):
+        result = await flow.arun(request.question, request.chat_id, request.profile_id,
+                                 request_id=request.request_id, deadline=deadline)
+    return _chat_response(result)
+
+
+@app.post("/mobile/chat/batch")
+async def chat_batch(batch: ChatBatchRequest):
+    # Mỗi phần tử của "results" ứng với request cùng vị trí, giống response của /mobile/chat;
+    # request lỗi chỉ làm hỏng phần tử của nó (request bị admission control từ chối có thêm "retry_after"),
+    # mọi request đều bị từ chối thì trả về 429
+    if len(batch.requests) > config.batch_max_requests:
+        return JSONResponse({"detail": f"At most {config.batch_max_requests} requests per batch"}, status_code=413)
+    deadline = flow.deadline(config.request_budget_for("/mobile/chat/batch"))
+    with metrics.timer("request_duration_seconds", errors="request_errors_total", endpoint="/mobile/chat/batch"):
+        results = await flow.abatch([request.model_dump() for request in batch.requests], deadline=deadline)
+    rejected = [result for result in results if isinstance(result, Overloaded)]
+    if rejected and len(rejected) == len(results):
+        raise max(rejected, key=lambda e: e.retry_after)
+    responses = []
+    for result in results:
+        if isinstance(result, Overloaded):
+            responses.append({"result": "", "error": [str(result)], "grader_latency": [],
+                              "deadline_exceeded": False, "retry_after": result.retry_after})
+        elif isinstance(result, BaseException):
+            print(f"Batch item failed: {result!r}")
+            responses.append({"result": "", "error": [f"Unexpected error: {result}"], "grader_latency": [],
+                              "deadline_exceeded": False})
+        else:
+            responses.append(_chat_response(result))
+    return {"results": responses}
+
+
+@app.post("/mobile/chat/stream")
+async def chat_stream(request: ChatRequest):
+    # Server-Sent Events: mỗi sự kiện của Flow.astream là một dòng "event" + "data"
+    deadline = flow.deadline(config.request_budget_for("/mobile/chat/stream"))
+    events = flow.astream(request.question, request.chat_id, request.profile_id,
+                          request_id=request.request_id, deadline=deadline)
+    # Chờ sự kiện đầu tiên trước khi gửi header, để request bị admission control từ chối nhận 429
+    first = await anext(events, None)
+
+    def encode(event) -> str:
+        return f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+    async def event_source():
+        if first is None:
+            return
+        yield encode(first)
+        async for event in events:
+            yield encode(event)
+
+    return StreamingResponse(event_source(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Định dạng text của Prometheus (exposition format 0.0.4)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/mobile/chat/cache")
+async def cache_stats():
+    return await flow.cache_stats()
 
 
 # @app.get("/mobile/chat/{profile_id}")
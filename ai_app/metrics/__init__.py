@@ -0,0 +1,279 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Bucket (giây) mặc định cho histogram độ trễ
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Giá (USD / 1 triệu token) đầu vào, đầu ra của các model đang dùng
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "llama3-groq-70b-8192-tool-use-preview": (0.89, 0.89),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+}
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"'.replace("\n", " ") for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """
+    Counter và histogram trong process, xuất ra định dạng text của Prometheus (endpoint /metrics).
+
+    Mỗi lần ghi chỉ là một thao tác dict dưới lock nên gần như không tốn thời gian trên hot path.
+    Metric phải được khai báo bằng `counter`/`histogram` trước khi dùng.
+    """
+
+    def __init__(self, prefix: str = "ai_app"):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._buckets: Dict[str, tuple] = {}
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, _Histogram]] = {}
+
+    def counter(self, name: str, help: str) -> None:
+        self._meta[name] = ("counter", help)
+        self._counters.setdefault(name, {})
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self._meta[name] = ("histogram", help)
+        self._buckets[name] = tuple(buckets)
+        self._histograms.setdefault(name, {})
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms[name]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self._buckets[name])
+            histogram.observe(value)
+
+    def value(self, name: str, **labels) -> float:
+        """Giá trị hiện tại của một counter (0 nếu chưa có), hoặc số lần quan sát của một histogram."""
+        key = _labels(labels)
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name].get(key, 0.0)
+            histogram = self._histograms[name].get(key)
+            return histogram.count if histogram else 0
+
+    def total(self, name: str) -> float:
+        """Tổng của một counter (hoặc tổng số lần quan sát của một histogram) trên mọi nhãn."""
+        with self._lock:
+            if name in self._counters:
+                return sum(self._counters[name].values())
+            return sum(histogram.count for histogram in self._histograms[name].values())
+
+    @contextmanager
+    def timer(self, name: str, errors: str = None, **labels):
+        """Đo thời gian khối lệnh vào histogram `name`; nếu có lỗi thì tăng counter `errors`."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if errors:
+                self.inc(errors, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, errors: str = None, **labels):
+        """Decorator của `timer` cho cả hàm thường và coroutine."""
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(name, errors, **labels):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, errors, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self) -> None:
+        with self._lock:
+            for series in self._counters.values():
+                series.clear()
+            for series in self._histograms.values():
+                series.clear()
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help) in sorted(self._meta.items()):
+                full_name = f"{self._prefix}_{name}"
+                lines.append(f"# HELP {full_name} {help}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                if kind == "counter":
+                    for labels, value in sorted(self._counters[name].items()):
+                        lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                for labels, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        bucket = _format_labels(labels, 'le="%s"' % bound)
+                        lines.append(f"{full_name}_bucket{bucket} {cumulative}")
+                    bucket = _format_labels(labels, 'le="+Inf"')
+                    lines.append(f"{full_name}_bucket{bucket} {histogram.count}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+metrics.histogram("request_duration_seconds", "Thời gian xử lý request theo endpoint")
+metrics.counter("request_errors_total", "Số request lỗi theo endpoint")
+metrics.histogram("graph_node_duration_seconds", "Thời gian chạy mỗi node của graph")
+metrics.counter("graph_node_errors_total", "Số lần node của graph raise lỗi")
+metrics.counter("graph_retries_total", "Số lần grade_generation quay lại vòng retry (loop_step), theo lý do")
+metrics.counter("summary_conflicts_total", "Số lần bản tóm tắt không được ghi vì worker khác đã ghi bản mới hơn")
+metrics.counter("route_decisions_total", "Quyết định của node route theo nguồn dữ liệu và cách quyết định")
+metrics.counter("grader_verdicts_total", "Kết quả của các grader")
+metrics.counter("prompt_context_tokens_total", "Token ngữ cảnh của generate trước (raw) và sau (built) khi dựng prompt")
+metrics.counter("prompt_documents_total", "Số tài liệu được giữ/bỏ khi dựng prompt của generate")
+metrics.counter("deadline_exceeded_total", "Số node bị huỷ vì hết ngân sách thời gian của request")
+metrics.counter("deadline_answers_total", "Câu trả lời trả về khi hết ngân sách thời gian: bản nháp hoặc câu trả lời dự phòng")
+metrics.counter("chat_coalesced_total", "Số request trùng dùng lại kết quả của request khác, theo phạm vi process/redis")
+metrics.histogram("chat_lock_wait_seconds", "Thời gian chờ tới lượt xử lý của chat")
+metrics.counter("chat_lock_timeouts_total", "Số lần chờ lock của chat quá CHAT_LOCK_WAIT")
+metrics.histogram("admission_queue_wait_seconds", "Thời gian chờ slot theo limiter: chat (admission control) hoặc upstream")
+metrics.counter("admission_rejected_total", "Số việc bị limiter từ chối theo lý do queue_full/timeout")
+metrics.counter("graph_checkpoints_total", "Checkpoint của graph ghi vào Redis: saved, too_large (vượt CHECKPOINT_MAX_BYTES) hoặc error")
+metrics.counter("graph_resumes_total", "Request có request_id đã có checkpoint: resumed (chạy tiếp) hoặc finished (trả lại kết quả)")
+metrics.counter("profile_store_results_total", "Kết quả tìm hồ sơ của node store: hit/miss/error")
+metrics.counter("ingest_profiles_total", "Số hồ sơ được nạp vào index vector theo kết quả upserted/unchanged/failed")
+metrics.histogram("llm_request_duration_seconds", "Thời gian mỗi lần gọi LLM")
+metrics.counter("llm_errors_total", "Số lần gọi LLM bị lỗi")
+metrics.counter("llm_tokens_total", "Số token LLM theo loại prompt/completion")
+metrics.counter("llm_cost_usd_total", "Chi phí LLM ước tính theo MODEL_PRICES (USD)")
+metrics.counter("llm_hedges_total", "Hedge của lời gọi LLM theo model chính: fired, won (model dự phòng về trước), lost, capped")
+metrics.histogram("llm_hedge_delay_seconds", "Ngưỡng chờ model chính trước khi hedge")
+metrics.histogram("llm_batch_items", "Số mục trong mỗi lời gọi LLM gộp của LLMBatcher theo loại",
+                  buckets=(1, 2, 3, 5, 10, 20, 50))
+metrics.counter("llm_batch_missing_total", "Số mục thiếu trong câu trả lời gộp, phải gọi lại riêng")
+metrics.histogram("upstream_request_duration_seconds", "Thời gian mỗi request tới Serper/Redis/Supabase")
+metrics.counter("upstream_errors_total", "Số request tới Serper/Redis/Supabase bị lỗi hoặc quá hạn")
+metrics.counter("upstream_retries_total", "Số lần retry request tới upstream")
+metrics.counter("upstream_cache_total", "Cache kết quả upstream theo hit/miss")
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Callback LangChain ghi độ trễ, token và chi phí của mọi lần gọi chat model trong một lần chạy graph.
+    Truyền qua `config={"callbacks": [...]}` nên áp dụng cả cho model giả lập trong benchmark.
+    """
+    # Chạy ngay trong event loop thay vì đẩy sang thread pool
+    run_inline = True
+
+    def __init__(self, registry: Metrics = metrics):
+        self._metrics = registry
+        self._runs: Dict[object, Tuple[float, str]] = {}
+
+    @property
+    def ignore_chain(self) -> bool:
+        return True
+
+    @property
+    def ignore_retriever(self) -> bool:
+        return True
+
+    @property
+    def ignore_agent(self) -> bool:
+        return True
+
+    @staticmethod
+    def _model_name(serialized, kwargs) -> str:
+        params = kwargs.get("invocation_params") or {}
+        name = params.get("model_name") or params.get("model")
+        if not name and serialized:
+            name = (serialized.get("kwargs") or {}).get("model_name") or serialized.get("name")
+        return name or params.get("_type", "unknown")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[run_id] = (time.perf_counter(), self._model_name(serialized, kwargs))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._runs[run_id] = (time.perf_counter(), self._model_name(serialized, kwargs))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start, model = self._runs.pop(run_id, (None, "unknown"))
+        if start is not None:
+            self._metrics.observe("llm_request_duration_seconds", time.perf_counter() - start, model=model)
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        if not usage:
+            for generations in response.generations:
+                for generation in generations:
+                    usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens += usage_metadata.get("input_tokens", 0)
+                    completion_tokens += usage_metadata.get("output_tokens", 0)
+        if not prompt_tokens and not completion_tokens:
+            return
+
+        self._metrics.inc("llm_tokens_total", prompt_tokens, model=model, type="prompt")
+        self._metrics.inc("llm_tokens_total", completion_tokens, model=model, type="completion")
+        prices = MODEL_PRICES.get(model)
+        if prices:
+            cost = (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+            self._metrics.inc("llm_cost_usd_total", cost, model=model)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        start, model = self._runs.pop(run_id, (None, "unknown"))
+        if isinstance(error, asyncio.CancelledError):
+            # Lời gọi bị huỷ (hedge thua, hết ngân sách thời gian) không phải lỗi của model
+            return
+        if start is not None:
+            self._metrics.observe("llm_request_duration_seconds", time.perf_counter() - start, model=model)
+        self._metrics.inc("llm_errors_total", model=model)
+
+
+llm_metrics = LLMMetricsCallback()
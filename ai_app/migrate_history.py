@@ -0,0 +1,17 @@
+"""
+Chuyển lịch sử chat cũ (RedisJSON, một document cho cả cuộc trò chuyện) sang Redis list
+dùng với HISTORY_STORAGE=list.
+
+    python migrate_history.py --pattern "chat:*"
+
+Các key chưa được chuyển vẫn hoạt động: RedisStore tự chuyển đổi key khi gặp lỗi WRONGTYPE.
+"""
+import argparse
+from database import RedisStore
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate JSON chat histories to Redis lists")
+    parser.add_argument("--pattern", default="chat:*")
+    args = parser.parse_args()
+    migrated = RedisStore().migrate_all_histories(args.pattern)
+    print(f"Migrated {migrated} chat histories")
@@ -1,11 +1,28 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.callbacks.manager import BaseCallbackManager
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables.config import ensure_config
 from langchain_groq import ChatGroq
 from langchain_openai import ChatOpenAI
+from admission import limiter
+from config import Config
+from registry import registry
+from metrics import metrics
 from dotenv import load_dotenv
 load_dotenv()
 
 class Groq:
-    def __init__(self):
-        self._model_name = "llama3-groq-70b-8192-tool-use-preview"
+    # Tên upstream trong UPSTREAM_CONCURRENCY
+    upstream = "groq"
+
+    def __init__(self, model_name: str = None):
+        self._model_name = model_name or "llama3-groq-70b-8192-tool-use-preview"
         self._temperature = 0.0
 
     def llm(self):
@@ -16,8 +33,10 @@ class Groq:
 
 
 class ChatGPT:
-    def __init__(self):
-        self._model_name = "gpt-4o-mini"
+    upstream = "openai"
+
+    def __init__(self, model_name: str = None):
+        self._model_name = model_name or "gpt-4o-mini"
         self._temperature = 0.0
 
     def llm(self):
@@ -25,3 +44,354 @@ class ChatGPT:
 
     def llm_json_model(self):
         return ChatOpenAI(model_name=self._model_name, temperature=self._temperature, model_kwargs={"response_format": {"type": "json_object"}})
+
+
+# Nhà cung cấp dùng trong MODEL_FAST/MODEL_STRONG/MODEL_NODES
+PROVIDERS = {"groq": Groq, "chatgpt": ChatGPT}
+
+
+class _FirstToken(BaseCallbackHandler):
+    """Đánh dấu khi model stream token đầu tiên (chỉ được gọi khi lời gọi đang được stream)."""
+    run_inline = True
+
+    def __init__(self, started: asyncio.Event):
+        self._started = started
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._started.set()
+
+
+class LimitedModel:
+    """
+    Bọc một chat model để mọi lời gọi bất đồng bộ giữ một slot của limiter của nhà cung cấp
+    (`upstream` trong UPSTREAM_CONCURRENCY), nên một đợt request tăng vọt không gửi quá số lời gọi
+    đồng thời đó tới provider. Lời gọi chờ slot quá lâu raise Overloaded như một lỗi của model.
+    """
+
+    def __init__(self, model, upstream: str):
+        self._model = model
+        self._upstream = upstream
+
+    def bind_tools(self, tools, **kwargs):
+        return LimitedModel(self._model.bind_tools(tools, **kwargs), self._upstream)
+
+    def invoke(self, input, config=None, **kwargs):
+        return self._model.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        async with limiter(self._upstream).slot():
+            return await self._model.ainvoke(input, config, **kwargs)
+
+
+class HedgeBudget:
+    """
+    Ngưỡng hedge thích ứng và giới hạn tỉ lệ hedge cho một model chính.
+
+    Ngưỡng là phân vị HEDGE_PERCENTILE của độ trễ gần đây của model chính (HEDGE_INITIAL_DELAY
+    khi chưa đủ HEDGE_MIN_SAMPLES mẫu, không nhỏ hơn HEDGE_MIN_DELAY); tỉ lệ hedge trên (tối đa)
+    HEDGE_WINDOW lời gọi gần nhất không vượt quá HEDGE_MAX_RATE, kể cả khi mới khởi động.
+    """
+
+    def __init__(self, config: Config):
+        self._percentile = config.hedge_percentile
+        self._initial_delay = config.hedge_initial_delay
+        self._min_delay = config.hedge_min_delay
+        self._min_samples = config.hedge_min_samples
+        self._max_rate = config.hedge_max_rate
+        self._latencies = deque(maxlen=config.hedge_window)
+        self._hedged = deque(maxlen=config.hedge_window)
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        with self._lock:
+            if len(self._latencies) < self._min_samples:
+                return self._initial_delay
+            ordered = sorted(self._latencies)
+        index = max(0, math.ceil(self._percentile / 100 * len(ordered)) - 1)
+        return max(self._min_delay, ordered[index])
+
+    def observe(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def allow(self) -> bool:
+        # Chia cho số lời gọi đã thấy (ít nhất 1/HEDGE_MAX_RATE) chứ không cho cả cửa sổ, để lúc
+        # mới khởi động cũng không hedge quá tỉ lệ cho phép. Lần hedge được ghi nhận ngay khi cho
+        # phép, nên các lời gọi đồng thời thấy nhau và lời gọi bị huỷ giữa chừng vẫn được tính.
+        with self._lock:
+            if self._max_rate <= 0 or sum(self._hedged) + 1 > max(self._max_rate * len(self._hedged), 1.0):
+                return False
+            self._hedged.append(True)
+            return True
+
+    def record(self, hedged: bool) -> None:
+        with self._lock:
+            self._hedged.append(hedged)
+
+
+class HedgedModel:
+    """
+    Bọc một chat model (đã tạo qua Groq/ChatGPT) để giảm độ trễ đuôi: nếu model chính chưa trả lời
+    sau ngưỡng của HedgeBudget, gửi cùng request tới model dự phòng, lấy kết quả về trước và huỷ
+    request còn lại.
+
+    Khi lời gọi đang được stream (astream_events), "trả lời" là token đầu tiên, nên client chỉ
+    nhận token của một model. Cả hai lời gọi đều chạy với callbacks của node nên metrics ghi đúng
+    model đã trả lời. Lời gọi bị huỷ không được tính token/chi phí.
+    """
+
+    def __init__(self, primary, secondary, budget: HedgeBudget, primary_spec: str, secondary_spec: str):
+        self._primary = primary
+        self._secondary = secondary
+        self._budget = budget
+        self._primary_spec = primary_spec
+        self._secondary_spec = secondary_spec
+
+    def bind_tools(self, tools, **kwargs):
+        return HedgedModel(self._primary.bind_tools(tools, **kwargs), self._secondary.bind_tools(tools, **kwargs),
+                           self._budget, self._primary_spec, self._secondary_spec)
+
+    def invoke(self, input, config=None, **kwargs):
+        return self._primary.invoke(input, config, **kwargs)
+
+    @staticmethod
+    def _start(model, input, config, **kwargs):
+        started = asyncio.Event()
+        handler = _FirstToken(started)
+        callbacks = config.get("callbacks")
+        if isinstance(callbacks, BaseCallbackManager):
+            callbacks = callbacks.copy()
+            callbacks.add_handler(handler, inherit=False)
+        else:
+            callbacks = list(callbacks or []) + [handler]
+        task = asyncio.create_task(model.ainvoke(input, {**config, "callbacks": callbacks}, **kwargs))
+        task.add_done_callback(lambda _: started.set())
+        return task, started
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        config = ensure_config(config)
+        start = time.perf_counter()
+        delay = self._budget.delay()
+        primary, primary_started = self._start(self._primary, input, config, **kwargs)
+        secondary = None
+        try:
+            try:
+                await asyncio.wait_for(primary_started.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+            if not primary_started.is_set():
+                if self._budget.allow():
+                    metrics.inc("llm_hedges_total", model=self._primary_spec, result="fired")
+                    metrics.observe("llm_hedge_delay_seconds", delay, model=self._primary_spec)
+                    secondary, secondary_started = self._start(self._secondary, input, config, **kwargs)
+                    waiters = {asyncio.ensure_future(primary_started.wait()): primary,
+                               asyncio.ensure_future(secondary_started.wait()): secondary}
+                    try:
+                        done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        for waiter in waiters:
+                            waiter.cancel()
+                    winner = waiters[done.pop()]
+                    # Bên về trước bị lỗi thì vẫn chờ bên còn lại
+                    if winner.done() and winner.exception() is not None:
+                        winner = secondary if winner is primary else primary
+                    loser = secondary if winner is primary else primary
+                    loser.cancel()
+                    metrics.inc("llm_hedges_total", model=self._primary_spec,
+                                result="won" if winner is secondary else "lost")
+                    if winner is secondary:
+                        self._budget.observe(time.perf_counter() - start)
+                    return await winner
+                metrics.inc("llm_hedges_total", model=self._primary_spec, result="capped")
+
+            await primary_started.wait()
+            self._budget.observe(time.perf_counter() - start)
+            self._budget.record(False)
+            return await primary
+        finally:
+            for task in (primary, secondary):
+                if task is not None and not task.done():
+                    task.cancel()
+
+
+class LLMBatcher:
+    """
+    Gộp các lời gọi LLM cùng loại (cùng system prompt, mỗi lời gọi chấm một mục) của nhiều request
+    chạy đồng thời thành một lời gọi chứa nhiều mục, và trả về kết quả JSON của từng mục.
+
+    Chat completions của OpenAI/Groq chỉ nhận một hội thoại mỗi request (Batch API của OpenAI trả
+    kết quả sau nhiều giờ, `abatch` của LangChain chỉ là các request song song), nên lô ở đây là một
+    prompt nhiều mục: system prompt chỉ gửi một lần và số lời gọi giảm theo số mục mỗi lô.
+
+    Các mục đến trong LLM_BATCH_WINDOW giây được gộp, tối đa LLM_BATCH_MAX_ITEMS mục mỗi lời gọi.
+    Lô chỉ có một mục dùng prompt gốc; mục bị thiếu trong câu trả lời gộp được gọi lại riêng.
+
+    Args:
+        kind: tên loại lời gọi trong metrics (route, grade_docs).
+        model: hàm trả về model JSON (lấy lại mỗi lần để dùng model hiện tại trong registry).
+        instructions: system prompt chung.
+        single: hàm dựng human prompt cho một mục.
+        packed: template human prompt nhiều mục, với `{items}`.
+        render: hàm dựng phần của một mục trong prompt nhiều mục, từ (id, mục).
+        parse: hàm chuyển câu trả lời của model thành dict.
+    """
+
+    def __init__(self, kind: str, model: Callable[[], Any], instructions: str, single: Callable[[Any], str],
+                 packed: str, render: Callable[[int, Any], str], parse: Callable[[Any], Dict[str, Any]],
+                 config: Config = None):
+        config = config or Config()
+        self._kind = kind
+        self._model = model
+        self._instructions = instructions
+        self._single = single
+        self._packed = packed
+        self._render = render
+        self._parse = parse
+        self._window = config.llm_batch_window
+        self._max_items = max(1, config.llm_batch_max_items)
+        self._pending: List[tuple] = []
+        self._timer = None
+        self._tasks = set()
+
+    async def ainvoke(self, item) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self._max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self._max_items], self._pending[self._max_items:]
+            # Mục của request đã bị huỷ (hết deadline) không cần chấm
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if batch:
+                task = asyncio.create_task(self._run(batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _invoke_single(self, item, future: asyncio.Future) -> None:
+        try:
+            response = await self._model().ainvoke([SystemMessage(content=self._instructions),
+                                                    HumanMessage(content=self._single(item))])
+            result = self._parse(response)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
+
+    async def _run(self, batch: List[tuple]) -> None:
+        metrics.observe("llm_batch_items", len(batch), kind=self._kind)
+        if len(batch) == 1:
+            await self._invoke_single(*batch[0])
+            return
+
+        items = "\n\n".join(self._render(index, item) for index, (item, _) in enumerate(batch))
+        try:
+            response = await self._model().ainvoke([SystemMessage(content=self._instructions),
+                                                    HumanMessage(content=self._packed.format(items=items))])
+            results = {}
+            for result in self._parse(response).get("results", []):
+                if isinstance(result, dict) and str(result.get("id", "")).isdigit():
+                    results[int(result["id"])] = result
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        missing = []
+        for index, (item, future) in enumerate(batch):
+            if index not in results:
+                missing.append((item, future))
+            elif not future.done():
+                future.set_result(results[index])
+        if missing:
+            metrics.inc("llm_batch_missing_total", len(missing), kind=self._kind)
+            await asyncio.gather(*(self._invoke_single(item, future) for item, future in missing))
+
+
+class ModelPolicy:
+    """
+    Chọn model cho các lần gọi LLM của từng node theo tier.
+
+    Tier `fast` (MODEL_FAST) cho các việc phân loại ngắn: route, chọn kiểu tìm kiếm của web,
+    các grader và tóm tắt lịch sử; tier `strong` (MODEL_STRONG) cho generate và tools (gọi tool
+    và trả lời từ kết quả tool). MODEL_NODES ghi đè từng node bằng tên tier hoặc một model
+    "<nhà cung cấp>:<model>".
+
+    Mỗi model là một client dùng chung trong process, đăng ký trong registry với tên
+    `llm:{model}` và `llm_json_model:{model}`, và được dùng qua LimitedModel để giới hạn số lời gọi
+    đồng thời tới nhà cung cấp (UPSTREAM_CONCURRENCY). Khi HEDGE_ENABLED và model có model dự phòng
+    trong HEDGE_MODELS, node nhận HedgedModel bọc hai client đó (`hedged:llm:{model}`).
+    """
+    NODES = {
+        "route": "fast",
+        "web": "fast",
+        "grade_docs": "fast",
+        "grade_generation": "fast",
+        "summary": "fast",
+        "generate": "strong",
+        "tools": "strong",
+    }
+
+    def __init__(self, config: Config = None):
+        config = config or Config()
+        self._tiers = {"fast": config.model_fast, "strong": config.model_strong}
+        self._nodes = {**self.NODES, **config.model_nodes}
+        self._config = config
+
+    def spec(self, node: str) -> str:
+        """Model "<nhà cung cấp>:<model>" của node."""
+        choice = self._nodes.get(node, "strong")
+        return self._tiers.get(choice, choice)
+
+    def specs(self) -> set:
+        return {self.spec(node) for node in self._nodes}
+
+    def tier(self, name: str) -> str:
+        return self._tiers[name]
+
+    @staticmethod
+    def registry_key(kind: str, spec: str) -> str:
+        return f"{kind}:{spec}"
+
+    @staticmethod
+    def provider(spec: str):
+        provider = spec.partition(":")[0]
+        try:
+            return PROVIDERS[provider.strip().lower()]
+        except KeyError:
+            raise ValueError(f"Unknown model provider '{provider}' in '{spec}', expected one of {', '.join(PROVIDERS)}")
+
+    @staticmethod
+    def create(spec: str):
+        return ModelPolicy.provider(spec)(spec.partition(":")[2].strip() or None)
+
+    def _client(self, kind: str, spec: str):
+        client = registry.get(self.registry_key(kind, spec), lambda: getattr(self.create(spec), kind)())
+        return LimitedModel(client, self.provider(spec).upstream)
+
+    def _get(self, kind: str, node: str):
+        spec = self.spec(node)
+        secondary = self._config.hedge_models.get(spec)
+        if not self._config.hedge_enabled or not secondary or secondary == spec:
+            return self._client(kind, spec)
+        # Ngưỡng hedge dùng chung cho lời gọi thường và JSON của cùng một model chính
+        budget = registry.get(f"hedge_budget:{spec}", lambda: HedgeBudget(self._config))
+        return registry.get(f"hedged:{self.registry_key(kind, spec)}", lambda: HedgedModel(
+            self._client(kind, spec), self._client(kind, secondary), budget, spec, secondary))
+
+    def llm(self, node: str):
+        return self._get("llm", node)
+
+    def llm_json_model(self, node: str):
+        return self._get("llm_json_model", node)
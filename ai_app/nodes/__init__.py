@@ -1,27 +1,194 @@
 from langchain.schema.messages import AIMessage, HumanMessage, SystemMessage
 from langchain.schema.document import Document
 from html import unescape
+import asyncio
 import json
-from typing import Dict, Any
+import time
+import weakref
+from typing import Dict, Any, List
 from database import RedisStore, SupabaseStore
-from models import Groq, ChatGPT
+from models import LLMBatcher, ModelPolicy
+from admission import Overloaded
 import redis
 from prompts import Prompt
 from tools import WebSearch, Chat
+from config import Config
+from router import LocalRouter
+from context import ContextBuilder
+from registry import registry
+from metrics import metrics, llm_metrics
+
+# Tag gắn cho các lần gọi LLM sinh câu trả lời cho người dùng, dùng để lọc token khi stream
+ANSWER_TAG = "answer"
+
 class Nodes:
     def __init__(self):
-        self._store = RedisStore()
-        self._model = ChatGPT()
-        self._llm = self._model.llm()
-        self._llm_json_model = self._model.llm_json_model()
-        self._retriver = self._store.as_retriver()
+        self._config = Config()
+        # Model của từng node theo tier fast/strong (MODEL_FAST, MODEL_STRONG, MODEL_NODES)
+        self._models = ModelPolicy(self._config)
         self._prompt = Prompt()
-        self._websearch = WebSearch()
-        self._chat = Chat()
-        self._llm_bind_tools = self._chat.get_llm_binds_tools()
-        self._supabase_store = SupabaseStore()
-        self._tool_node = self._chat.get_tool_node()
-        self._client = self._supabase_store.get_client()
+        self._router = LocalRouter(temperature=self._config.router_temperature,
+                                   min_coverage=self._config.router_min_coverage) if self._config.router_local_enabled else None
+        self._context = ContextBuilder(self._config)
+        # warm() tắt node store khi index hồ sơ chưa có document nào
+        self._profile_store_ready = True
+        self._max_history_length = 5
+        # Lock tự được giải phóng khi không còn task nào của chat đó giữ tham chiếu
+        self._summary_locks = weakref.WeakValueDictionary()
+        self._background_tasks = set()
+        # Request của /mobile/chat/batch gộp lời gọi route và chấm tài liệu với nhau
+        prompt = self._prompt
+        self._route_batcher = LLMBatcher(
+            "route", lambda: self._llm_json_model("route"), prompt.route_intructions,
+            lambda question: question, prompt.route_batch_prompt,
+            lambda index, question: prompt.route_batch_item.format(id=index, question=question),
+            self._ai_to_json, self._config)
+        self._doc_grader_batcher = LLMBatcher(
+            "grade_docs", lambda: self._llm_json_model("grade_docs"), prompt.doc_grader_instructions,
+            lambda item: prompt.doc_grader_prompt.format(question=item[0], documents=item[1]),
+            prompt.doc_grader_batch_prompt,
+            lambda index, item: prompt.doc_grader_batch_item.format(id=index, question=item[0], documents=item[1]),
+            self._ai_to_json, self._config)
+
+    # Các client được tạo khi dùng lần đầu và dùng chung trong process qua registry
+    @property
+    def _store(self) -> RedisStore:
+        return registry.get("redis_store", RedisStore)
+
+    def _llm(self, node: str):
+        return self._models.llm(node)
+
+    def _llm_json_model(self, node: str):
+        return self._models.llm_json_model(node)
+
+    @property
+    def _retriver(self):
+        return self._store.as_retriver()
+
+    @property
+    def _websearch(self) -> WebSearch:
+        return registry.get("web_search", lambda: WebSearch(self._store.aredis if self._config.serper_cache_redis else None))
+
+    @property
+    def _chat(self) -> Chat:
+        return registry.get("chat", Chat)
+
+    @property
+    def _llm_bind_tools(self):
+        return self._chat.get_llm_binds_tools()
+
+    @property
+    def _tool_node(self):
+        return self._chat.get_tool_node()
+
+    async def warm(self) -> None:
+        """Khởi tạo trước các client và mở kết nối Redis để request đầu tiên không phải chờ."""
+        store = self._store
+        await store.aredis.ping()
+        _ = store.store, self._websearch, self._chat
+        await registry.get("supabase_store", SupabaseStore).aget_client()
+        for node in ModelPolicy.NODES:
+            _ = self._llm(node), self._llm_json_model(node)
+        await asyncio.to_thread(self._context.warm)
+        if self._config.profile_store_enabled:
+            await self._check_profile_store(store)
+        if self._config.warm_llm:
+            # Một lời gọi 1 token tới model của node route (tier fast) thay vì một lời gọi cho mỗi model,
+            # vì mỗi worker gửi nó mỗi lần khởi động
+            await self._warm_llm(self._llm("route"))
+
+    async def _check_profile_store(self, store: RedisStore) -> None:
+        # Index rỗng (chưa chạy ingest_profiles.py) thì mọi câu hỏi web chỉ tốn thêm một lượt tìm kiếm
+        try:
+            info = await store.aredis.ft(store.store.config.index_name).info()
+            documents = int(info.get("num_docs", 0))
+        except Exception as e:
+            print(f"Profile store check failed: {e}")
+            documents = 0
+        if not documents:
+            print("Profile index is empty, the store node is skipped until ingest_profiles.py has run")
+        self._profile_store_ready = documents > 0
+
+    @staticmethod
+    async def _warm_llm(model) -> None:
+        # Lời gọi đầu tiên tới provider phải bắt tay TLS và mở connection pool
+        try:
+            await model.ainvoke([HumanMessage(content="ok")], {"callbacks": [llm_metrics]}, max_tokens=1)
+        except Exception as e:
+            print(f"LLM warm-up failed: {e}")
+
+    def get_store(self):
+        return self._store
+
+    @staticmethod
+    def remaining(state: Dict[str, Any]):
+        """Số giây còn lại trước deadline của request, None nếu request không có deadline."""
+        deadline = state.get("deadline")
+        if not deadline:
+            return None
+        return max(0.0, deadline - time.time())
+
+    def expired(self, state: Dict[str, Any]) -> bool:
+        remaining = self.remaining(state)
+        return state.get("deadline_exceeded", False) or (remaining is not None and remaining <= 0)
+
+    async def deadline_answer(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Hết ngân sách thời gian: trả về câu trả lời tốt nhất đang có (bản nháp gần nhất của generate)
+        hoặc câu trả lời dự phòng, thay vì tiếp tục vòng retry.
+        """
+        question, generation = state["question"], state.get("generation")
+        if state.get("final_generation"):
+            answer = state["final_generation"]
+        elif generation and not state.get("error"):
+            answer = generation
+            metrics.inc("deadline_answers_total", result="draft")
+            await self.save_turn(state["chat_id"], question, answer)
+        else:
+            answer = self._prompt.deadline_fallback
+            metrics.inc("deadline_answers_total", result="fallback")
+        return {"final_generation": answer, "next_state": "deadline", "deadline_exceeded": True}
+
+    async def save_turn(self, chat_id: str, question: str, answer: str) -> None:
+        """Lưu một lượt hỏi đáp và cập nhật bản tóm tắt ở background, ngoài luồng xử lý request."""
+        await self._store.asave_history(chat_id, question, answer)
+        task = asyncio.create_task(self._update_summary(chat_id))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _update_summary(self, chat_id: str) -> None:
+        # Lock trong process chỉ tránh gọi LLM thừa; giữa các worker, asave_summary chỉ ghi nếu chưa
+        # worker nào ghi bản mới hơn (compare-and-set), lượt chưa gộp được lần cập nhật sau gộp tiếp
+        lock = self._summary_locks.get(chat_id)
+        if lock is None:
+            lock = self._summary_locks[chat_id] = asyncio.Lock()
+        try:
+            async with lock:
+                summary, through, total = await self._store.aget_summary(chat_id)
+                if summary:
+                    # Gộp mọi lượt lưu sau bản tóm tắt, không chỉ lượt vừa lưu
+                    pending = min(total - through, self._max_history_length)
+                    if pending <= 0:
+                        return
+                    turns = await self._store.aget_history(chat_id, -pending, -1)
+                    prompt = self._prompt.rolling_summary_prompt.format(summary=summary, turns=self._format_turns(turns))
+                else:
+                    # Chỉ bắt đầu tóm tắt khi lịch sử đủ dài, các chat cũ cũng được tóm tắt lần đầu ở đây
+                    chat_history = await self._store.aget_history(chat_id, -self._max_history_length, -1)
+                    if not chat_history or len(chat_history) <= 2:
+                        return
+                    prompt = self._prompt.history_summary_prompt.format(chat_history=chat_history)
+
+                summary = await self._llm("summary").ainvoke([HumanMessage(content=prompt)])
+                if not await self._store.asave_summary(chat_id, summary.content, total, through):
+                    metrics.inc("summary_conflicts_total")
+        except Exception as e:
+            print(f"Error while summarizing chat history: {e}")
+
+    @staticmethod
+    def _format_turns(turns: List[dict]) -> str:
+        return "\n".join(f"Câu hỏi: {turn.get('question', '')}\nTrả lời: {turn.get('answer', '')}" for turn in turns)
+
     @staticmethod
     def _ai_to_json(ai: AIMessage):
         try:
@@ -30,191 +197,179 @@ class Nodes:
             print("Error decoding AI response")
             return {}
 
-    def history(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    # history và route chạy song song nên mỗi node chỉ trả về các trường nó cập nhật
+    async def history(self, state: Dict[str, Any]) -> Dict[str, Any]:
         # print("\nHISTORY")
         chat_id = state.get("chat_id")
         if not chat_id:
             error_message = "Chat ID not found in state."
             print(error_message)
-            state["error"] = error_message
-            state["next_state"] = "route"
-            return state
+            return {"error": [error_message]}
 
         try:
-            # Truy xuất lịch sử trò chuyện từ Redis
-            chat_history = self._store.get_history(chat_id)
+            # Bản tóm tắt được cập nhật dần ở background sau mỗi lượt hỏi đáp (xem save_turn), nên luôn kèm
+            # các lượt nó chưa gộp (ít nhất lượt cuối) để câu hỏi nối tiếp ngay sau đó không bị thiếu ngữ cảnh
+            summary, through, total = await self._store.aget_summary(chat_id)
+            if summary:
+                pending = min(max(total - through, 1), self._max_history_length)
+                turns = await self._store.aget_history(chat_id, -pending, -1)
+                return {"chat_history": [summary, *(turns or [])]}
+
+            # Chưa có tóm tắt (cuộc trò chuyện ngắn): dùng trực tiếp các lượt gần nhất
+            chat_history = await self._store.aget_history(chat_id, -self._max_history_length, -1)
 
             # Kiểm tra xem có lịch sử trò chuyện hay không
             if not chat_history:
                 # print("No chat history found")
-                state["chat_history"] = []
-                state["next_state"] = "route"
-                return state
+                return {"chat_history": []}
 
-            # Giới hạn số lượng tin nhắn cần tóm tắt
-            max_history_length = 5
-            if len(chat_history) > max_history_length:
-                chat_history = chat_history[-max_history_length:]
-
-            # Tóm tắt lịch sử trò chuyện chỉ khi cần thiết
-            if len(chat_history) > 2:  # Nếu có đủ lịch sử để tóm tắt
-                summary_instruction = """
-                Tóm tắt lịch sử các câu hỏi và trả lời:
-                {chat_history}
-                """
-                chat_history_summary = self._llm.invoke(
-                    [HumanMessage(content=summary_instruction.format(chat_history=chat_history))])
-
-                # Kiểm tra nếu có lỗi trong quá trình tóm tắt
-                if not chat_history_summary or not hasattr(chat_history_summary, 'content'):
-                    error_message = "Error while summarizing chat history."
-                    print(error_message)
-                    state["error"] = error_message
-                    state["next_state"] = "route"
-                    return state
-
-                chat_history = chat_history_summary.content
-
-            state["chat_history"] = chat_history
-            state["next_state"] = "route"
+            return {"chat_history": chat_history}
 
         except redis.RedisError as redis_error:
             error_message = f"Redis error: {str(redis_error)}"
             print(error_message)
-            state["error"] = error_message
-            state["next_state"] = "route"
+            return {"error": [error_message]}
 
         except Exception as e:
             error_message = f"Unexpected error: {str(e)}"
             print(error_message)
-            state["error"] = error_message
-            state["next_state"] = "route"
-
-        return state
+            return {"error": [error_message]}
 
-    def route(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def route(self, state: Dict[str, Any]) -> Dict[str, Any]:
         # print("\nROUTE")
         question = state.get("question")
 
+        # Bộ phân loại cục bộ đủ tự tin thì không cần gọi LLM
+        if self._router:
+            datasource, confidence = self._router.predict(question)
+            if confidence >= self._config.router_confidence_threshold:
+                metrics.inc("route_decisions_total", datasource=datasource, source="local")
+                return {"next_state": datasource}
+
         try:
             # Gọi LLM để quyết định nguồn dữ liệu
-            decision = self._llm_json_model.invoke(
-                [SystemMessage(content=self._prompt.route_intructions), HumanMessage(content=question)])
+            if state.get("batched"):
+                decision = await self._route_batcher.ainvoke(question)
+            else:
+                decision = await self._llm_json_model("route").ainvoke(
+                    [SystemMessage(content=self._prompt.route_intructions), HumanMessage(content=question)])
 
-            # Giải mã kết quả từ AI
-            decision = self._ai_to_json(decision)
+                # Giải mã kết quả từ AI
+                decision = self._ai_to_json(decision)
 
             # Kiểm tra nguồn dữ liệu và quyết định tiếp theo
             if decision.get("datasource") in ["tools", "web"]:
-                state["next_state"] = decision["datasource"]
-            else:
-                state["next_state"] = "generate"
+                metrics.inc("route_decisions_total", datasource=decision["datasource"], source="llm")
+                return {"next_state": decision["datasource"]}
+            metrics.inc("route_decisions_total", datasource="generate", source="llm")
+            return {"next_state": "generate"}
 
         except KeyError as e:
             # Nếu gặp lỗi KeyError khi truy cập dữ liệu từ decision, in lỗi và lưu vào state
             error_message = f"Error decoding AI response: Missing key {str(e)}"
             print(error_message)
-
-            # Lưu thông tin lỗi vào state
-            if "error" not in state:
-                state["error"] = []  # Nếu chưa có trường "error", tạo mới
-            state["error"].append(error_message)  # Thêm lỗi vào danh sách lỗi
-
-            # Đặt trạng thái tiếp theo là "store" vì có lỗi xảy ra
-            state["next_state"] = "generate"
+            metrics.inc("route_decisions_total", datasource="generate", source="error")
+            return {"next_state": "generate", "error": [error_message]}
 
         except Exception as e:
             # Bắt tất cả các lỗi khác
             error_message = f"Unexpected error: {str(e)}"
             print(error_message)
+            metrics.inc("route_decisions_total", datasource="generate", source="error")
+            return {"next_state": "generate", "error": [error_message]}
 
-            # Lưu thông tin lỗi vào state
-            if "error" not in state:
-                state["error"] = []  # Nếu chưa có trường "error", tạo mới
-            state["error"].append(error_message)  # Thêm lỗi vào danh sách lỗi
-
-            # Đặt trạng thái tiếp theo là "store" vì có lỗi xảy ra
-            state["next_state"] = "generate"
-
-        return state
-
-    def using_tools(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def using_tools(self, state: Dict[str, Any]) -> Dict[str, Any]:
         question = state["question"]
-        response = self._llm_bind_tools.invoke([SystemMessage(content=self._prompt.tool_instructions.format(profile_id=state["profile_id"])), HumanMessage(content=question)])
-        print(response)
+        response = await self._llm_bind_tools.ainvoke([SystemMessage(content=self._prompt.tool_instructions.format(profile_id=state["profile_id"])), HumanMessage(content=question)])
         if response.tool_calls:
-            tool_run = self._tool_node.invoke([response])
-            final_result = self._llm.invoke([HumanMessage(content=self._prompt.tool_prompt.format(question=question, tool_run=tool_run))])
-            print(final_result)
+            tool_run = await self._tool_node.ainvoke([response])
+            final_result = await self._llm("tools").ainvoke([HumanMessage(content=self._prompt.tool_prompt.format(question=question, tool_run=tool_run))], config={"tags": [ANSWER_TAG]})
             state["final_generation"] = final_result.content
-            self._store.save_history(state['chat_id'], question, final_result.content)
+            state["uses_tools"] = True
+            await self.save_turn(state['chat_id'], question, final_result.content)
             state["next_state"] = "useful"
         else:
           state["next_state"] = "not_supported"
         return state
 
-    # def store(self, state: Dict[str, Any]) -> Dict[str, Any]:
-    #     # print("\nSTORE")
-    #     question = state.get("question")
-    #
-    #     try:
-    #         # Gọi retriever để lấy kết quả
-    #         results = self._retriver.invoke(question)
-    #
-    #         # Kiểm tra kết quả trả về
-    #         if not results or len(results) == 0:
-    #             # print("No documents found")
-    #             state["next_state"] = "web"
-    #             state["documents"] = []
-    #         else:
-    #             state["documents"] = results
-    #             state["next_state"] = "grade_docs"
-    #
-    #     except Exception as e:
-    #         # Bắt lỗi nếu có ngoại lệ trong quá trình gọi retriever
-    #         error_message = f"Error during document retrieval: {str(e)}"
-    #         print(error_message)
-    #
-    #         # Lưu thông tin lỗi vào state
-    #         if "error" not in state:
-    #             state["error"] = []  # Nếu chưa có trường "error", tạo mới
-    #         state["error"].append(error_message)  # Thêm lỗi vào danh sách lỗi
-    #
-    #         # Đặt trạng thái tiếp theo là "web" vì có lỗi xảy ra
-    #         state["next_state"] = "web"
-    #         state["documents"] = []  # Không có tài liệu, trả về danh sách trống
-    #
-    #     return state
-
-
-    def grade_docs(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        # print("\nGRADE DOCS")
+    async def store(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Tìm hồ sơ người dùng khớp với câu hỏi trong index vector (nạp bằng ingest_profiles.py)."""
         question = state.get("question")
-        docs = state.get("documents", [])
-        min_relevant_docs = state.get("min_relevant_docs", 1)
-        relevant_docs = 0
-        errors = []  # Danh sách để lưu các lỗi gặp phải
-        doc_relevant = []
-        for index, doc in enumerate(docs):
-            doc = doc.page_content
+        if not self._profile_store_ready:
+            return {"documents": [], "next_state": "web"}
+
+        try:
+            vector_store, embedding = self._store.store, state.get("question_embedding")
+            search = {"k": self._config.profile_store_k, "distance_threshold": self._config.profile_store_max_distance}
+            if embedding is not None:
+                # Dùng lại embedding của semantic cache (cùng model embedding với index hồ sơ)
+                results = await asyncio.to_thread(vector_store.similarity_search_with_score_by_vector, embedding, **search)
+            else:
+                results = await vector_store.asimilarity_search_with_score(question, **search)
+        except Exception as e:
+            # Index chưa có hoặc Redis lỗi: tiếp tục tìm trên web, không ghi vào `error`
+            # vì generate sẽ từ chối trả lời khi state có lỗi
+            print(f"Error during document retrieval: {e}")
+            metrics.inc("profile_store_results_total", result="error")
+            return {"documents": [], "next_state": "web"}
+
+        documents = [result[0] for result in results]
+        metrics.inc("profile_store_results_total", result="hit" if documents else "miss")
+        if not documents:
+            return {"documents": [], "next_state": "web"}
+        return {"documents": documents, "next_state": "grade_docs"}
+
+
+    async def _grade_doc(self, index: int, doc: str, question: str, semaphore: asyncio.Semaphore, batched: bool = False):
+        async with semaphore:
             try:
-                # Gọi API LLM để đánh giá tài liệu
-                grade = self._llm_json_model.invoke([SystemMessage(content=self._prompt.doc_grader_instructions),
-                                    HumanMessage(content=self._prompt.doc_grader_prompt.format(documents=doc, question=question))])
-                # Chuyển đổi kết quả từ AI thành JSON
-                grade = self._ai_to_json(grade)
-                # Kiểm tra sự liên quan của tài liệu
-                if grade.get("relevant").lower() == "yes":
-                    # print(f"Document {index + 1}: Relevant")
-                    doc_relevant.append(doc)
-                    relevant_docs += 1
+                if batched:
+                    grade = await self._doc_grader_batcher.ainvoke((question, doc))
                 else:
-                    pass
-                    # print(f"Document {index + 1}: Not Relevant")
+                    # Gọi API LLM để đánh giá tài liệu
+                    grade = await self._llm_json_model("grade_docs").ainvoke([SystemMessage(content=self._prompt.doc_grader_instructions),
+                                        HumanMessage(content=self._prompt.doc_grader_prompt.format(documents=doc, question=question))])
+                    # Chuyển đổi kết quả từ AI thành JSON
+                    grade = self._ai_to_json(grade)
+                # Kiểm tra sự liên quan của tài liệu
+                return index, grade.get("relevant").lower() == "yes", None
             except Exception as e:
-                error_message = f"Error grading document {index}: {str(e)}"
-                print(error_message)
-                errors.append(error_message)
+                return index, False, f"Error grading document {index}: {str(e)}"
+
+    async def grade_docs(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        # print("\nGRADE DOCS")
+        question = state.get("question")
+        docs = state.get("documents", [])
+        min_relevant_docs = state.get("min_relevant_docs", self._config.min_relevant_docs)
+        early_exit = state.get("grade_docs_early_exit", self._config.grade_docs_early_exit)
+        errors = []  # Danh sách để lưu các lỗi gặp phải
+        relevant_indexes = []
+
+        # Chấm điểm song song, giới hạn số request đồng thời tới LLM
+        semaphore = asyncio.Semaphore(self._config.grade_docs_concurrency)
+        tasks = [asyncio.create_task(self._grade_doc(index, doc.page_content, question, semaphore, state.get("batched", False)))
+                 for index, doc in enumerate(docs)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                index, relevant, error_message = await task
+                if error_message:
+                    print(error_message)
+                    errors.append(error_message)
+                    metrics.inc("grader_verdicts_total", grader="document", verdict="error")
+                    continue
+                metrics.inc("grader_verdicts_total", grader="document", verdict="yes" if relevant else "no")
+                if relevant:
+                    relevant_indexes.append(index)
+                    # Đủ tài liệu phù hợp thì không cần chờ các tài liệu còn lại
+                    if early_exit and len(relevant_indexes) >= min_relevant_docs:
+                        break
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        # Giữ nguyên thứ tự ban đầu của tài liệu
+        doc_relevant = [docs[index].page_content for index in sorted(relevant_indexes)]
+        relevant_docs = len(doc_relevant)
         # Nếu có lỗi xảy ra, lưu vào state
         if errors:
             state["error"] = errors  # Ghi lại tất cả các lỗi vào state để theo dõi
@@ -229,7 +384,7 @@ class Nodes:
             state["next_state"] = "generate"
         return state
 
-    def generate(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def generate(self, state: Dict[str, Any]) -> Dict[str, Any]:
         # print("\nGENERATE")
         try:
             if state.get("error"):
@@ -239,16 +394,16 @@ class Nodes:
                 state["next_state"] = "grade_generation"
                 return state
             question = state["question"]
-            documents = state["documents"]
-            history = state["chat_history"]
+            # Lịch sử và tài liệu được render gọn, bỏ trùng và cắt theo ngân sách token
+            history, documents, _ = self._context.build(question, state["documents"], state["chat_history"])
             prompt = self._prompt.generate_prompt.format(
                 history=history,
                 documents=documents,
                 question=question
             )
-            generation = self._llm.invoke([
+            generation = await self._llm("generate").ainvoke([
                 HumanMessage(content=prompt)
-            ])
+            ], config={"tags": [ANSWER_TAG]})
 
             state["generation"] = generation.content
             state["next_state"] = "grade_generation"
@@ -263,7 +418,77 @@ class Nodes:
             return state
 
 
-    def grade_generation(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def _timed(self, latency: Dict[str, float], name: str, grader):
+        start = time.perf_counter()
+        try:
+            return await grader
+        finally:
+            latency[name] = round(time.perf_counter() - start, 4)
+
+    async def _grade_hallucination(self, documents, generation: str) -> bool:
+        result = await self._llm_json_model("grade_generation").ainvoke([
+            SystemMessage(content=self._prompt.generate_docs_instructions),
+            HumanMessage(content=self._prompt.generate_docs_prompt.format(documents=documents, generation=generation))
+        ])
+        return self._ai_to_json(result)["score"].lower() == "yes"
+
+    async def _grade_answer(self, question: str, generation: str) -> bool:
+        result = await self._llm_json_model("grade_generation").ainvoke([SystemMessage(content=self._prompt.generate_question_instructions),
+            HumanMessage(content=self._prompt.generate_question_prompt.format(question=question, generation=generation))
+        ])
+        return self._ai_to_json(result)["score"].lower() == "yes"
+
+    async def _grade_fused(self, question: str, documents, generation: str):
+        result = await self._llm_json_model("grade_generation").ainvoke([SystemMessage(content=self._prompt.generate_fused_instructions),
+            HumanMessage(content=self._prompt.generate_fused_prompt.format(question=question, documents=documents, generation=generation))
+        ])
+        result = self._ai_to_json(result)
+        return result["grounded"].lower() == "yes", result["answers"].lower() == "yes"
+
+    async def _run_graders(self, question: str, documents, generation: str, is_web_search: bool):
+        """
+        Chạy grader hallucination và grader liên quan theo GRADER_MODE:
+            parallel:   hai grader chạy đồng thời, grader còn lại bị huỷ khi kết quả đã đủ để retry.
+            fused:      một lần gọi LLM trả về cả hai đánh giá.
+            sequential: như trước đây, grader liên quan chỉ chạy khi không có hallucination.
+
+        Returns:
+            (grounded, answers, latency): answers là None nếu grader liên quan bị bỏ qua/huỷ;
+            latency là thời gian (giây) của từng grader.
+        """
+        latency = {}
+        mode = self._config.grader_mode
+
+        if mode == "fused":
+            grounded, answers = await self._timed(latency, "fused", self._grade_fused(question, documents, generation))
+            return grounded, answers, latency
+
+        if mode == "sequential":
+            grounded = await self._timed(latency, "hallucination", self._grade_hallucination(documents, generation))
+            if not grounded:
+                return False, None, latency
+            answers = await self._timed(latency, "answer", self._grade_answer(question, generation))
+            return True, answers, latency
+
+        hallucination = asyncio.create_task(self._timed(latency, "hallucination", self._grade_hallucination(documents, generation)))
+        answer = asyncio.create_task(self._timed(latency, "answer", self._grade_answer(question, generation)))
+        try:
+            done, _ = await asyncio.wait({hallucination, answer}, return_when=asyncio.FIRST_COMPLETED)
+            if hallucination in done and not hallucination.result():
+                return False, None, latency
+            # Ngoài web search, câu trả lời không liên quan luôn dẫn tới "not useful" nên không cần chờ grader kia
+            if answer in done and not answer.result() and not is_web_search:
+                return None, False, latency
+            return await hallucination, await answer, latency
+        finally:
+            for task in (hallucination, answer):
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Cả hai grader cùng lỗi (ví dụ upstream quá tải): lỗi của grader kia đã được raise
+                    task.exception()
+
+    async def grade_generation(self, state: Dict[str, Any]) -> Dict[str, Any]:
         # print("\nĐÁNH GIÁ GENERATION")
         loop_step = state.get("loop_step", 0)
         try:
@@ -277,55 +502,54 @@ class Nodes:
                 return state
 
             # Hàm xử lý retry và lưu lịch sử
-            def handle_retries():
+            async def handle_retries():
                 if loop_step >= 3:
                     print("Đã đạt số lần retry tối đa")
                     state["final_generation"] = generation
-                    self._store.save_history(state['chat_id'], question, generation)
+                    await self.save_turn(state['chat_id'], question, generation)
                     state["next_state"] = "max retries"
                     return True
                 return False
 
             # Kiểm tra lỗi trong generation
             if any(phrase in generation.lower() for phrase in ["xin lỗi", "không có thông tin", "không thể trả lời", "không tìm thấy"]):
-                if handle_retries(): return state
+                if await handle_retries(): return state
                 print("Phát hiện thông điệp lỗi")
+                metrics.inc("graph_retries_total", reason="apology")
                 state["loop_step"] = loop_step + 1
                 state["next_state"] = "not supported"
                 return state
 
 
-            # Đánh giá sự nhất quán với tài liệu (hallucination)
-            hall_result = self._llm_json_model.invoke([
-                 SystemMessage(content=self._prompt.generate_docs_instructions),
-                HumanMessage(content=self._prompt.generate_docs_prompt.format(documents=documents, generation=generation))
-            ])
+            grounded, answers, latency = await self._run_graders(question, documents, generation, is_web_search)
+            state["grader_latency"] = state.get("grader_latency", []) + [latency]
+            for grader, verdict in (("hallucination", grounded), ("answer", answers)):
+                metrics.inc("grader_verdicts_total", grader=grader, verdict={True: "yes", False: "no"}.get(verdict, "skipped"))
 
-            if self._ai_to_json(hall_result)["score"].lower() != "yes":
-                if handle_retries(): return state
+            # Đánh giá sự nhất quán với tài liệu (hallucination)
+            if grounded is False:
+                if await handle_retries(): return state
                 print("Phát hiện hallucination")
+                metrics.inc("graph_retries_total", reason="hallucination")
                 state["next_state"] = "not useful"
                 state["loop_step"] = loop_step + 1
                 return state
 
             # Đánh giá tính liên quan với câu hỏi
-            answer_result = self._llm_json_model.invoke([SystemMessage(content=self._prompt.generate_question_instructions),
-                HumanMessage(content=self._prompt.generate_question_prompt.format(question=question, generation=generation))
-            ])
-
-            if self._ai_to_json(answer_result)["score"].lower() == "yes":
+            if answers:
                 # print("Câu trả lời hợp lệ")
                 state["final_generation"] = generation
-                self._store.save_history(state['chat_id'], question, generation)
+                await self.save_turn(state['chat_id'], question, generation)
                 state["next_state"] = "useful"
                 state["loop_step"] = loop_step + 1
                 return state
 
-            if handle_retries():
+            if await handle_retries():
                 state["loop_step"] = loop_step + 1
                 return state
 
             # print("Câu trả lời không liên quan")
+            metrics.inc("graph_retries_total", reason="irrelevant")
             state["loop_step"] = loop_step + 1
             if is_web_search:
                 state["next_state"] = "not supported"
@@ -336,14 +560,22 @@ class Nodes:
         except Exception as e:
             print(f"Lỗi: {e}")
             state["loop_step"] = loop_step + 1
+            if loop_step >= 3 or isinstance(e, Overloaded):
+                # Không lặp vô hạn khi grader liên tục lỗi, và không thử lại khi upstream đang quá tải
+                # vì mỗi vòng retry lại gửi thêm lời gọi LLM tới đúng upstream đó
+                state["next_state"] = "max retries"
+                if state.get("generation"):
+                    state["final_generation"] = state["generation"]
+                return state
+            metrics.inc("graph_retries_total", reason="error")
             state["next_state"] = "not useful"
             return state
 
-    def web_search(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def web_search(self, state: Dict[str, Any]) -> Dict[str, Any]:
         # print("\nWEB SEARCH")
         try:
             question = state["question"]
-            type_search = self._llm_json_model.invoke([
+            type_search = await self._llm_json_model("web").ainvoke([
                 SystemMessage(content=self._prompt.search_intructions),
                 HumanMessage(content=self._prompt.search_prompt.format(question=question))
             ])
@@ -352,7 +584,7 @@ class Nodes:
                 type_search = "search"
 
             try:
-                search_results = self._websearch.serper_search(question, type_search)
+                search_results = await self._websearch.aserper_search(question, type_search)
             except (json.JSONDecodeError, TypeError):
                 search_results = []
 
@@ -364,6 +596,8 @@ class Nodes:
         except Exception as e:
             print(f"Error in web search: {e}")
             state["is_web_search"] = True
+            # Tài liệu cũ (từ lượt trước của grade_docs) đã là văn bản, không chấm lại được
+            state["documents"] = []
             state["next_state"] = "grade_docs"
             return state
 
@@ -7,6 +7,24 @@ class Prompt:
             {chat_history}
         """
 
+        self.history_summary_prompt = """
+                Tóm tắt lịch sử các câu hỏi và trả lời:
+                {chat_history}
+                """
+
+        self.rolling_summary_prompt = """
+            Bạn đang duy trì bản tóm tắt cuộc trò chuyện giữa người dùng và chatbot của ứng dụng hẹn hò.
+            Hãy cập nhật bản tóm tắt hiện tại với các lượt hỏi đáp mới, giữ lại các ý quan trọng
+            (tên, sở thích, địa điểm, yêu cầu của người dùng) và lược bỏ chi tiết không cần thiết.
+            Chỉ trả về bản tóm tắt mới, ngắn gọn.
+
+            BẢN TÓM TẮT HIỆN TẠI:
+            {summary}
+
+            CÁC LƯỢT HỎI ĐÁP MỚI:
+            {turns}
+        """
+
         self.route_intructions = """
           Bạn là chuyên gia định tuyến câu hỏi cho ứng dụng dating app.
           Hãy xác định nguồn xử lý dựa trên các tiêu chí sau:
@@ -49,6 +67,38 @@ class Prompt:
               "relevant": "yes" | "no",
             }}"""
 
+        # Prompt nhiều mục cho các request của /mobile/chat/batch (LLMBatcher), dùng cùng system prompt
+        # với route_intructions và doc_grader_instructions
+        self.route_batch_prompt = """
+          Định tuyến TỪNG câu hỏi dưới đây một cách độc lập theo các tiêu chí trên.
+
+          {items}
+
+          Trả về JSON với đúng một phần tử cho mỗi câu hỏi, giữ nguyên id:
+          {{
+            "results": [{{"id": 0, "datasource": "web" | "tools"}}]
+          }}
+        """
+
+        self.route_batch_item = """### Mục {id}
+{question}"""
+
+        self.doc_grader_batch_prompt = """
+            Đánh giá TỪNG cặp hồ sơ và câu hỏi dưới đây một cách độc lập, theo yêu cầu:
+            1. Nếu hồ sơ có thông tin liên quan (kể cả một phần) để trả lời câu hỏi của cặp đó -> "yes"
+            2. Nếu hồ sơ không có thông tin hữu ích -> "no"
+
+            {items}
+
+            Trả về JSON với đúng một phần tử cho mỗi cặp, giữ nguyên id:
+            {{
+              "results": [{{"id": 0, "relevant": "yes" | "no"}}]
+            }}"""
+
+        self.doc_grader_batch_item = """### Mục {id}
+CÂU HỎI: {question}
+HỒ SƠ: {documents}"""
+
         self.generate_prompt = """
             Bạn là trợ lý tư vấn cho ứng dụng hẹn hò. Hãy luôn trả lời dựa trên ngữ cảnh, hồ sơ người dùng, và câu hỏi hiện tại, định dạng câu trả lời theo kiểu markdown và luôn trả về câu trả lời bằng Tiếng Việt.
 
@@ -148,9 +198,13 @@ class Prompt:
             Lưu ý chỉ trả về các thông tin cần thiết, không trả về thông tin cá nhân như mật khẩu
         """
 
+        # Trả về khi hết ngân sách thời gian của request mà chưa có bản nháp nào
+        self.deadline_fallback = "Xin lỗi, mình cần thêm thời gian để trả lời câu hỏi này. Bạn thử hỏi lại sau ít phút nhé."
+
         self.tool_prompt = """
         Tạo câu trả lời Markdown từ câu hỏi {question} và dữ liệu API {tool_run}.
         Nếu chứa email, thêm liên kết `mailto:` nếu có thuộc tính `view_profile_link`  [Xem hồ sơ](view_profile_link).
+        Nếu một phần dữ liệu có thuộc tính `error`, vẫn trả lời bằng phần dữ liệu còn lại và nói ngắn gọn phần nào tạm thời chưa lấy được.
         Trả về Markdown cơ bản đừng có viết markdown code block hoặc table gì cả.
         Lưu ý chỉ trả về Markdown đừng chú thích hay thêm gì, không được thêm ```markdown vào câu trả lời."""
 
@@ -194,3 +248,30 @@ class Prompt:
         }}
         """
 
+        self.generate_fused_instructions = """Bạn là chuyên gia đánh giá câu trả lời của chatbot ứng dụng hẹn hò.
+
+        NHIỆM VỤ: Đánh giá đồng thời hai tiêu chí của câu trả lời.
+        1. **grounded**: Câu trả lời khớp chính xác với thông tin gốc, không sai lệch, không thêm thông tin ngoài nguồn.
+        2. **answers**: Câu trả lời trực tiếp, đầy đủ và rõ ràng giải quyết câu hỏi của người dùng.
+
+        CÁCH CHẤM ĐIỂM cho mỗi tiêu chí:
+        - **"yes"**: Đáp ứng tiêu chí.
+        - **"no"**: Không đáp ứng tiêu chí."""
+
+        self.generate_fused_prompt = """
+        ĐÁNH GIÁ CÂU TRẢ LỜI
+
+        THÔNG TIN GỐC:
+        {documents}
+
+        CÂU HỎI: {question}
+
+        CÂU TRẢ LỜI CẦN ĐÁNH GIÁ:
+        {generation}
+
+        Trả về kết quả theo format JSON:
+        {{
+          "grounded": "yes" | "no",
+          "answers": "yes" | "no"
+        }}
+        """
@@ -0,0 +1,52 @@
+import threading
+import time
+from typing import Any, Callable, Dict
+
+
+class Registry:
+    """
+    Registry dùng chung trong process: mỗi client/connection pool chỉ được tạo một lần,
+    vào lần đầu tiên được dùng, và được chia sẻ giữa các node, tool và endpoint.
+
+        store = registry.get("redis_store", RedisStore)
+    """
+
+    def __init__(self):
+        self._instances: Dict[str, Any] = {}
+        self._build_seconds: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self.ready = False
+        self.warm_seconds = None
+
+    def get(self, name: str, factory: Callable[[], Any]) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._instances:
+                start = time.perf_counter()
+                self._instances[name] = factory()
+                self._build_seconds[name] = time.perf_counter() - start
+            return self._instances[name]
+
+    def override(self, name: str, instance: Any) -> None:
+        """Thay một client bằng instance có sẵn (ví dụ client giả lập khi benchmark)."""
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self) -> None:
+        with self._lock:
+            self._instances.clear()
+            self._build_seconds.clear()
+            self.ready = False
+            self.warm_seconds = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "warm_seconds": self.warm_seconds,
+            "clients": {name: round(seconds, 4) for name, seconds in self._build_seconds.items()},
+        }
+
+
+registry = Registry()
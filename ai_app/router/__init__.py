@@ -0,0 +1,123 @@
+from dotenv import load_dotenv
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Tuple
+load_dotenv()
+
+SEED_PATH = os.path.join(os.path.dirname(__file__), "seed.json")
+# Câu hỏi viết lại, không có trong seed.json: chỉ dùng để đánh giá (benchmarks/eval_router.py)
+HOLDOUT_PATH = os.path.join(os.path.dirname(__file__), "holdout.json")
+
+
+class LocalRouter:
+    """
+    Bộ phân loại Naive Bayes chạy trong process để chọn nguồn xử lý "tools" | "web".
+
+    Được huấn luyện từ bộ câu hỏi mẫu đi kèm (seed.json) và, nếu có, file JSON Lines
+    các câu hỏi đã gán nhãn trong ROUTER_TRAINING_FILE (mỗi dòng {"text": ..., "label": ...}).
+
+    Xác suất hậu nghiệm của Naive Bayes quá tự tin (các token được xem là độc lập, unigram và bigram
+    cùng được đếm) nên được hiệu chỉnh bằng `temperature` (chia log-odds trước khi tính xác suất,
+    fit bằng eval_router.py --fit). Câu hỏi có ít hơn `min_coverage` số từ nằm trong từ vựng đã học
+    nhận độ tin cậy 0, tức luôn được chuyển cho LLM.
+    """
+
+    def __init__(self, examples: Iterable[Dict[str, str]] = None, temperature: float = 1.0,
+                 min_coverage: float = 0.0):
+        if examples is None:
+            examples = self.load_examples()
+        self._temperature = temperature
+        self._min_coverage = min_coverage
+        self._class_counts = Counter()
+        self._token_counts = defaultdict(Counter)
+        self._vocabulary = set()
+        self.fit(examples)
+
+    @staticmethod
+    def load_examples() -> List[Dict[str, str]]:
+        with open(SEED_PATH, encoding="utf-8") as f:
+            examples = json.load(f)
+
+        training_file = os.getenv("ROUTER_TRAINING_FILE")
+        if training_file and os.path.exists(training_file):
+            with open(training_file, encoding="utf-8") as f:
+                examples.extend(json.loads(line) for line in f if line.strip())
+        return examples
+
+    @staticmethod
+    def _tokenize(text: str) -> List[str]:
+        # Bỏ dấu để câu gõ không dấu vẫn khớp với câu có dấu
+        text = text.lower().replace("đ", "d")
+        text = "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+        words = re.findall(r"\w+", text)
+        return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+    def fit(self, examples: Iterable[Dict[str, str]]) -> None:
+        for example in examples:
+            label = example["label"]
+            tokens = self._tokenize(example["text"])
+            self._class_counts[label] += 1
+            self._token_counts[label].update(tokens)
+            self._vocabulary.update(tokens)
+        self._totals = {label: sum(counts.values()) for label, counts in self._token_counts.items()}
+
+    def log_odds(self, question: str) -> Tuple[str, float, float]:
+        """
+        Returns:
+            (datasource, margin, coverage): nhãn có điểm cao nhất, chênh lệch log-xác suất với nhãn
+            đứng sau (chưa hiệu chỉnh) và tỉ lệ từ của câu hỏi nằm trong từ vựng đã học.
+        """
+        all_tokens = self._tokenize(question)
+        words = [token for token in all_tokens if "_" not in token]
+        coverage = sum(1 for word in words if word in self._vocabulary) / (len(words) or 1)
+        tokens = [token for token in all_tokens if token in self._vocabulary]
+        total_examples = sum(self._class_counts.values())
+        vocabulary_size = len(self._vocabulary)
+
+        scores = {}
+        for label, count in self._class_counts.items():
+            score = math.log(count / total_examples)
+            denominator = self._totals[label] + vocabulary_size
+            for token in tokens:
+                score += math.log((self._token_counts[label][token] + 1) / denominator)
+            scores[label] = score
+
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        margin = scores[ranked[0]] - scores[ranked[1]] if len(ranked) > 1 else math.inf
+        return ranked[0], margin, coverage
+
+    def predict(self, question: str) -> Tuple[str, float]:
+        """
+        Returns:
+            (datasource, confidence): nhãn có xác suất cao nhất và xác suất hậu nghiệm đã hiệu chỉnh
+            của nó; 0 nếu câu hỏi có quá ít từ đã biết.
+        """
+        best, margin, coverage = self.log_odds(question)
+        if coverage < self._min_coverage:
+            return best, 0.0
+        return best, 1.0 / (1.0 + math.exp(-margin / self._temperature))
+
+
+# Dấu hiệu câu hỏi nối tiếp, chỉ hiểu được khi biết các lượt trước: mở đầu bằng từ nối
+# ("còn ... thì sao?") hoặc nhắc lại thứ đã nói bằng đại từ/chỉ định từ ("quán đó", "người ấy")
+_FOLLOWUP_START = re.compile(r"^(còn|con|và|va|vậy|vay|thế còn|the con|thế thì|nếu vậy|neu vay|rồi sao|tiếp|tiep)\b")
+_FOLLOWUP_WORDS = re.compile(
+    r"\b(đó|ấy|kia|nữa|nua|nó|họ|vừa rồi|vua roi|lúc nãy|luc nay|ở trên|o tren|trước đó|truoc do"
+    r"|cái này|người này|quán này|chỗ này|câu trên|như vậy|như thế)\b")
+# Câu quá ngắn ("tại sao?", "chi tiết hơn") luôn dựa vào ngữ cảnh
+_FOLLOWUP_MIN_WORDS = 3
+
+
+def is_followup(question: str) -> bool:
+    """
+    Câu hỏi có phụ thuộc vào các lượt trước của cuộc trò chuyện hay không. Câu trả lời cho câu hỏi
+    nối tiếp chỉ đúng trong cuộc trò chuyện đó nên không được tra hoặc lưu vào semantic cache.
+    """
+    text = " ".join(re.findall(r"\w+", question.lower()))
+    if len(text.split()) < _FOLLOWUP_MIN_WORDS:
+        return True
+    return bool(_FOLLOWUP_START.search(text) or _FOLLOWUP_WORDS.search(text))
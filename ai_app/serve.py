@@ -0,0 +1,41 @@
+"""
+Chạy app với nhiều worker (process) trên cùng một cổng.
+
+    python serve.py --port 8000 --workers 4
+    SERVE_WORKERS=4 python serve.py
+
+Process cha bind socket một lần rồi khởi động các worker (uvicorn, multiprocessing spawn). Mỗi worker
+import `main` (compile StateGraph), rồi trong lifespan warm-up các client: Redis, index vector,
+Supabase, model của mọi node và một lời gọi LLM nhỏ (WARM_LLM), tối đa WARM_TIMEOUT giây. Worker chỉ
+nhận request trên socket dùng chung sau khi warm-up xong. Worker chết được uvicorn khởi động lại;
+SIGHUP khởi động lại lần lượt toàn bộ worker.
+
+Mỗi worker có registry, cache trong process và connection pool riêng; chat lock, kết quả của request
+trùng và semantic cache dùng chung qua Redis. /health, /ready và /metrics trả về số liệu của worker
+nhận request đó (pid trong header X-Worker-Id).
+"""
+import argparse
+import os
+import uvicorn
+from config import Config
+
+
+def main(args):
+    # Worker được spawn kế thừa biến môi trường của process cha
+    os.environ["WARM_BEFORE_SERVE"] = "true"
+    workers = args.workers or Config().serve_workers or os.cpu_count() or 1
+    print(f"Serving {args.app} on {args.host}:{args.port} with {workers} workers")
+    uvicorn.run(args.app, host=args.host, port=args.port, workers=workers, log_level=args.log_level,
+                timeout_graceful_shutdown=args.graceful_timeout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the app with preforked, pre-warmed workers")
+    parser.add_argument("--app", default="main:app", help="ASGI app as module:attribute")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=0, help="0 = SERVE_WORKERS, or the CPU count")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="Seconds to let in-flight requests finish on shutdown")
+    main(parser.parse_args())
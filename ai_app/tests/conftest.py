@@ -0,0 +1,55 @@
+"""
+Cấu hình chung cho test: mọi client ngoài (LLM, Redis, Supabase, Serper) được thay bằng bản giả lập
+trong benchmarks.fakes, không cần mạng hay API key thật.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:1")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test.service.role")
+os.environ.setdefault("SERPER_URL", "http://localhost:1")
+
+from benchmarks.fakes import FakeRedisStore, override_models
+from registry import registry
+
+
+class FakeSemanticCache:
+    """SemanticCache trong bộ nhớ: câu hỏi trùng khớp (không phân biệt hoa thường) là cache hit."""
+
+    def __init__(self):
+        self.entries = {}
+        self.lookups = []
+
+    async def alookup(self, question, profile_id):
+        self.lookups.append(question)
+        key = question.strip().lower()
+        for scope in ("global", f"profile:{profile_id}"):
+            if (scope, key) in self.entries:
+                return self.entries[(scope, key)], [1.0, 0.0]
+        return None, [1.0, 0.0]
+
+    async def asave(self, question, answer, embedding, scope):
+        self.entries[(scope, question.strip().lower())] = answer
+
+
+@pytest.fixture
+def store():
+    registry.reset()
+    store = FakeRedisStore(latency=0)
+    registry.override("redis_store", store)
+    override_models(registry, latency=0, verdicts={"datasource": "web"})
+    yield store
+    registry.reset()
+
+
+@pytest.fixture
+def cache(store):
+    cache = FakeSemanticCache()
+    registry.override("semantic_cache", cache)
+    return cache
@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import Limiter, Overloaded
+from config import Config
+from coordinator import ChatCoordinator
+
+
+async def test_chat_lock_wait_stops_at_deadline():
+    coordinator = ChatCoordinator(config=Config())
+    entered = asyncio.Event()
+
+    async def previous_turn():
+        async with coordinator.serialize("chat:me"):
+            entered.set()
+            await asyncio.sleep(2)
+
+    task = asyncio.create_task(previous_turn())
+    await entered.wait()
+    start = time.perf_counter()
+    async with coordinator.serialize("chat:me", deadline=time.time() + 0.2):
+        waited = time.perf_counter() - start
+    task.cancel()
+    assert 0.15 < waited < 1
+
+
+async def test_admission_queue_wait_stops_at_deadline():
+    limiter = Limiter("chat", concurrency=1, max_queue=10, queue_timeout=5)
+    await limiter.acquire()
+    start = time.perf_counter()
+    with pytest.raises(Overloaded):
+        await limiter.acquire(deadline=time.time() + 0.2)
+    assert time.perf_counter() - start < 1
+    with pytest.raises(Overloaded):
+        await limiter.acquire(deadline=time.time() - 1)
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeRedisStore, override_models
+from registry import registry
+from workflow import Flow
+
+
+class LoopBoundStore(FakeRedisStore):
+    """Giống client redis.asyncio/httpx: chỉ dùng được trên event loop đầu tiên đã dùng nó."""
+
+    loop = None
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.loop = loop
+        elif loop is not self.loop:
+            raise RuntimeError("Event loop is closed")
+
+    async def aget_history(self, *args, **kwargs):
+        self._check_loop()
+        return await super().aget_history(*args, **kwargs)
+
+    async def asave_history(self, *args, **kwargs):
+        self._check_loop()
+        return await super().asave_history(*args, **kwargs)
+
+
+@pytest.fixture
+def loop_bound_store():
+    registry.reset()
+    store = LoopBoundStore(latency=0)
+    registry.override("redis_store", store)
+    # Route thẳng tới generate để không cần Serper/Supabase
+    override_models(registry, latency=0, verdicts={"datasource": "generate"})
+    yield store
+    registry.reset()
+
+
+def test_run_twice_reuses_clients_and_keeps_background_tasks(loop_bound_store):
+    flow = Flow()
+    flow._cache_enabled = False
+    questions = ["Quán cà phê nào đẹp ở Đà Lạt?", "Phim nào hay tuần này?", "Gợi ý món ăn tối cho hai người"]
+    for question in questions:
+        result = flow.run(question, "me", "me")
+        assert not result.get("error"), result.get("error")
+
+    assert [turn["question"] for turn in loop_bound_store._histories["chat:me"]] == questions
+    # Bản tóm tắt được cập nhật bởi task background, task đó không bị huỷ khi run trả về
+    deadline = time.time() + 5
+    while "chat:me" not in loop_bound_store._summaries and time.time() < deadline:
+        time.sleep(0.01)
+    assert "chat:me" in loop_bound_store._summaries
@@ -0,0 +1,23 @@
+from config import Config
+from models import HedgeBudget
+
+
+def test_hedge_rate_stays_under_cap_from_cold_start(monkeypatch):
+    monkeypatch.setenv("HEDGE_MAX_RATE", "0.1")
+    monkeypatch.setenv("HEDGE_WINDOW", "200")
+    budget = HedgeBudget(Config())
+    history = []
+    for _ in range(500):
+        # Mọi lời gọi đều chậm: hedge bất cứ khi nào budget cho phép
+        history.append(budget.allow())
+        if not history[-1]:
+            budget.record(False)
+        window = history[-200:]
+        assert sum(window) <= max(0.1 * len(window), 1)
+    assert sum(history[-200:]) >= 0.1 * 200 - 1
+
+
+def test_concurrent_hedges_see_each_other():
+    budget = HedgeBudget(Config())
+    # Các lời gọi đồng thời cùng hỏi trước khi lời gọi nào kết thúc
+    assert [budget.allow() for _ in range(20)].count(True) == 1
@@ -0,0 +1,22 @@
+import json
+
+from router import HOLDOUT_PATH, LocalRouter
+
+
+def test_unknown_words_defer_to_llm():
+    router = LocalRouter(min_coverage=0.5)
+    datasource, confidence = router.predict("Zodiac Gemini compatibility horoscope")
+    assert confidence == 0.0
+
+
+def test_temperature_softens_confidence():
+    question = "Cách xin số điện thoại của người mình thích"
+    _, raw = LocalRouter().predict(question)
+    _, calibrated = LocalRouter(temperature=1.9).predict(question)
+    assert calibrated < raw
+
+
+def test_holdout_is_disjoint_from_seed():
+    with open(HOLDOUT_PATH, encoding="utf-8") as f:
+        held_out = {example["text"] for example in json.load(f)}
+    assert not held_out & {example["text"] for example in LocalRouter.load_examples()}
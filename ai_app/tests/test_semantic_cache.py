@@ -0,0 +1,38 @@
+from router import is_followup
+from workflow import Flow
+
+
+def test_followup_questions_are_detected():
+    assert is_followup("Còn quán nào khác không?")
+    assert is_followup("Người đó bao nhiêu tuổi?")
+    assert is_followup("Tại sao?")
+    assert not is_followup("Quán cà phê nào đẹp ở Đà Lạt?")
+    assert not is_followup("Thời tiết Hà Nội cuối tuần này thế nào?")
+
+
+async def test_cache_hit_on_chat_with_history(store, cache):
+    await store.asave_history("chat:me", "Xin chào", "Chào bạn!")
+    cache.entries[("global", "quán cà phê nào đẹp ở đà lạt?")] = "Quán Mê Linh."
+
+    result = await Flow().arun("Quán cà phê nào đẹp ở Đà Lạt?", "me", "me")
+
+    assert result["next_state"] == "cached"
+    assert result["final_generation"] == "Quán Mê Linh."
+    assert (await store.aget_history("chat:me"))[-1]["answer"] == "Quán Mê Linh."
+
+
+async def test_followup_skips_cache(store, cache):
+    await store.asave_history("chat:me", "Quán cà phê nào đẹp ở Đà Lạt?", "Quán Mê Linh.")
+    cache.entries[("global", "còn quán nào khác không?")] = "Câu trả lời của người khác."
+
+    result = await Flow().arun("Còn quán nào khác không?", "me", "me")
+
+    assert result["next_state"] != "cached"
+    assert cache.lookups == []
+
+
+async def test_tools_answers_are_not_saved(store, cache):
+    flow = Flow()
+    result = {"next_state": "useful", "final_generation": "Bạn có 3 người bạn.", "uses_tools": True}
+    await flow._cache_save("Lấy danh sách bạn bè của tôi", "me", [1.0, 0.0], result)
+    assert cache.entries == {}
@@ -3,16 +3,157 @@ from dotenv import load_dotenv
 import os
 from langchain.schema.document import Document
 import json
-import requests
+import asyncio
+import hashlib
+import random
+import time
+from collections import OrderedDict
+import httpx
 from langchain_core.tools import tool
 from langgraph.prebuilt import ToolNode
-from models import ChatGPT
+from models import ModelPolicy
+from admission import limiter
 from database import SupabaseStore
+from config import Config
+from registry import registry
+from metrics import metrics
 from langchain.schema.messages import HumanMessage
 load_dotenv()
+class TTLCache:
+    """LRU cache trong process, mỗi entry hết hạn sau `ttl` giây."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        self._data[key] = (time.monotonic() + self._ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+
 class WebSearch:
-    def __init__(self):
-        self._serper_api_key = os.getenv("SERPER_API_KEY")
+    """
+    Client Serper dùng chung connection pool, có timeout, retry với backoff và cache kết quả.
+    Mỗi lần gửi bất đồng bộ giữ một slot của limiter `serper` (UPSTREAM_CONCURRENCY).
+
+    Kết quả được cache theo (câu truy vấn đã chuẩn hoá, hl, gl, loại tìm kiếm) trong process
+    và, nếu truyền `redis` (client redis.asyncio), thêm một tầng cache Redis dùng chung giữa các worker
+    cho `aserper_search`.
+    """
+    _RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, redis=None):
+        config = Config()
+        self._serper_api_key = os.getenv("SERPER_API_KEY", "")
+        self._url = config.serper_url
+        self._hl = "vi"
+        self._gl = "vn"
+        timeout = httpx.Timeout(config.serper_read_timeout, connect=config.serper_connect_timeout)
+        limits = httpx.Limits(max_connections=config.serper_max_connections, max_keepalive_connections=config.serper_max_connections)
+        self._client = httpx.AsyncClient(timeout=timeout, limits=limits)
+        self._sync_client = httpx.Client(timeout=timeout, limits=limits)
+        self._max_retries = config.serper_max_retries
+        self._backoff = config.serper_backoff
+        self._cache_ttl = config.serper_cache_ttl
+        self._cache = TTLCache(config.serper_cache_size, config.serper_cache_ttl)
+        self._redis = redis
+
+    def _request(self, query: str):
+        payload = json.dumps({
+            "q": query,
+            "hl": self._hl,
+            "gl": self._gl,
+        })
+        headers = {
+            'X-API-KEY': self._serper_api_key,
+            'Content-Type': 'application/json'
+        }
+        return headers, payload
+
+    def _cache_key(self, query: str, type_search: str) -> str:
+        normalized = " ".join(query.lower().split())
+        raw = json.dumps([normalized, self._hl, self._gl, type_search.lower()], ensure_ascii=False)
+        return f"serper:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+    def _backoff_delay(self, attempt: int) -> float:
+        return self._backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    def _post(self, url: str, headers: dict, payload: str):
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                metrics.inc("upstream_retries_total", upstream="serper")
+            try:
+                with metrics.timer("upstream_request_duration_seconds", errors="upstream_errors_total", upstream="serper", operation="search"):
+                    response = self._sync_client.post(url, headers=headers, content=payload)
+                if response.status_code not in self._RETRY_STATUS or attempt == self._max_retries:
+                    return response
+            except httpx.TransportError:
+                if attempt == self._max_retries:
+                    raise
+            time.sleep(self._backoff_delay(attempt))
+
+    async def _apost(self, url: str, headers: dict, payload: str):
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                metrics.inc("upstream_retries_total", upstream="serper")
+            try:
+                async with limiter("serper").slot():
+                    with metrics.timer("upstream_request_duration_seconds", errors="upstream_errors_total", upstream="serper", operation="search"):
+                        response = await self._client.post(url, headers=headers, content=payload)
+                if response.status_code not in self._RETRY_STATUS or attempt == self._max_retries:
+                    return response
+            except httpx.TransportError:
+                if attempt == self._max_retries:
+                    raise
+            await asyncio.sleep(self._backoff_delay(attempt))
+
+    @staticmethod
+    def _to_documents(response: dict, type_search: str):
+        documents = []
+
+        if type_search.lower() == "maps":
+            for item in response.get("places", []):
+                # Nội dung đầy đủ hơn bao gồm thông tin đánh giá, link nếu có
+                content = (
+                    f"Tên địa điểm: {item['title']}\n"
+                    f"Địa chỉ: {item['address']}\n"
+                    f"Giờ làm việc: {item.get('openingHours', 'Không có thông tin giờ mở cửa')}\n"
+                    f"Đánh giá: {item.get('rating', 'Không có đánh giá')} sao\n"
+                    f"Số đánh giá: {item.get('reviewCount', 'Không rõ')}\n"
+                    f"Link: {item.get('link', 'Không có đường dẫn')}."
+                )
+                metadata = {
+                }
+                documents.append(Document(page_content=content, metadata=metadata))
+        else:
+            answer = response.get("answerBox", {})
+            if answer:
+                # Nội dung chi tiết cho kết quả tìm kiếm
+                content = (
+                    f"Câu trả lời: {answer.get('snippet', 'Không có câu trả lời')}\n"
+                    f"Tiêu đề: {answer.get('title', 'Không có tiêu đề')}\n"
+                    f"Link: {answer.get('link', 'Không có đường dẫn')}\n"
+                    f"Snippet nổi bật: {answer.get('snippetHighlighted', 'Không có thông tin')}"
+                )
+                metadata = {
+                }
+                documents.append(Document(page_content=content, metadata=metadata))
+
+        return documents
 
     def serper_search(self, query: str, type_search: str):
         """
@@ -25,51 +166,62 @@ class WebSearch:
         Returns:
             list[Document]: Danh sách tài liệu kết quả tìm kiếm.
         """
-        url = f"https://google.serper.dev/{type_search}"
-        payload = json.dumps({
-            "q": query,
-            "hl": "vi",
-            "gl": "vn",
-        })
-        headers = {
-            'X-API-KEY': self._serper_api_key,
-            'Content-Type': 'application/json'
-        }
-        response = requests.request("POST", url, headers=headers, data=payload)
+        key = self._cache_key(query, type_search)
+        cached = self._cache.get(key)
+        metrics.inc("upstream_cache_total", upstream="serper", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return self._to_documents(cached, type_search)
+
+        url = f"{self._url}/{type_search}"
+        headers, payload = self._request(query)
+        response = self._post(url, headers, payload)
 
         if response.status_code == 200:
-            response = response.json()
-            documents = []
-
-            if type_search.lower() == "maps":
-                for item in response.get("places", []):
-                    # Nội dung đầy đủ hơn bao gồm thông tin đánh giá, link nếu có
-                    content = (
-                        f"Tên địa điểm: {item['title']}\n"
-                        f"Địa chỉ: {item['address']}\n"
-                        f"Giờ làm việc: {item.get('openingHours', 'Không có thông tin giờ mở cửa')}\n"
-                        f"Đánh giá: {item.get('rating', 'Không có đánh giá')} sao\n"
-                        f"Số đánh giá: {item.get('reviewCount', 'Không rõ')}\n"
-                        f"Link: {item.get('link', 'Không có đường dẫn')}."
-                    )
-                    metadata = {
-                    }
-                    documents.append(Document(page_content=content, metadata=metadata))
-            else:
-                answer = response.get("answerBox", {})
-                if answer:
-                    # Nội dung chi tiết cho kết quả tìm kiếm
-                    content = (
-                        f"Câu trả lời: {answer.get('snippet', 'Không có câu trả lời')}\n"
-                        f"Tiêu đề: {answer.get('title', 'Không có tiêu đề')}\n"
-                        f"Link: {answer.get('link', 'Không có đường dẫn')}\n"
-                        f"Snippet nổi bật: {answer.get('snippetHighlighted', 'Không có thông tin')}"
-                    )
-                    metadata = {
-                    }
-                    documents.append(Document(page_content=content, metadata=metadata))
-
-            return documents
+            result = response.json()
+            self._cache.set(key, result)
+            return self._to_documents(result, type_search)
+        else:
+            return []
+
+    async def aserper_search(self, query: str, type_search: str):
+        """
+        Phiên bản bất đồng bộ của `serper_search`, dùng httpx để không chặn event loop
+        và thêm tầng cache Redis nếu có.
+
+        Args:
+            query (str): Câu truy vấn tìm kiếm.
+            type_search (str): Loại tìm kiếm ("maps" hoặc "search").
+
+        Returns:
+            list[Document]: Danh sách tài liệu kết quả tìm kiếm.
+        """
+        key = self._cache_key(query, type_search)
+        cached = self._cache.get(key)
+        if cached is None and self._redis is not None:
+            try:
+                raw = await self._redis.get(key)
+                if raw:
+                    cached = json.loads(raw)
+                    self._cache.set(key, cached)
+            except Exception as e:
+                print(f"Serper cache error: {e}")
+        metrics.inc("upstream_cache_total", upstream="serper", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return self._to_documents(cached, type_search)
+
+        url = f"{self._url}/{type_search}"
+        headers, payload = self._request(query)
+        response = await self._apost(url, headers, payload)
+
+        if response.status_code == 200:
+            result = response.json()
+            self._cache.set(key, result)
+            if self._redis is not None:
+                try:
+                    await self._redis.set(key, json.dumps(result, ensure_ascii=False), ex=self._cache_ttl)
+                except Exception as e:
+                    print(f"Serper cache error: {e}")
+            return self._to_documents(result, type_search)
         else:
             return []
 
@@ -79,20 +231,30 @@ class WebSearch:
 
 class Chat:
     def __init__(self):
-        self._client = SupabaseStore().get_client()
+        self._supabase = registry.get("supabase_store", SupabaseStore)
+        config = Config()
+        self._in_chunk_size = config.supabase_in_chunk_size
+        self._tool_timeout = config.tool_timeout
+        self._tool_timeouts = config.tool_timeouts
 
         @tool
-        def get_user_info(profile_id: str):
+        async def get_user_info(profile_id: str):
             """Xem thông tin người dùng."""
-            return self._client.table("profiles").select("*").eq("id", profile_id).execute()
+            async def query():
+                client = await self._supabase.aget_client()
+                response = await client.table("profiles").select("*").eq("id", profile_id).execute()
+                return response.data
+
+            return await self._with_timeout("get_user_info", query)
 
         @tool
-        def get_friends(profile_id: str):
+        async def get_friends(profile_id: str):
             """Lấy thông tin chi tiết bạn bè."""
-            try:
+            async def query():
+                client = await self._supabase.aget_client()
                 # Truy vấn danh sách bạn bè từ bảng 'friends'
-                friends_response = self._client.table("friends").select("friends").eq("profile_id",
-                                                                                      profile_id).single().execute()
+                friends_response = await client.table("friends").select("friends").eq("profile_id",
+                                                                                     profile_id).single().execute()
 
                 friends = friends_response.data.get("friends", [])
 
@@ -100,65 +262,92 @@ class Chat:
                 if not friends:
                     return []
 
-                # Khởi tạo danh sách thông tin bạn bè
-                friend_info_list = []
+                # Lấy thông tin tất cả bạn bè từ bảng 'profiles' theo từng nhóm id
+                return await self._aget_profiles(friends)
 
-                # Lặp qua danh sách bạn bè và truy vấn thông tin từ bảng 'profiles'
-                for friend_id in friends:
-                    profile_response = self._client.table("profiles").select(
-                        "id, full_name, avatar, age, gender, email").eq("id", friend_id).single().execute()
-
-                    friend_info = profile_response.data
-                    if friend_info:
-                        friend_info['view_profile_link'] = f"nonegroup.io://profile/{friend_info['id']}?goBack=/chat"
-                        friend_info_list.append(friend_info)
-
-                return friend_info_list  # Trả về danh sách thông tin bạn bè
-
-            except Exception as e:
-                return {
-                    "error": str(e)
-                }
+            return await self._with_timeout("get_friends", query)
 
         @tool
-        def get_friend_request(profile_id: str):
+        async def get_friend_request(profile_id: str):
             """Lấy thông tin yêu cầu kết bạn và trả về kèm link của từng bạn bè."""
-            try:
+            async def query():
+                client = await self._supabase.aget_client()
                 # Truy vấn danh sách yêu cầu kết bạn từ bảng 'friend_request'
-                friends_response = self._client.table("friend_request").select("sender_id").eq("receiver_id",
-                                                                                               profile_id).execute()
+                friends_response = await client.table("friend_request").select("sender_id").eq("receiver_id",
+                                                                                              profile_id).execute()
 
                 if not friends_response.data or len(friends_response.data) == 0:
                     return []
 
-                friend_info_list = []
-                # Lặp qua danh sách yêu cầu kết bạn và truy vấn thông tin từ bảng 'profiles'
-                for dict_request in friends_response.data:
-                    profile_response = self._client.table("profiles").select(
-                        "id, full_name, avatar, age, gender, email").eq("id", dict_request.get(
-                        "sender_id")).single().execute()
+                # Lấy thông tin tất cả người gửi từ bảng 'profiles' theo từng nhóm id
+                sender_ids = [dict_request.get("sender_id") for dict_request in friends_response.data]
+                return await self._aget_profiles(sender_ids)
 
-                    friend_info = profile_response.data
-                    if friend_info:
-                        # Tạo URL với friend id
-                        friend_info['view_profile_link'] = f"nonegroup.io://profile/{friend_info['id']}?goBack=/chat"  # Thêm tham số goBack vào URL
-                        friend_info_list.append(friend_info)
-
-                return friend_info_list  # Trả về danh sách thông tin bạn bè, mỗi bạn bè có kèm link
-
-            except Exception as e:
-                return {
-                    "error": str(e)
-                }
+            return await self._with_timeout("get_friend_request", query)
 
         self._tools = [get_user_info, get_friends, get_friend_request]
+        # ToolNode chạy các tool call của cùng một message đồng thời (asyncio.gather)
         self._tool_node = ToolNode(self._tools)
 
 
-        self._model = ChatGPT()
-        self._llm = self._model.llm()
+        # Gọi tool dùng model của node tools (tier strong mặc định)
+        self._llm = ModelPolicy().llm("tools")
         self._llm_binds_tools = self._llm.bind_tools(self._tools)
 
+    async def _with_timeout(self, name: str, query):
+        """
+        Chạy truy vấn `query()` của một tool với timeout riêng (tính cả thời gian chờ slot của limiter
+        `supabase`). Khi quá hạn hoặc lỗi, trả về {"error": ...} thay vì raise để các tool khác trong
+        cùng lượt vẫn trả kết quả (kết quả một phần).
+        """
+        timeout = self._tool_timeouts.get(name, self._tool_timeout)
+
+        async def limited():
+            async with limiter("supabase").slot():
+                return await query()
+
+        try:
+            with metrics.timer("upstream_request_duration_seconds", errors="upstream_errors_total", upstream="supabase", operation=name):
+                return await asyncio.wait_for(limited(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Tool {name} timed out after {timeout}s")
+            return {
+                "error": f"{name} không phản hồi sau {timeout:g}s, dữ liệu tạm thời không có"
+            }
+        except Exception as e:
+            return {
+                "error": str(e)
+            }
+
+    async def _aget_profiles(self, profile_ids):
+        """
+        Lấy thông tin các profile bằng truy vấn `in`, chia thành từng nhóm để URL không quá dài
+        và gửi các nhóm đồng thời. Kết quả giữ đúng thứ tự của profile_ids và kèm `view_profile_link`.
+        """
+        client = await self._supabase.aget_client()
+        unique_ids = list(dict.fromkeys(profile_ids))
+        chunks = [unique_ids[start:start + self._in_chunk_size] for start in range(0, len(unique_ids), self._in_chunk_size)]
+        responses = await asyncio.gather(*(
+            client.table("profiles").select("id, full_name, avatar, age, gender, email").in_("id", chunk).execute()
+            for chunk in chunks
+        ))
+        profiles = {}
+        for profile_response in responses:
+            for profile in profile_response.data:
+                profiles[profile["id"]] = profile
+
+        friend_info_list = []
+        for profile_id in profile_ids:
+            friend_info = profiles.get(profile_id)
+            if friend_info:
+                # Tạo URL với friend id, thêm tham số goBack vào URL
+                friend_info = {**friend_info, "view_profile_link": f"nonegroup.io://profile/{friend_info['id']}?goBack=/chat"}
+                friend_info_list.append(friend_info)
+        return friend_info_list
+
+    def get_tools(self):
+        return self._tools
+
     def get_llm_binds_tools(self):
         return self._llm_binds_tools
 
@@ -1,6 +1,33 @@
-from typing import TypedDict, List, Any
-from langgraph.graph import StateGraph, END
-from nodes import Nodes
+import asyncio
+import functools
+import operator
+import threading
+import time
+from typing import TypedDict, List, Any, AsyncIterator, Dict, Annotated, Optional
+from langgraph.graph import StateGraph, START, END
+from nodes import Nodes, ANSWER_TAG
+from database import SemanticCache
+from coordinator import ChatCoordinator
+from checkpoint import RedisCheckpointer
+from admission import limiter
+from router import is_followup
+from config import Config
+from registry import registry
+from metrics import metrics, llm_metrics
+
+
+def merge_errors(left: Any, right: Any) -> List[Any]:
+    """Reducer cho `error`: gộp lỗi từ các node, kể cả các node chạy song song, bỏ qua lỗi trùng."""
+    def as_list(value):
+        if not value:
+            return []
+        return list(value) if isinstance(value, list) else [value]
+
+    merged = as_list(left)
+    merged += [error for error in as_list(right) if error not in merged]
+    return merged
+
+
 class State(TypedDict):
     chat_id: str
     question: str
@@ -8,53 +35,141 @@ class State(TypedDict):
     documents: List[Any]
     generation: Any
     final_generation: str
-    error: List[Any]
+    error: Annotated[List[Any], merge_errors]
     next_state: str
     loop_step: int
     is_web_search: bool
+    # Embedding của câu hỏi do semantic cache tính, node store dùng lại thay vì embedding lần nữa
+    question_embedding: Optional[List[float]]
+    # Câu trả lời dựa trên dữ liệu trực tiếp của app (tools), không được cache
+    uses_tools: bool
     profile_id: str
+    grader_latency: List[Any]
+    # Thời điểm (epoch giây) request phải có câu trả lời, 0 là không giới hạn
+    deadline: float
+    # history và route chạy song song có thể cùng đánh dấu hết hạn nên dùng reducer or
+    deadline_exceeded: Annotated[bool, operator.or_]
+    # Request thuộc /mobile/chat/batch: route và chấm tài liệu đi qua LLMBatcher
+    batched: bool
+
+def _instrument(name: str, node, remaining):
+    """
+    Ghi thời gian chạy và số lần lỗi của một node vào metrics, và huỷ node khi hết ngân sách
+    thời gian của request (`remaining(state)` giây), đánh dấu `deadline_exceeded` để các cạnh
+    điều kiện chuyển sang node deadline_answer.
+    """
+    @metrics.timed("graph_node_duration_seconds", errors="graph_node_errors_total", node=name)
+    @functools.wraps(node)
+    async def guarded(state):
+        try:
+            return await asyncio.wait_for(node(state), remaining(state))
+        except asyncio.TimeoutError:
+            metrics.inc("deadline_exceeded_total", node=name)
+            return {"deadline_exceeded": True}
+    return guarded
+
+
+_sync_loop = None
+_sync_loop_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    # Flow.run dùng một event loop duy nhất chạy suốt đời process trong thread riêng: các client async
+    # trong registry (httpx, redis.asyncio, supabase) gắn với loop đầu tiên dùng chúng, và các task
+    # background (cập nhật tóm tắt) phải sống tiếp sau khi run trả về
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="flow-sync-loop", daemon=True).start()
+            _sync_loop = loop
+    return _sync_loop
+
+
+def _unless_expired(edge, mapping: Dict[str, Any], expired):
+    """Cạnh điều kiện chuyển sang node deadline_answer khi hết thời gian, trừ khi graph đã sắp kết thúc."""
+    def route(state):
+        target = edge(state)
+        if mapping.get(target) != END and expired(state):
+            return "deadline"
+        return target
+    return route
+
 
 class Flow:
     def __init__(self):
         nodes = Nodes()
+        self._nodes = nodes
+        config = Config()
+        self._cache_enabled = config.semantic_cache_enabled
+        self._request_budget = config.request_budget
+        self._coordination_enabled = config.chat_coordination_enabled
+        self._coordinator_instance = None
+        self._checkpoint_enabled = config.checkpoint_enabled
+        self._checkpoint_graph_instance = None
+        self._batch_concurrency = max(1, config.batch_concurrency)
         workflow = StateGraph(State)
-        workflow.add_node("history", nodes.history)
-        workflow.add_node("route", nodes.route)
-        workflow.add_node("tools", nodes.using_tools)
-        # workflow.add_node("store", nodes.store)
-        workflow.add_node("grade_docs", nodes.grade_docs)
-        workflow.add_node("generate", nodes.generate)
-        workflow.add_node("grade_generation", nodes.grade_generation)
-        workflow.set_entry_point("history")
-        workflow.add_node("web", nodes.web_search)
+        workflow.add_node("history", _instrument("history", nodes.history, nodes.remaining))
+        workflow.add_node("route", _instrument("route", nodes.route, nodes.remaining))
+        workflow.add_node("tools", _instrument("tools", nodes.using_tools, nodes.remaining))
+        if config.profile_store_enabled:
+            # Hồ sơ trong index vector được thử trước, không khớp thì tìm trên web
+            workflow.add_node("store", _instrument("store", nodes.store, nodes.remaining))
+        workflow.add_node("grade_docs", _instrument("grade_docs", nodes.grade_docs, nodes.remaining))
+        workflow.add_node("generate", _instrument("generate", nodes.generate, nodes.remaining))
+        workflow.add_node("grade_generation", _instrument("grade_generation", nodes.grade_generation, nodes.remaining))
+        workflow.add_node("web", _instrument("web", nodes.web_search, nodes.remaining))
+        # Hết ngân sách thời gian: trả về bản nháp tốt nhất hoặc câu trả lời dự phòng
+        workflow.add_node("deadline_answer", nodes.deadline_answer)
+        workflow.add_edge("deadline_answer", END)
+        # Điểm hợp nhất của history và route, không thay đổi state
+        workflow.add_node("join", lambda x: None)
         # Kết nối các node với nhau
-        workflow.add_edge("history", "route")
+        if config.graph_parallel_entry:
+            # route chỉ dùng question nên chạy song song với việc tải lịch sử
+            workflow.add_edge(START, "history")
+            workflow.add_edge(START, "route")
+            workflow.add_edge(["history", "route"], "join")
+        else:
+            workflow.set_entry_point("history")
+            workflow.add_edge("history", "route")
+            workflow.add_edge("route", "join")
         # Thêm các điều kiện chuyển tiếp
-        workflow.add_conditional_edges(
-            "route",
-            lambda x: x["next_state"],
+        # Mọi cạnh điều kiện đều kiểm tra deadline của request trước khi đi tiếp
+        def add_conditional_edges(source: str, mapping: Dict[str, Any]):
+            route = _unless_expired(lambda x: x["next_state"], mapping, nodes.expired)
+            workflow.add_conditional_edges(source, route, {**mapping, "deadline": "deadline_answer"})
+
+        add_conditional_edges(
+            "join",
             {
                 "tools": "tools",
-                "web": "web",
-                # "tool": "generate"
+                "web": "store" if config.profile_store_enabled else "web",
+                "generate": "generate"
             }
         )
+        if config.profile_store_enabled:
+            add_conditional_edges(
+                "store",
+                {
+                    "grade_docs": "grade_docs",
+                    "web": "web"
+                }
+            )
         workflow.add_edge(
             "web",
             "grade_docs"
         )
-        workflow.add_conditional_edges(
+        add_conditional_edges(
             "tools",
-            lambda x: x["next_state"],
             {
                 "useful": END,
                 "not_supported": "web",
             }
         )
 
-        workflow.add_conditional_edges(
+        add_conditional_edges(
             "grade_docs",
-            lambda x: x["next_state"],
             {
                 "generate": "generate",
                 "web": "web"
@@ -63,9 +178,8 @@ class Flow:
 
         workflow.add_edge("generate", "grade_generation")
 
-        workflow.add_conditional_edges(
+        add_conditional_edges(
             "grade_generation",
-            lambda x: x["next_state"],
             {
                 "useful": END,
                 "not useful": "web",
@@ -73,15 +187,66 @@ class Flow:
                 "max retries": END
             }
         )
+        self._workflow = workflow
         self._graph = workflow.compile()
+        self._node_names = set(workflow.nodes)
+        # Callback ghi độ trễ, token và chi phí của mọi lần gọi LLM trong graph
+        self._run_config = {"callbacks": [llm_metrics]}
+
+
+    @property
+    def _store(self):
+        return self._nodes.get_store()
+
+    @property
+    def _cache(self):
+        if not self._cache_enabled:
+            return None
+        return registry.get("semantic_cache", lambda: SemanticCache(self._store))
 
+    @property
+    def _coordinator(self):
+        # Mỗi Flow (mỗi worker) có bảng request đang chạy riêng, dùng chung Redis với các worker khác
+        if not self._coordination_enabled:
+            return None
+        if self._coordinator_instance is None:
+            self._coordinator_instance = ChatCoordinator(getattr(self._store, "aredis", None))
+        return self._coordinator_instance
+
+    @property
+    def _checkpoint_graph(self):
+        # Graph có checkpointer bắt buộc mọi lần chạy phải có thread_id nên được compile riêng,
+        # chỉ dùng cho request có request_id
+        if self._checkpoint_graph_instance is None:
+            checkpointer = registry.get("redis_checkpointer", lambda: RedisCheckpointer(self._store.aredis))
+            self._checkpoint_graph_instance = self._workflow.compile(checkpointer=checkpointer)
+        return self._checkpoint_graph_instance
+
+    async def warm(self) -> None:
+        """Khởi tạo các client dùng chung và đánh dấu process sẵn sàng nhận request."""
+        start = time.perf_counter()
+        await self._nodes.warm()
+        _ = self._cache
+        registry.warm_seconds = round(time.perf_counter() - start, 4)
+        registry.ready = True
 
     def get_graph(self):
         return self._graph.get_graph().draw_mermaid()
 
 
-    def run(self, question: str, chat_id: str, profile_id: str):
-        initial_state: State = {
+    def deadline(self, budget: float = None) -> float:
+        """
+        Hạn chót (epoch giây) của một request bắt đầu lúc này với ngân sách `budget` giây (mặc định
+        REQUEST_BUDGET), 0 là không giới hạn. Được tính một lần khi request tới endpoint (main.py) để
+        thời gian chờ lượt trước của chat và chờ admission control cũng nằm trong ngân sách.
+        """
+        if budget is None:
+            budget = self._request_budget
+        return time.time() + budget if budget else 0
+
+    def _initial_state(self, question: str, chat_id: str, profile_id: str, deadline: float = 0,
+                       batched: bool = False) -> State:
+        return {
             "chat_id": f"chat:{chat_id}",  # Trống hoặc một giá trị mặc định
             "question": question,  # Trống hoặc câu hỏi mặc định
             "chat_history": "",  # Trống hoặc lịch sử chat mặc định
@@ -92,6 +257,261 @@ class Flow:
             "next_state": "history",  # Trạng thái ban đầu, có thể thay đổi tùy theo yêu cầu
             "loop_step": 0,  # Số lần retry ban đầu
             "is_web_search": False,  # Trạng thái web search
-            "profile_id": profile_id
+            "question_embedding": None,
+            "uses_tools": False,
+            "profile_id": profile_id,
+            "grader_latency": [],  # Thời gian của từng grader trong mỗi lần grade_generation
+            "deadline": deadline,  # Hạn chót của request
+            "deadline_exceeded": False,
+            "batched": batched
         }
-        return self._graph.invoke(initial_state)
+
+    async def _cache_lookup(self, question: str, chat_id: str, profile_id: str):
+        if not self._cache:
+            return None, None
+        try:
+            # Câu hỏi nối tiếp ("còn quán nào khác không?") phụ thuộc vào các lượt trước:
+            # không tra cache và không lưu (embedding None)
+            if is_followup(question):
+                return None, None
+            answer, embedding = await self._cache.alookup(question, profile_id)
+            if answer is not None:
+                await self._nodes.save_turn(f"chat:{chat_id}", question, answer)
+            return answer, embedding
+        except Exception as e:
+            print(f"Semantic cache error: {e}")
+            return None, None
+
+    async def _cache_save(self, question: str, profile_id: str, embedding, result: Dict[str, Any]) -> None:
+        if embedding is None or result.get("error") or result.get("next_state") != "useful":
+            return
+        if not result.get("final_generation"):
+            return
+        # Câu trả lời từ tools là dữ liệu trực tiếp (danh sách bạn bè, lịch hẹn...): không cache
+        if result.get("uses_tools"):
+            return
+        # Câu trả lời từ web được dùng chung giữa các người dùng, các câu trả lời khác chỉ cache
+        # trong phạm vi profile_id
+        if result.get("is_web_search"):
+            scope = SemanticCache.GLOBAL_SCOPE
+        else:
+            scope = SemanticCache.profile_scope(profile_id)
+        try:
+            await self._cache.asave(question, result["final_generation"], embedding, scope)
+        except Exception as e:
+            print(f"Semantic cache error: {e}")
+
+    async def _checkpoint(self, chat_id: str, request_id: str, deadline: float = 0):
+        """
+        Chọn graph và config cho một lần chạy. Với request_id (CHECKPOINT_ENABLED), graph được
+        checkpoint trong Redis theo thread `chat:{chat_id}:{request_id}` và trả về thêm trạng thái
+        của checkpoint đã có:
+            None        chưa có checkpoint, chạy từ đầu,
+            "resumed"   request trước bị ngắt giữa chừng, chạy tiếp từ node đã xong gần nhất,
+            "finished"  graph đã chạy xong, kèm state cuối cùng.
+
+        Returns:
+            (graph, run_config, status, values)
+        """
+        if not (request_id and self._checkpoint_enabled):
+            return self._graph, self._run_config, None, None
+        graph = self._checkpoint_graph
+        run_config = {**self._run_config, "configurable": {"thread_id": f"chat:{chat_id}:{request_id}"}}
+        try:
+            snapshot = await graph.aget_state(run_config)
+            # Chưa có checkpoint, hoặc request trước bị ngắt trước khi node đầu tiên chạy xong
+            if not snapshot.values or snapshot.metadata.get("step", -1) < 0:
+                return graph, run_config, None, None
+            if not snapshot.next:
+                metrics.inc("graph_resumes_total", result="finished")
+                return graph, run_config, "finished", snapshot.values
+            await self._refresh_deadline(graph.checkpointer, run_config, deadline)
+            metrics.inc("graph_resumes_total", result="resumed")
+            return graph, run_config, "resumed", None
+        except Exception as e:
+            print(f"Checkpoint error: {e}")
+            return self._graph, self._run_config, None, None
+
+    async def _refresh_deadline(self, checkpointer, run_config, deadline: float = 0) -> None:
+        """
+        Dùng hạn chót của request thử lại (tính từ lúc nó tới), bằng cách ghi đè `deadline` trong
+        checkpoint mới nhất (giữ nguyên id). Không dùng update_state vì nó tạo checkpoint mới như thể
+        một node vừa chạy, làm mất write của các node đã xong trong bước đang dở (history/route).
+        """
+        saved = await checkpointer.aget_tuple(run_config)
+        checkpoint = {**saved.checkpoint,
+                      "channel_values": {**saved.checkpoint["channel_values"], "deadline": deadline}}
+        parent_id = saved.parent_config["configurable"]["checkpoint_id"] if saved.parent_config else None
+        await checkpointer.aput({"configurable": {**saved.config["configurable"], "checkpoint_id": parent_id}},
+                                checkpoint, saved.metadata, {})
+
+    async def cache_stats(self) -> Dict[str, Any]:
+        if not self._cache:
+            return {"enabled": False}
+        return {"enabled": True, **await self._cache.astats()}
+
+    async def arun(self, question: str, chat_id: str, profile_id: str, budget: float = None, request_id: str = None,
+                   batched: bool = False, deadline: float = None):
+        """
+        Request giống hệt một request đang chạy (hoặc vừa xong) của cùng chat dùng chung kết quả,
+        các lượt khác nhau của một chat chạy lần lượt (xem ChatCoordinator).
+
+        Args:
+            budget: ngân sách thời gian (giây) của request, mặc định REQUEST_BUDGET; 0 là không giới hạn.
+            deadline: hạn chót đã tính sẵn (`deadline()`, lúc request tới endpoint), thay cho `budget`.
+                Thời gian chờ lượt trước của chat và chờ slot của admission control bị giới hạn bởi nó.
+            request_id: id do client gửi, giữ nguyên khi thử lại. Với CHECKPOINT_ENABLED, request thử lại
+                chạy tiếp từ checkpoint của lần trước hoặc nhận lại kết quả đã có.
+            batched: gộp lời gọi route và chấm tài liệu với các request đang chạy khác (xem abatch).
+
+        Mỗi lần chạy graph giữ một slot của limiter `chat` (ADMISSION_*); khi hàng chờ đầy hoặc chờ quá
+        ADMISSION_QUEUE_TIMEOUT giây thì raise Overloaded (429 ở main.py). Request trùng dùng chung kết quả
+        và lượt đang chờ lượt trước của cùng chat không giữ slot.
+        """
+        if deadline is None:
+            deadline = self.deadline(budget)
+        if not self._coordinator:
+            return await self._arun(question, chat_id, profile_id, deadline, request_id, batched)
+        return await self._coordinator.run(chat_id, question, profile_id,
+                                           lambda: self._arun(question, chat_id, profile_id, deadline, request_id, batched),
+                                           deadline)
+
+    async def abatch(self, requests: List[Dict[str, Any]], budget: float = None, deadline: float = None) -> List[Any]:
+        """
+        Chạy nhiều request (dict có question, chat_id, profile_id và request_id tuỳ chọn), tối đa
+        BATCH_CONCURRENCY graph cùng lúc. Lời gọi route và chấm tài liệu của các graph đang chạy được
+        gộp thành các lời gọi LLM nhiều mục (LLMBatcher).
+
+        Returns:
+            Kết quả theo đúng thứ tự của `requests`; request lỗi (kể cả Overloaded) có exception thay cho kết quả.
+        """
+        semaphore = asyncio.Semaphore(self._batch_concurrency)
+        # Mọi request của lô dùng chung hạn chót của lô, kể cả khi phải chờ BATCH_CONCURRENCY
+        if deadline is None:
+            deadline = self.deadline(budget)
+
+        async def run(request: Dict[str, Any]):
+            async with semaphore:
+                return await self.arun(request["question"], request["chat_id"], request["profile_id"],
+                                       request_id=request.get("request_id"), batched=True, deadline=deadline)
+
+        return await asyncio.gather(*(run(request) for request in requests), return_exceptions=True)
+
+    async def _arun(self, question: str, chat_id: str, profile_id: str, deadline: float = 0, request_id: str = None,
+                    batched: bool = False):
+        async with limiter("chat").slot(deadline):
+            return await self._arun_admitted(question, chat_id, profile_id, deadline, request_id, batched)
+
+    async def _arun_admitted(self, question: str, chat_id: str, profile_id: str, deadline: float = 0,
+                             request_id: str = None, batched: bool = False):
+        graph, run_config, status, values = await self._checkpoint(chat_id, request_id, deadline)
+        if status == "finished":
+            return values
+        if status == "resumed":
+            return await graph.ainvoke(None, config=run_config)
+
+        initial_state = self._initial_state(question, chat_id, profile_id, deadline, batched)
+        cached, embedding = await self._cache_lookup(question, chat_id, profile_id)
+        if cached is not None:
+            return {**initial_state, "final_generation": cached, "next_state": "cached"}
+        initial_state["question_embedding"] = embedding
+
+        result = await graph.ainvoke(initial_state, config=run_config)
+        await self._cache_save(question, profile_id, embedding, result)
+        return result
+
+    async def astream(self, question: str, chat_id: str, profile_id: str, budget: float = None,
+                      request_id: str = None, deadline: float = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Chạy graph và trả về dần các sự kiện cho client.
+
+        Các sự kiện:
+            node:    {"node": tên node} khi một node bắt đầu chạy.
+            token:   {"text": đoạn văn bản} token của câu trả lời nháp từ generate hoặc using_tools.
+            retract: {"reason": next_state} grade_generation từ chối bản nháp, client cần xoá
+                     các token đã nhận; graph sẽ tiếp tục và có thể stream một bản nháp mới.
+            final:   {"result": ..., "error": ...} kết quả cuối cùng, giống /mobile/chat.
+
+        Khi hết ngân sách thời gian, bản nháp đã stream được giữ làm câu trả lời nếu nó đã
+        hoàn chỉnh; nếu không, client nhận retract với reason "deadline" rồi tới final.
+
+        Với request_id như arun: stream thử lại chạy tiếp từ checkpoint (chỉ các node còn lại phát
+        sự kiện) hoặc chỉ nhận final nếu graph đã chạy xong.
+
+        Admission control như arun: Overloaded được raise trước sự kiện đầu tiên.
+        """
+        if deadline is None:
+            deadline = self.deadline(budget)
+        # Stream không gộp được với request khác nhưng vẫn xếp hàng theo chat
+        if not self._coordinator:
+            async for event in self._astream(question, chat_id, profile_id, deadline, request_id):
+                yield event
+            return
+        async with self._coordinator.serialize(chat_id, deadline):
+            async for event in self._astream(question, chat_id, profile_id, deadline, request_id):
+                yield event
+
+    async def _astream(self, question: str, chat_id: str, profile_id: str, deadline: float = 0,
+                       request_id: str = None) -> AsyncIterator[Dict[str, Any]]:
+        async with limiter("chat").slot(deadline):
+            async for event in self._astream_admitted(question, chat_id, profile_id, deadline, request_id):
+                yield event
+
+    async def _astream_admitted(self, question: str, chat_id: str, profile_id: str, deadline: float = 0,
+                                request_id: str = None) -> AsyncIterator[Dict[str, Any]]:
+        graph, run_config, status, values = await self._checkpoint(chat_id, request_id, deadline)
+        if status == "finished":
+            yield {"event": "final", "data": {"result": values.get("final_generation", ""), "error": values.get("error", None)}}
+            return
+
+        graph_input, embedding = None, None
+        if status is None:
+            graph_input = self._initial_state(question, chat_id, profile_id, deadline)
+            cached, embedding = await self._cache_lookup(question, chat_id, profile_id)
+            if cached is not None:
+                yield {"event": "final", "data": {"result": cached, "error": []}}
+                return
+            graph_input["question_embedding"] = embedding
+
+        draft_streamed = False
+        async for event in graph.astream_events(graph_input, config=run_config, version="v2"):
+            kind = event["event"]
+            name = event["name"]
+            node = event.get("metadata", {}).get("langgraph_node")
+
+            if kind == "on_chain_start" and name in self._node_names and node == name:
+                yield {"event": "node", "data": {"node": name}}
+
+            elif kind == "on_chat_model_stream" and ANSWER_TAG in event.get("tags", []):
+                text = event["data"]["chunk"].content
+                if text:
+                    draft_streamed = True
+                    yield {"event": "token", "data": {"text": text}}
+
+            elif kind == "on_chain_end" and name == "grade_generation" and node == name:
+                output = event["data"]["output"]
+                # Hết thời gian khi đang chấm: bản nháp vừa stream sẽ là câu trả lời
+                if draft_streamed and not output.get("deadline_exceeded") and output.get("next_state") not in ("useful", "max retries"):
+                    yield {"event": "retract", "data": {"reason": output.get("next_state")}}
+                draft_streamed = False
+
+            elif kind == "on_chain_end" and name == "deadline_answer" and node == name:
+                # Bản nháp bị cắt giữa chừng (generate hoặc tools hết thời gian)
+                if draft_streamed:
+                    yield {"event": "retract", "data": {"reason": "deadline"}}
+                draft_streamed = False
+
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                result = event["data"]["output"]
+                await self._cache_save(question, profile_id, embedding, result)
+                yield {"event": "final", "data": {
+                    "result": result.get("final_generation", ""),
+                    "error": result.get("error", None)
+                }}
+
+    def run(self, question: str, chat_id: str, profile_id: str, budget: float = None, request_id: str = None):
+        # Các node đều là coroutine nên bản đồng bộ chỉ bọc lại arun, luôn trên cùng một event loop
+        # (không dùng asyncio.run: mỗi lần gọi tạo rồi đóng một loop mới)
+        future = asyncio.run_coroutine_threadsafe(self.arun(question, chat_id, profile_id, budget, request_id),
+                                                  _background_loop())
+        return future.result()